@@ -0,0 +1,96 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import time
+from multiprocessing.connection import Client
+
+from utils.log import log
+from utils.codec import useCodec, encodeMessage
+from config.env import supervisor as supervisorEnv
+from config.workerConfig import SupervisorConfig, allConfigs
+from supervisor import Supervisor
+from utils.startup import useStartMethod
+
+#########
+# Runs workers on another host. Each worker process connects to the
+# supervisor over TCP (SUPERVISOR_REMOTE_ADDRESS, authenticated with
+# SUPERVISOR_REMOTE_AUTHKEY), registers its worker type and is routed to
+# like a local replica. The agent restarts the ones that exit.
+#
+#   python src/agent.py --supervisor 10.0.0.5:9200 --workers CRAGWorker=2 LogicalFallacyPromptWorker=1
+#########
+
+def _remote_runner(worker_name: str, address: tuple, authkey: bytes, config: dict):
+    useCodec(SupervisorConfig.get("codec", "json"))
+    conn = Client(address, authkey=authkey)
+    conn.send_bytes(encodeMessage({
+        "messageId": "register",
+        "status": "register",
+        "reason": "",
+        "destination": ["supervisor"],
+        "data": {"worker": worker_name, "host": socket.gethostname(), "pid": os.getpid()},
+    }))
+    Supervisor._worker_runner(worker_name, conn, {**config, "remote": True})
+
+
+class Agent:
+    def __init__(self, address: tuple, authkey: bytes, workers: dict, restart_delay: float = 5):
+        self.address = address
+        self.authkey = authkey
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self._processes: list = []
+
+    def start(self):
+        for worker_name, count in self.workers.items():
+            for _ in range(count):
+                self._processes.append([worker_name, self._spawn(worker_name)])
+
+    def _spawn(self, worker_name: str) -> multiprocessing.Process:
+        p = multiprocessing.Process(
+            target=_remote_runner,
+            args=(worker_name, self.address, self.authkey, allConfigs.get(worker_name, {})),
+            daemon=False,
+        )
+        p.start()
+        log(f"{worker_name} started on pid {p.pid}", "success")
+        return p
+
+    def watch(self):
+        while True:
+            time.sleep(self.restart_delay)
+            for entry in self._processes:
+                worker_name, process = entry
+                if not process.is_alive():
+                    log(f"{worker_name} ({process.pid}) exited with {process.exitcode}, restarting it", "warn")
+                    entry[1] = self._spawn(worker_name)
+
+    def stop(self):
+        for _, process in self._processes:
+            process.terminate()
+
+
+def _parseWorkers(specs: list) -> dict:
+    workers = {}
+    for spec in specs:
+        name, _, count = spec.partition('=')
+        workers[name] = int(count or 1)
+    return workers
+
+
+if __name__ == '__main__':
+    useStartMethod(SupervisorConfig.get("start_method", "spawn"), SupervisorConfig.get("preload"))
+    parser = argparse.ArgumentParser(description="Run workers for a supervisor on another host")
+    parser.add_argument("--supervisor", default=supervisorEnv['remote_address'], help="host:port of the supervisor")
+    parser.add_argument("--workers", nargs="+", required=True, help="WorkerName[=replicas] ...")
+    args = parser.parse_args()
+
+    host, port = args.supervisor.rsplit(':', 1)
+    agent = Agent((host, int(port)), supervisorEnv['remote_authkey'].encode(), _parseWorkers(args.workers))
+    agent.start()
+    try:
+        agent.watch()
+    except KeyboardInterrupt:
+        log("Shutting down agent", "info")
+        agent.stop()
@@ -0,0 +1,113 @@
+"""
+Throughput and size of one worker -> supervisor -> worker hop.
+
+"legacy" is the path before utils/codec.py: json.dumps in the worker,
+pickled by Connection.send, json.loads in the supervisor, the dict pickled
+again towards the destination. The codec paths send tagged frames with
+send_bytes; the supervisor decodes the frame to route it and forwards
+the same bytes.
+
+    python src/benchmarks/bench_codec.py --tweets 500 --messages 200
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.reduction import ForkingPickler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.codec import CODECS, isAvailable, useCodec, encodeMessage, decodeMessage
+
+
+def makeMessage(tweets: int) -> dict:
+    # shaped like DatabaseInteractionWorker.getTweets output
+    return {
+        "messageId": "bench",
+        "status": "completed",
+        "reason": "",
+        "destination": ["VectorWorker/createVector/project", "PromptRecommendationWorker/onTweetComing/project"],
+        "data": [
+            {
+                "_id": f"{i:024x}",
+                "projectId": "project",
+                "full_text": f"tweet {i} tentang kebijakan publik dan tanggapan warganet " * 3,
+                "username": f"user{i}",
+                "created_at": "2025-01-01T00:00:00",
+                "favorite_count": i % 100,
+                "retweet_count": i % 10,
+                "lang": "in",
+            }
+            for i in range(tweets)
+        ],
+    }
+
+
+def produce(conn, codec: str, message: dict, messages: int):
+    if codec == "legacy":
+        for _ in range(messages):
+            conn.send(json.dumps(message))
+    else:
+        useCodec(codec)
+        for _ in range(messages):
+            conn.send_bytes(encodeMessage(message))
+
+
+def relay(inbound, outbound, codec: str, messages: int):
+    for _ in range(messages):
+        if codec == "legacy":
+            outbound.send(json.loads(inbound.recv()))
+        else:
+            frame = inbound.recv_bytes()
+            decodeMessage(frame)
+            outbound.send_bytes(frame)
+
+
+def bench(codec: str, message: dict, messages: int) -> float:
+    worker_out, supervisor_in = multiprocessing.Pipe()
+    supervisor_out, worker_in = multiprocessing.Pipe()
+    processes = [
+        multiprocessing.Process(target=produce, args=(worker_out, codec, message, messages), daemon=True),
+        multiprocessing.Process(target=relay, args=(supervisor_in, supervisor_out, codec, messages), daemon=True),
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    for _ in range(messages):
+        if codec == "legacy":
+            worker_in.recv()
+        else:
+            decodeMessage(worker_in.recv_bytes())
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    return elapsed
+
+
+def bytesPerHop(codec: str, message: dict) -> float:
+    if codec == "legacy":
+        # worker -> supervisor carries the json string, supervisor -> worker the dict
+        return (len(ForkingPickler.dumps(json.dumps(message))) + len(ForkingPickler.dumps(message))) / 2
+    useCodec(codec)
+    return len(encodeMessage(message))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tweets", type=int, default=500, help="tweets in the payload")
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    message = makeMessage(args.tweets)
+    for codec in ["legacy", *CODECS]:
+        if codec != "legacy" and not isAvailable(codec):
+            print(f"{codec:<8} not installed, skipped")
+            continue
+        elapsed = bench(codec, message, args.messages)
+        print(f"{codec:<8} {args.messages / elapsed:10.1f} msgs/s   {bytesPerHop(codec, message) / 1024:10.1f} KiB/hop")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Retrieval evaluation of one chat in CRAGWorker.grade_documents, or with
+--stage refinement the 256-token strips of CRAGWorker.knowledge_refinement,
+graded one after the other, --concurrency at once, or several per request
+(grading_mode "batched"). The web results of the refinement repeat each
+other the way near-identical search hits do, --duplicates of them.
+
+The graders are the real grade_prompt and batch_grade_prompt piped into a
+stub LLM that sleeps --latency seconds plus up to --jitter, and
+--per-document seconds for each classification it writes. It answers
+Benar, Salah or Ambigu depending on the document alone, like an Azure call
+whose answer does not depend on when or with whom it was asked. Every run
+must give the same documents, grades and updateProgress payload, in the
+same order.
+
+    python src/benchmarks/bench_document_grading.py --documents 10 --latency 0.8
+    python src/benchmarks/bench_document_grading.py --stage refinement --documents 5
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from prompt.RetrievalEvaluator import grade_prompt, GradeDocuments, batch_grade_prompt, GradeDocumentsBatch, DocumentGrade
+from workers.CRAGWorker import CRAGWorker
+
+GRADES = ["Benar", "Salah", "Ambigu"]
+
+
+def gradeOf(text: str) -> str:
+    return GRADES[sum(map(ord, text)) % len(GRADES)]
+
+
+class StubLLM:
+    def __init__(self, texts: list, latency: float, jitter: float, per_document: float):
+        self.texts, self.latency, self.jitter, self.per_document = texts, latency, jitter, per_document
+        self.requests = 0
+
+    def _answer(self, prompt) -> list:
+        self.requests += 1
+        text = prompt.to_string()
+        # the documents of the request, in the order they were numbered
+        found = sorted((text.index(document), document) for document in self.texts if document in text)
+        time.sleep(self.latency + random.uniform(0, self.jitter) + self.per_document * len(found))
+        return [gradeOf(document) for _, document in found]
+
+    def single(self, prompt):
+        return GradeDocuments(final_classification=self._answer(prompt)[0])
+
+    def batched(self, prompt):
+        return GradeDocumentsBatch(classifications=[
+            DocumentGrade(index=i, final_classification=grade) for i, grade in enumerate(self._answer(prompt), 1)
+        ])
+
+
+def gradeOnce(stage: str, mode: str, concurrency: int, documents: list, llm: StubLLM, splitter) -> tuple:
+    worker = CRAGWorker.__new__(CRAGWorker)
+    worker.retrieval_grader = grade_prompt | RunnableLambda(llm.single)
+    worker.batch_grader = batch_grade_prompt | RunnableLambda(llm.batched)
+    worker.grading_mode, worker.grading_concurrency = mode, concurrency
+    worker.text_splitter = splitter
+    sent = []
+    worker.sendToOtherWorker = lambda **kwargs: sent.append(kwargs)
+    state = {"question": "apakah kebijakan subsidi energi efektif?", "documents": documents, "chat_id": "bench", "key_word": "subsidi energi"}
+    started = time.perf_counter()
+    if stage == "refinement":
+        result = worker.knowledge_refinement(state)
+    else:
+        result = worker.grade_documents(state)
+    progress = [message["data"] for message in sent]
+    for data in progress:
+        # timings differ from run to run, the rest must not
+        if isinstance(data["output"], dict):
+            data["output"].pop("Timing", None)
+    return time.perf_counter() - started, result, progress
+
+
+def webResults(count: int, duplicates: int) -> list:
+    """count results of about a thousand tokens, the last duplicates of them repeating earlier ones."""
+    results = []
+    for i in range(count):
+        source = i if i < count - duplicates else i % max(count - duplicates, 1)
+        paragraphs = [
+            f"Laporan {source} bagian {j}: anggaran subsidi energi tahun {2015 + source} mencapai {source * 7 + j} triliun rupiah, "
+            f"sebagian besar untuk BBM dan listrik rumah tangga di provinsi ke-{j}. " * 3
+            for j in range(12)
+        ]
+        results.append(Document(page_content="\n\n".join(paragraphs)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stage", choices=["grading", "refinement"], default="grading")
+    parser.add_argument("--documents", type=int, default=10, help="retrieved documents or web results per chat")
+    parser.add_argument("--duplicates", type=int, default=2, help="web results of the refinement repeating another one")
+    parser.add_argument("--latency", type=float, default=0.8, help="seconds of one grading request")
+    parser.add_argument("--jitter", type=float, default=0.4, help="extra seconds of a request, drawn uniformly")
+    parser.add_argument("--per-document", type=float, default=0.05, help="seconds the answer of each document adds to a request")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--chats", type=int, default=5)
+    args = parser.parse_args()
+
+    splitter = None
+    if args.stage == "refinement":
+        splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=256, chunk_overlap=0)
+        documents = webResults(args.documents, args.duplicates)
+        texts = list({d.page_content: None for d in splitter.split_documents(documents)})
+        print(f"{len(texts)} distinct strips of {len(splitter.split_documents(documents))}")
+    else:
+        documents = [
+            Document(page_content=f"Dokumen {i}: pemerintah menyalurkan subsidi energi sebesar {i * 7} triliun rupiah pada tahun {2015 + i}.")
+            for i in range(args.documents)
+        ]
+        texts = [d.page_content for d in documents]
+    results = []
+    for mode, concurrency in [("concurrent", 1), ("concurrent", args.concurrency), ("batched", args.concurrency)]:
+        llm = StubLLM(texts, args.latency, args.jitter, args.per_document)
+        timings = []
+        for _ in range(args.chats):
+            elapsed, result, progress = gradeOnce(args.stage, mode, concurrency, documents, llm, splitter)
+            timings.append(elapsed)
+        results.append((result, progress))
+        print(
+            f"{mode:<10} concurrency {concurrency:>3}   per chat p50 {statistics.median(timings) * 1000:8.1f} ms"
+            f"   max {max(timings) * 1000:8.1f} ms   requests/chat {llm.requests / args.chats:5.1f}"
+        )
+    same = all(result == results[0] for result in results)
+    print(f"same documents, grades and progress payload: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+One chat through the logical fallacy prompt loop, distributed over a
+process per stage or fused into one (workers/FusedWorker.py).
+
+The stages are stand-ins with the shape and public methods of the real
+ones, those outside this loop raise NotImplementedError. Each adds its
+output to message["data"], which grows along the loop as the FOL, SMT
+file, counterexample and classification are carried to the next stage,
+and sends an updateProgress record. The LLM and solver calls are replaced
+by --work seconds of sleep, 0 measures the pipeline overhead alone.
+
+  distributed  a process per stage, every hop goes through a relay that
+               decodes and re-encodes the frame like the supervisor does
+  fused        the stages in one FusedWorker, a chat is one handler call
+
+Reported: milliseconds per chat, hops through the relay per chat and the
+relay CPU, the supervisor work saved by fusing.
+
+    python src/benchmarks/bench_fused_loop.py --chats 200 --iterations 3
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from multiprocessing.connection import wait
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.codec import useCodec, encodeMessage, decodeMessage
+from utils.handleMessage import sendMessage, useLocalRoutes
+from utils.routeTable import stage, parseDestination
+from workers.Worker import Worker
+from workers.FusedWorker import FusedWorker
+
+
+class _Stage(Worker):
+    worker_name = ""
+    work = 0.0
+    iterations = 3
+
+    def run(self, conn, config):
+        type(self).conn = conn
+        asyncio.run(self.listen_task())
+
+    def _name(self) -> str:
+        return self.worker_name
+
+    def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
+        sendMessage(conn=self.conn, status="completed", messageId=messageId, destination=destination, data=data or {})
+
+    def _hand_on(self, message: dict, destination: str, sub_process_name: str, output: str) -> None:
+        if self.work:
+            time.sleep(self.work)
+        data = {**message["data"], sub_process_name: output}
+        self.sendToOtherWorker(
+            [f"DatabaseInteractionWorker/updateProgress/{data['chat_id']}"], str(time.perf_counter()),
+            {"process_name": "bench", "sub_process_name": sub_process_name, "input": "", "output": output},
+        )
+        self.sendToOtherWorker([destination], message["messageId"], data)
+
+    def _not_in_loop(self, *args, **kwargs):
+        # the real stage's helpers and handlers of the other loops, kept so
+        # compileRoutes sees the same methods and the same stages resolve
+        raise NotImplementedError(f"{self.worker_name} stand-in only runs the prompt loop")
+
+
+class PromptStage(_Stage):
+    worker_name = "LogicalFallacyPromptWorker"
+    fol_transformation = intent = thematic_progression = modification = _Stage._not_in_loop
+    intent_relationship = modify_prompt = prepare_fol_transformation = _Stage._not_in_loop
+
+    def removeLFPrompt(self, message):
+        self._hand_on(message, stage("fol_to_smt"), "fol", "forall x (P(x) -> Q(x)) " * 20)
+
+    def logical_fallacy_prompt_modification(self, message):
+        iteration = message["data"].get("eval_iteration", 0)
+        if iteration + 1 >= self.iterations:
+            self._hand_on(message, stage("generate_answer", message["data"]["chat_id"]), "final", "kalimat akhir " * 20)
+            return
+        message = {**message, "data": {**message["data"], "eval_iteration": iteration + 1}}
+        self._hand_on(message, stage("fol_to_smt"), f"modification_{iteration}", "kalimat yang dimodifikasi " * 20)
+
+
+class SmtStage(_Stage):
+    worker_name = "SMTConverterWorker"
+    smt_file_converter_from_response = smt_solver = _Stage._not_in_loop
+
+    def fol_to_smtlib(self, message):
+        self._hand_on(message, stage("counterexample"), "smt", "(declare-fun P (Int) Bool) (assert (forall ((x Int)) (=> (P x) (Q x)))) " * 15)
+
+
+class CounterExampleStage(_Stage):
+    worker_name = "CounterExampleCreatorWorker"
+    test = _Stage._not_in_loop
+
+    def counterexample_interpretation(self, message):
+        self._hand_on(message, stage("classification"), "counterexample", "interpretasi contoh penyangkal " * 30)
+
+
+class ClassificationStage(_Stage):
+    worker_name = "LogicalFallacyClassificationWorker"
+    fallacy_classification = _Stage._not_in_loop
+
+    def prepare_classification(self, message):
+        self._hand_on(message, stage("prompt_modification"), "classification", "hasty generalization " * 10)
+
+
+STAGES = [PromptStage, SmtStage, CounterExampleStage, ClassificationStage]
+
+
+def serveStage(stage_class, conn, work: float, iterations: int):
+    useCodec("orjson")
+    stage_class.work, stage_class.iterations = work, iterations
+    stage_class().run(conn, {})
+
+
+def serveFused(conn, work: float, iterations: int):
+    useCodec("orjson")
+    host = FusedWorker("LogicWorker")
+    FusedWorker.conn = conn
+    FusedWorker.capacity = len(STAGES)
+    for stage_class in STAGES:
+        stage_class.work, stage_class.iterations = work, iterations
+        stage_class.conn = conn
+        host._members[stage_class.worker_name] = stage_class()
+    useLocalRoutes(host._members, host._deliver_local)
+    asyncio.run(host.listen_task())
+
+
+def relay(conns: dict, chats: int) -> tuple:
+    """Route frames between the stage pipes like the supervisor, until every chat reached generateAnswer."""
+    pipes = list(set(conns.values()))
+    started, latencies, hops = {}, [], 0
+    for conn in pipes:
+        # every process announces its capacity first
+        decodeMessage(conn.recv_bytes())
+    cpu = os.times()
+    for i in range(chats):
+        chat_id = f"chat-{i}"
+        started[chat_id] = time.perf_counter()
+        conns["LogicalFallacyPromptWorker"].send_bytes(encodeMessage({
+            "messageId": chat_id, "status": "completed", "reason": "",
+            "destination": ["LogicalFallacyPromptWorker/removeLFPrompt/"],
+            "data": {"chat_id": chat_id, "prompt": "semua burung bisa terbang " * 10},
+        }))
+    while len(latencies) < chats:
+        for conn in wait(pipes):
+            message = decodeMessage(conn.recv_bytes())
+            if message["status"] != "completed":
+                continue
+            worker, method, param = parseDestination(message["destination"][0])
+            if worker == "CRAGWorker":
+                latencies.append(time.perf_counter() - started[param])
+            elif worker in conns:
+                hops += 1
+                conns[worker].send_bytes(encodeMessage(message))
+    after = os.times()
+    return latencies, hops, (after.user + after.system) - (cpu.user + cpu.system)
+
+
+def bench(mode: str, chats: int, work: float, iterations: int):
+    conns, processes = {}, []
+    if mode == "distributed":
+        for stage_class in STAGES:
+            parent, child = multiprocessing.Pipe()
+            processes.append(multiprocessing.Process(target=serveStage, args=(stage_class, child, work, iterations), daemon=True))
+            conns[stage_class.worker_name] = parent
+    else:
+        parent, child = multiprocessing.Pipe()
+        processes.append(multiprocessing.Process(target=serveFused, args=(child, work, iterations), daemon=True))
+        # the supervisor routes every member to the host
+        conns = {stage_class.worker_name: parent for stage_class in STAGES}
+    for process in processes:
+        process.start()
+    result = relay(conns, chats)
+    for process in processes:
+        process.terminate()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=3, help="evaluation iterations per chat, eval_iteration")
+    parser.add_argument("--work", type=float, default=0.0, help="seconds each stage spends, standing in for its LLM call")
+    args = parser.parse_args()
+    useCodec("orjson")
+
+    for mode in ["distributed", "fused"]:
+        latencies, hops, cpu = bench(mode, args.chats, args.work, args.iterations)
+        print(
+            f"{mode:<12} per chat p50 {statistics.median(latencies) * 1000:8.2f} ms   max {max(latencies) * 1000:8.2f} ms"
+            f"   relay hops/chat {hops / args.chats:5.1f}   relay CPU {cpu * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Latency of updateProgress-sized messages from one worker to another, both
+run by a real Supervisor, with and without a peer channel for the method.
+
+The sender calls sendMessage from a worker process, as CRAGWorker does for
+every step of a chat. Without peer routes the frame goes worker pipe ->
+supervisor I/O thread, which decodes, queues and forwards it under flow
+control -> receiver pipe. With SupervisorConfig["peer_routes"] set for
+updateProgress, sendMessage writes it to the receiver's Unix socket (see
+utils/peers.py). The supervisor CPU column is the CPU time of the process
+running the Supervisor while the messages are sent.
+
+The two workers stand in for CRAGWorker and DatabaseInteractionWorker,
+which need Azure and MongoDB; the receiver takes DatabaseInteractionWorker's
+concurrency and does nothing but record when each message arrived.
+
+    python src/benchmarks/bench_peer_channels.py --messages 2000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import psutil
+
+from config.workerConfig import SupervisorConfig, DatabaseInteractionWorkerConfig
+from supervisor import Supervisor
+from utils.handleMessage import sendMessage
+from workers.Worker import Worker
+
+
+def makeData() -> dict:
+    # shaped like the progress updates CRAGWorker sends for every step
+    return {"name": "retrieve", "status": "completed", "input": "pertanyaan pengguna", "output": "dokumen relevan " * 8, "sent": 0.0}
+
+
+class BenchSender(Worker):
+    def run(self, conn, config):
+        BenchSender.conn = conn
+        threading.Thread(target=self._send, args=(config["go"], config["messages"], config["interval"]), daemon=True).start()
+        asyncio.run(self.listen_task())
+
+    def _send(self, go, messages: int, interval: float):
+        go.wait()
+        for i in range(messages):
+            data = makeData()
+            data["sent"] = time.perf_counter()
+            sendMessage(
+                conn=self.conn,
+                messageId=f"chat-{i}",
+                status="completed",
+                destination=[f"ProgressSink/updateProgress/chat-{i % 16}"],
+                data=data,
+            )
+            if interval:
+                time.sleep(interval)
+
+
+class ProgressSink(Worker):
+    handler_args = {"data": "data"}
+
+    def run(self, conn, config):
+        ProgressSink.conn = conn
+        self._results, self._expected = config["results"], config["messages"]
+        self._latencies = []
+        self._lock = threading.Lock()
+        asyncio.run(self.listen_task())
+
+    def updateProgress(self, data):
+        with self._lock:
+            self._latencies.append(time.perf_counter() - data["sent"])
+            if len(self._latencies) == self._expected:
+                self._results.put(self._latencies)
+
+
+# the supervisor imports workers.<name>, in its process and in the spawned workers
+for _worker in (BenchSender, ProgressSink):
+    _module = types.ModuleType(f"workers.{_worker.__name__}")
+    setattr(_module, _worker.__name__, _worker)
+    _module.main = lambda conn, config, worker=_worker: worker().run(conn, config)
+    sys.modules[_module.__name__] = _module
+
+
+def onlyBenchWorkers(workers: list):
+    """create_worker for Supervisor.__init__: the benchmark's workers instead of the configured ones."""
+    create = Supervisor.create_worker
+
+    def createWorker(self, worker, count=1, config=None):
+        # on the first call, before the I/O thread starts, like the configured workers
+        while workers:
+            create(self, *workers.pop(0))
+    return createWorker
+
+
+def bench(peer: bool, messages: int, interval: float, results):
+    SupervisorConfig["peer_routes"] = {"ProgressSink": ["updateProgress"]} if peer else {}
+    go, latencies = multiprocessing.Event(), multiprocessing.Queue()
+    sink = {"concurrency": DatabaseInteractionWorkerConfig.get("concurrency", 1), "results": latencies, "messages": messages}
+    sender = {"go": go, "messages": messages, "interval": interval}
+    create = Supervisor.create_worker
+    Supervisor.create_worker = onlyBenchWorkers([("ProgressSink", 1, sink), ("BenchSender", 1, sender)])
+    try:
+        supervisor = Supervisor()
+    finally:
+        Supervisor.create_worker = create
+    while any(info['last_seen'] is None for info in list(supervisor._workers.values())):
+        time.sleep(0.1)
+    # the peer routes broadcast when the receiver became ready
+    time.sleep(0.5)
+    process = psutil.Process()
+    before = process.cpu_times()
+    go.set()
+    result = latencies.get()
+    after = process.cpu_times()
+    for info in list(supervisor._workers.values()):
+        info['process'].kill()
+    results.put((result, (after.user - before.user) + (after.system - before.system)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--interval", type=float, default=0.0005, help="seconds between two messages, 0 to flood")
+    args = parser.parse_args()
+
+    for name, peer in [("supervisor", False), ("peer", True)]:
+        # a Supervisor per process, its worker table is a class attribute
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=bench, args=(peer, args.messages, args.interval, results))
+        process.start()
+        latencies, cpu = results.get()
+        process.join()
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(
+            f"{name:<10} p50 {statistics.median(latencies) * 1e6:8.1f} us   p99 {p99 * 1e6:8.1f} us"
+            f"   supervisor CPU {cpu * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Per-hop latency of the worker runtime.
+
+Sends messages one at a time to an echo worker and measures the round trip
+until its reply comes back, once for the event-driven runtime of
+workers/Worker.py and once for the poll(1) + asyncio.sleep(0.1) loop the
+workers used to copy.
+
+    python src/benchmarks/bench_worker_runtime.py --messages 200
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.handleMessage import sendMessage, recvMessage
+from utils.codec import encodeMessage
+from workers.Worker import Worker
+
+
+class EchoWorker(Worker):
+    def run(self, conn, config=None):
+        EchoWorker.conn = conn
+        asyncio.run(self.listen_task())
+
+    def echo(self, message):
+        return {"destination": ["supervisor"], "data": message.get("data")}
+
+
+class PollingEchoWorker(EchoWorker):
+    async def listen_task(self):
+        while True:
+            try:
+                if self.conn.poll(1):
+                    message = recvMessage(self.conn)
+                    result = self.echo(message)
+                    sendMessage(
+                        conn=self.conn,
+                        status="completed",
+                        destination=result["destination"],
+                        messageId=message["messageId"],
+                        data=result["data"],
+                    )
+                    await asyncio.sleep(0.1)
+            except EOFError:
+                break
+
+
+def roundTrip(conn, worker_name: str, messageId: str) -> float:
+    started = time.perf_counter()
+    conn.send_bytes(encodeMessage({
+        "messageId": messageId,
+        "status": "completed",
+        "destination": [f"{worker_name}/echo/"],
+        "data": {"text": "ping"},
+    }))
+    while True:
+        # skip ready/credit control messages
+        reply = recvMessage(conn)
+        if reply.get("status") == "completed" and reply.get("messageId") == messageId:
+            return time.perf_counter() - started
+
+
+def bench(worker_cls, messages: int, warmup: int) -> list:
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=worker_cls().run, args=(child_conn,), daemon=True)
+    process.start()
+    try:
+        for i in range(warmup):
+            roundTrip(parent_conn, worker_cls.__name__, f"warmup-{i}")
+        return [roundTrip(parent_conn, worker_cls.__name__, str(i)) for i in range(messages)]
+    finally:
+        process.terminate()
+        process.join()
+
+
+def report(label: str, samples: list) -> None:
+    ms = sorted(s * 1000 for s in samples)
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+    print(f"{label:<10} mean {statistics.mean(ms):8.3f} ms   p50 {statistics.median(ms):8.3f} ms   p99 {p99:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    args = parser.parse_args()
+
+    report("runtime", bench(EchoWorker, args.messages, args.warmup))
+    # the polling loop sleeps 100 ms per message, keep the run short
+    report("polling", bench(PollingEchoWorker, max(1, args.messages // 10), args.warmup))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Startup cost of each worker type under the spawn and forkserver start
+methods (see utils/startup.py).
+
+For every worker type a process is started and imports its module, as
+Supervisor._worker_runner does. Reported per worker:
+
+  start    seconds from Process.start() until the module is imported
+  import   seconds the import of the worker module itself took
+  rss      resident memory of the process, MB
+  uss      memory only this process holds, MB. With forkserver the
+           preloaded modules are shared with the server and the other
+           workers and do not count here
+
+    python src/benchmarks/bench_worker_startup.py --workers CRAGWorker VectorWorker
+"""
+import argparse
+import importlib
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import psutil
+
+from config.workerConfig import SupervisorConfig, allConfigs
+
+
+def measure(worker_name: str, conn, started: float):
+    began = time.perf_counter()
+    error = None
+    try:
+        importlib.import_module(f"workers.{worker_name}")
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    imported = time.perf_counter()
+    memory = psutil.Process().memory_full_info()
+    conn.send({
+        "start": time.time() - started,
+        "import": imported - began,
+        "rss": memory.rss / 2**20,
+        "uss": memory.uss / 2**20,
+        "error": error,
+    })
+    # stay alive until every worker is measured, the shared pages stay shared
+    conn.recv()
+
+
+def bench(method: str, workers: list) -> dict:
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        context.set_forkserver_preload(SupervisorConfig.get("preload", []))
+        # the server imports the preload list when it starts, not on the clock of the first worker
+        process = context.Process(target=time.sleep, args=(0,))
+        process.start()
+        process.join()
+    results, running = {}, []
+    for worker_name in workers:
+        parent, child = context.Pipe()
+        process = context.Process(target=measure, args=(worker_name, child, time.time()))
+        process.start()
+        results[worker_name] = parent.recv()
+        running.append((process, parent))
+    for process, parent in running:
+        parent.send(None)
+        process.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", nargs="+", default=list(allConfigs))
+    parser.add_argument("--methods", nargs="+", default=["spawn", "forkserver"])
+    args = parser.parse_args()
+
+    for method in args.methods:
+        results = bench(method, args.workers)
+        print(f"\n{method}")
+        print(f"{'worker':<36}{'start s':>9}{'import s':>10}{'rss MB':>9}{'uss MB':>9}")
+        for worker_name, r in results.items():
+            line = f"{worker_name:<36}{r['start']:>9.2f}{r['import']:>10.2f}{r['rss']:>9.0f}{r['uss']:>9.0f}"
+            print(line + (f"   {r['error']}" if r["error"] else ""))
+        print(f"{'total':<36}{sum(r['start'] for r in results.values()):>9.2f}{'':>10}"
+              f"{sum(r['rss'] for r in results.values()):>9.0f}{sum(r['uss'] for r in results.values()):>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -47,4 +47,44 @@ redis={
     "db": int(os.getenv("REDIS_DB", 0)),
     "username":os.getenv("REDIS_USERNAME", ""),
     "password": os.getenv("REDIS_PASSWORD", "")
-}
\ No newline at end of file
+}
+
+llm={
+    # of each Azure OpenAI deployment, shared by all the workers, 0 for no limit
+    "rpm": int(os.getenv("LLM_REQUESTS_PER_MINUTE", 0)),
+    "tpm": int(os.getenv("LLM_TOKENS_PER_MINUTE", 0)),
+    "max_retries": int(os.getenv("LLM_MAX_RETRIES", 5)),
+    "max_connections": int(os.getenv("LLM_MAX_CONNECTIONS", 20)),
+    "cache_enabled": os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true",
+    # shares cached answers between replicas through the CacheWorker Redis
+    "cache_redis": os.getenv("LLM_CACHE_REDIS", "true").lower() == "true",
+}
+
+supervisor={
+    "dispatch_policy": os.getenv("SUPERVISOR_DISPATCH_POLICY", "least_in_flight"),
+    # json | orjson | msgpack, falls back to json when the library is missing
+    "codec": os.getenv("IPC_CODEC", "orjson"),
+    # bytes, payloads above it travel through shared memory, 0 disables it
+    "shm_threshold": int(os.getenv("IPC_SHM_THRESHOLD", 1024 * 1024)),
+    # write-ahead log of routed messages, replayed when the supervisor restarts.
+    # Opt-in, SUPERVISOR_WAL_ENABLED=true, it fsyncs into SUPERVISOR_WAL_DIR
+    "wal_enabled": os.getenv("SUPERVISOR_WAL_ENABLED", "false").lower() == "true",
+    "wal_dir": os.getenv("SUPERVISOR_WAL_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "wal")),
+    # opt-in, SUPERVISOR_AUTOSCALE_ENABLED=true scales the worker types of
+    # SupervisorConfig["autoscale"]["workers"] between their min and max replicas
+    "autoscale_enabled": os.getenv("SUPERVISOR_AUTOSCALE_ENABLED", "false").lower() == "true",
+    # opt-in worker -> worker channels for the methods in SupervisorConfig["peer_routes"]
+    "peer_channels": os.getenv("SUPERVISOR_PEER_CHANNELS", "false").lower() == "true",
+    # host:port remote worker agents (src/agent.py) connect to, empty to disable
+    "remote_address": os.getenv("SUPERVISOR_REMOTE_ADDRESS", ""),
+    "remote_authkey": os.getenv("SUPERVISOR_REMOTE_AUTHKEY", ""),
+    # spawn | forkserver, how worker processes are started. forkserver starts
+    # them faster from preloaded imports (Unix only), SUPERVISOR_START_METHOD=forkserver
+    "start_method": os.getenv("SUPERVISOR_START_METHOD", "spawn"),
+    # run the cheap stages of config/pipeline.py FusedWorkers in one process
+    "fuse_stages": os.getenv("SUPERVISOR_FUSE_STAGES", "false").lower() == "true",
+    # default quotas of a project, 0 for no limit. PROJECT_MAX_CONCURRENCY=8
+    # rejects a project's requests beyond 8 running at once with QUOTA_EXCEEDED
+    "project_concurrency": int(os.getenv("PROJECT_MAX_CONCURRENCY", 0)),
+    "project_tokens_per_minute": int(os.getenv("PROJECT_TOKENS_PER_MINUTE", 0)),
+}
@@ -0,0 +1,42 @@
+from .env import supervisor
+
+#########
+# Pipeline topology. Workers hand work to the next stage by its name here,
+# utils.routeTable.stage("counterexample"), instead of a "Worker/method/"
+# string of their own, so the order of the stages is changed in this file.
+#########
+
+# stage -> the worker method that runs it
+Stages = {
+    "generate_answer": "CRAGWorker/generateAnswer",
+    "remove_lf_prompt": "LogicalFallacyPromptWorker/removeLFPrompt",
+    "remove_lf_response": "LogicalFallacyResponseWorker/removeLFResponse",
+    "fol_to_smt": "SMTConverterWorker/fol_to_smtlib",
+    "response_to_smt": "SMTConverterWorker/smt_file_converter_from_response",
+    "counterexample": "CounterExampleCreatorWorker/counterexample_interpretation",
+    "classification": "LogicalFallacyClassificationWorker/prepare_classification",
+    "prompt_modification": "LogicalFallacyPromptWorker/logical_fallacy_prompt_modification",
+    "response_modification": "LogicalFallacyResponseWorker/logical_fallacy_response_modification",
+}
+
+# the stages of each pipeline in order. The modification stages loop back to
+# fol_to_smt / response_to_smt until the intent holds or the iterations run out
+Pipelines = {
+    "crag_chat": ["generate_answer", "remove_lf_response"],
+    "logical_fallacy_prompt": ["remove_lf_prompt", "fol_to_smt", "counterexample", "classification", "prompt_modification"],
+    "logical_fallacy_response": ["remove_lf_response", "response_to_smt", "counterexample", "classification", "response_modification"],
+}
+
+# host -> worker types run together in one process by workers/FusedWorker.py.
+# Messages between them stay in the process, without the supervisor hop.
+# These stages are a solver call and two short LLM calls, a process each
+# is mostly idle memory. With the prompt worker in, a whole evaluation loop
+# of logical_fallacy_prompt runs as one call, see FusedWorker._run_stages
+FusedWorkers = {
+    "LogicWorker": [
+        "LogicalFallacyPromptWorker",
+        "SMTConverterWorker",
+        "CounterExampleCreatorWorker",
+        "LogicalFallacyClassificationWorker",
+    ],
+} if supervisor['fuse_stages'] else {}
@@ -1,11 +1,12 @@
 
-from .env import port, database, tavily_api_key, azure, rabbit_mq,redis
+from .env import port, database, tavily_api_key, azure, rabbit_mq,redis,supervisor,llm
 
 
 DatabaseInteractionWorkerConfig={
   'connection_string':database['connection_string'],
   'database': database['database_name'],
   "dbTweets": database["database_tweets"],
+  "concurrency": 8,
 } 
 
 VectorWorkerConfig={
@@ -17,6 +18,7 @@ VectorWorkerConfig={
     "azure_openai_api_version": azure['api_version']['embedding'],
     "mongodb_collection": database['mongodb_collection_vector'],
     "atlas_vector_search_index_name": database['mongo_vector_search_index_name'],
+    "concurrency": 2,
 }
 
 PromptRecommendationWorkerConfig={
@@ -28,6 +30,7 @@ PromptRecommendationWorkerConfig={
     "azure_openai_chat_api_version": azure['api_version']['api'],
     "azure_openai_chat_api_key": azure['api_key'],
     "azure_openai_chat_endpoint": azure['endpoint'],
+    "concurrency": 4,
 }
 
 RabbitMQWorkerConfig={
@@ -35,15 +38,22 @@ RabbitMQWorkerConfig={
     'consumeQueue': rabbit_mq['consume']['queue'],
     'consumeCompensationQueue': rabbit_mq['consume']['compensation_queue'],
     'produceQueue': rabbit_mq['produce']['queue'],
-    'produceCompensationQueue': rabbit_mq['produce']['compensation_queue']
+    'produceCompensationQueue': rabbit_mq['produce']['compensation_queue'],
+    "concurrency": 4,
 }
 
 RestApiWorkerConfig={
     'port': port,
+    "concurrency": 16,
+    # seconds a route waits for an answer, and a chat pipeline may run, before they are cancelled
+    "request_timeout": 30,
+    "chat_timeout": 900,
 }
 GraphQLWorkerConfig={
     'port': int(port) +1,
-
+    "concurrency": 16,
+    "request_timeout": 10,
+    "chat_timeout": 900,
 }
 
 CRAGWorkerConfig={
@@ -58,38 +68,54 @@ CRAGWorkerConfig={
     "azure_openai_deployment_name_embedding": azure['deployment_name']['embedding'],
     "azure_openai_api_version": azure['api_version']['api'],
     "azure_openai_embedding_api_version": azure['api_version']['embedding'],
+    "concurrency": 4,
+    # documents of one chat graded at once, the gateway still holds them to the deployment's limits
+    "grading_concurrency": 5,
+    # concurrent: a request per document | batched: several documents per request
+    "grading_mode": "concurrent",
+    "grading_batch_size": 10,
+    # estimated tokens of the documents in one batched request
+    "grading_batch_tokens": 6000,
 }
 
 LogicalFallacyPromptWorkerConfig={
     "azure_openai_api_key": azure['api_key'],
     "azure_openai_endpoint": azure['endpoint'],
     "azure_openai_deployment_name": azure['deployment_name']['api'],
-    "azure_openai_api_version": azure['api_version']['api']
+    "azure_openai_api_version": azure['api_version']['api'],
+    "concurrency": 8,
 }
 
 LogicalFallacyResponseWorkerConfig={
     "azure_openai_api_key": azure['api_key'],
     "azure_openai_endpoint": azure['endpoint'],
     "azure_openai_deployment_name": azure['deployment_name']['api'],
-    "azure_openai_api_version": azure['api_version']['api']
+    "azure_openai_api_version": azure['api_version']['api'],
+    "concurrency": 8,
 }
 
 SMTConverterWorkerConfig={
-    "":""
+    "azure_openai_api_key": azure['api_key'],
+    "azure_openai_endpoint": azure['endpoint'],
+    "azure_openai_deployment_name": azure['deployment_name']['api'],
+    "azure_openai_api_version": azure['api_version']['api'],
+    "concurrency": 4,
 }
 
 CounterExampleCreatorWorkerConfig={
     "azure_openai_api_key": azure['api_key'],
     "azure_openai_endpoint": azure['endpoint'],
     "azure_openai_deployment_name": azure['deployment_name']['api'],
-    "azure_openai_api_version": azure['api_version']['api']
+    "azure_openai_api_version": azure['api_version']['api'],
+    "concurrency": 8,
 }
 
 LogicalFallacyClassificationWorkerConfig={
     "azure_openai_api_key": azure['api_key'],
     "azure_openai_endpoint": azure['endpoint'],
     "azure_openai_deployment_name": azure['deployment_name']['api'],
-    "azure_openai_api_version": azure['api_version']['api']
+    "azure_openai_api_version": azure['api_version']['api'],
+    "concurrency": 8,
 }
 
 CacheWorkerConfig={
@@ -98,9 +124,167 @@ CacheWorkerConfig={
     "redis_db": redis['db'], # type: ignore
     "redis_username": redis['username'], # type: ignore
     "redis_password": redis['password'], # type: ignore
-
+    "concurrency": 16,
 } 
 
+SupervisorConfig={
+    # see utils/startup.py. forkserver imports the preload modules once and
+    # forks every worker from there, spawn starts each from scratch
+    "start_method": supervisor['start_method'],
+    "preload": [
+        "workers.Worker",
+        "pandas",
+        "openai",
+        "langchain_core.prompts",
+        "langchain_openai",
+        "langgraph.graph",
+        "pymongo",
+        "nltk.tokenize",
+    ],
+    # round_robin | least_in_flight | sticky, per worker type
+    "dispatch_policy": {
+        "default": supervisor['dispatch_policy'],
+        # every write of one chat goes to the same replica so progress stays ordered
+        "DatabaseInteractionWorker": "sticky",
+        # generatePrompt waits in its replica for the onTweetComing of the same project
+        "PromptRecommendationWorker": "sticky",
+    },
+    # messages waiting for a credit, per worker type and priority class
+    "queue_limit": 1000,
+    # seconds a queued message of the class waits at most before it is served
+    # ahead of higher classes (interactive > default > bulk), see utils/priority.py
+    "priority_aging": {"default": 10, "bulk": 30},
+    # encoding of every supervisor <-> worker message, see utils/codec.py
+    "codec": supervisor['codec'],
+    "shm_threshold": supervisor['shm_threshold'],
+    # seconds before a shared payload nobody released is unlinked anyway
+    "shm_ttl": 600,
+    # seconds between two worker health checks
+    "health_interval": 10,
+    # messages kept for resending until their worker finishes them
+    "pending_limit": 10000,
+    # seconds before an unfinished pending message is dropped
+    "pending_ttl": 900,
+    "wal": {
+        "enabled": supervisor['wal_enabled'],
+        "dir": supervisor['wal_dir'],
+        # buffered records are fsynced after this many seconds or records
+        "fsync_interval": 0.05,
+        "fsync_batch": 64,
+        # bytes before the log is rewritten with only the outstanding routes
+        "compact_bytes": 64 * 1024 * 1024,
+    },
+    "heartbeat": {
+        # seconds between two heartbeats of a worker
+        "interval": 5,
+        # seconds without any message before a worker is recycled
+        "silent_after": 60,
+        # seconds one message may run, per worker type
+        "task_timeout": {
+            "default": 300,
+            "CRAGWorker": 900,
+            "PromptRecommendationWorker": 600,
+            # runs every iteration of a logical fallacy loop in one message
+            "LogicWorker": 900,
+        },
+        # recycles a single message may cause before it is dropped
+        "max_retries": 2,
+    },
+    # worker type -> methods other workers send to it directly over a Unix
+    # socket instead of through the supervisor, see utils/peers.py
+    "peer_routes": {
+        # every write to a chat's history takes the same channel, so they arrive
+        # in the order they were sent. One of them waiting in the supervisor
+        # for a credit while the next went peer would be overtaken
+        "DatabaseInteractionWorker": ["createNewProgress", "updateProgress", "updateOutputProcess", "updateFinalAnswer"],
+    } if supervisor['peer_channels'] else {},
+    # TCP endpoint for workers running on other hosts, see src/agent.py
+    "remote": {
+        "address": supervisor['remote_address'],
+        "authkey": supervisor['remote_authkey'].encode(),
+    },
+    # replicas of each listed worker type between min and max, see utils/autoscaler.py.
+    # RestApiWorker and GraphQLWorker bind a port and stay at one replica.
+    # PromptRecommendationWorker does too: a replica added between a
+    # generatePrompt and its tweets would take over some projects' replies
+    "autoscale": {
+        "enabled": supervisor['autoscale_enabled'],
+        # seconds between two scaling decisions
+        "interval": 5,
+        "cooldown_up": 30,
+        "cooldown_down": 120,
+        # percent of system memory above which no replica is added
+        "memory_ceiling": 85,
+        "defaults": {
+            "queue_per_replica": 4,
+            "busy_per_interval": 3,
+            "target_latency": 30,
+            "idle_after": 120,
+        },
+        "workers": {
+            "CRAGWorker": {"min": 1, "max": 4, "target_latency": 60},
+            "LogicalFallacyPromptWorker": {"min": 1, "max": 3},
+            "LogicalFallacyResponseWorker": {"min": 1, "max": 3},
+            "LogicalFallacyClassificationWorker": {"min": 1, "max": 3},
+            "CounterExampleCreatorWorker": {"min": 1, "max": 2},
+            "SMTConverterWorker": {"min": 1, "max": 2},
+        },
+    },
+    # connection pool and rate limits of every LLM call, see utils/llmGateway.py
+    "llm": {
+        "max_retries": llm['max_retries'],
+        "max_connections": llm['max_connections'],
+        "max_keepalive": 10,
+        "timeout": 120,
+        # deployment -> {"rpm", "tpm"} as set on Azure, the limits are shared
+        # by all the workers. Deployments not listed are limited per process
+        "deployments": {
+            deployment: {"rpm": llm['rpm'], "tpm": llm['tpm']}
+            for deployment in {azure['deployment_name']['api'], azure['deployment_name']['prompt'], azure['deployment_name']['embedding']}
+        },
+    },
+    # answers of the chains that opt in, see utils/llmCache.py
+    "llm_cache": {
+        "enabled": llm['cache_enabled'],
+        "max_entries": 2048,
+        "ttl": 3600,
+        # chain -> seconds its answers are kept
+        "chains": {
+            "retrieval_grader": 24 * 3600,
+            "keyword_extractor": 24 * 3600,
+            "intent": 3600,
+            "thematic_progression": 3600,
+            "prompt_category": 6 * 3600,
+            "format_context": 6 * 3600,
+        },
+        "redis": {
+            "url": redis['host'],
+            "port": redis['port'],
+            "db": redis['db'],
+            "username": redis['username'],
+            "password": redis['password'],
+        } if llm['cache_redis'] else None,
+    },
+    # fair share and quotas per projectId, see utils/quota.py
+    "quotas": {
+        "enabled": True,
+        # worker types whose messages start requests -> method rejections are
+        # answered to. RabbitMQ ingestion is only queued fairly, never rejected
+        "entry_workers": {
+            "RestApiWorker": "onProcessed",
+            "GraphQLWorker": "onProcessed",
+        },
+        "defaults": {
+            "weight": 1,
+            "concurrency": supervisor['project_concurrency'],
+            "tokens_per_minute": supervisor['project_tokens_per_minute'],
+            "tokens_per_request": 2000,
+        },
+        # projectId -> overrides of the defaults, e.g. {"weight": 2, "concurrency": 16}
+        "projects": {},
+    },
+}
+
 allConfigs = {
     "DatabaseInteractionWorker": DatabaseInteractionWorkerConfig,
     "VectorWorker": VectorWorkerConfig,
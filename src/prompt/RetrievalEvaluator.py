@@ -1,5 +1,6 @@
 from langchain.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
+from typing import List
 from langchain_openai import AzureChatOpenAI
 
 
@@ -41,6 +42,41 @@ grade_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
+# Several documents graded in one request, each by the same criteria as above
+class DocumentGrade(BaseModel):
+    """Klasifikasi relevansi satu dokumen."""
+
+    index: int = Field(
+        description="Nomor dokumen, seperti tertulis di dalam tanda kurung siku."
+    )
+    final_classification: str = Field(
+        description="Klasifikasi akhir dokumen: 'Benar', 'Salah', atau 'Ambigu'."
+    )
+
+
+class GradeDocumentsBatch(BaseModel):
+    """Klasifikasi relevansi setiap dokumen."""
+
+    classifications: List[DocumentGrade] = Field(
+        description="Satu klasifikasi untuk setiap dokumen, urut sesuai nomornya."
+    )
+
+batch_system = system.split("Pertanyaan: {question}")[0] + """Nilai setiap dokumen secara terpisah, seolah-olah hanya dokumen itu yang diberikan; dokumen lain tidak memengaruhi klasifikasinya.\n
+Berikan tepat satu klasifikasi untuk setiap nomor dokumen.\n
+Pertanyaan: {question}\n
+Dokumen yang Diambil:\n{documents}\n"""
+
+batch_grade_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", batch_system),
+        ("human", "Evaluasi setiap dokumen ini untuk relevansi: \n\n {documents} \n\n Pertanyaan pengguna: {question}"),
+    ]
+)
+
+def number_documents(texts):
+    """The {documents} of batch_grade_prompt, each text under its number from 1."""
+    return "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(texts, 1))
+
 # Create a retrieval grader pipeline
 # retrieval_grader = grade_prompt | structured_llm_grader
 
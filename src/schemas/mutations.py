@@ -1,9 +1,10 @@
 import strawberry
 from typing import List, Optional
-from .types import ChatResponse, ChatResponseDataItem, DataItemType, ProcessResponse,PromptResponse,SubProcessType, TopicDataType, TopicQuestionType
+from .types import CancelResponse, ChatResponse, ChatResponseDataItem, DataItemType, ProcessResponse,PromptResponse,SubProcessType, TopicDataType, TopicQuestionType
 import uuid
 import threading
-from utils.handleMessage import sendMessage, convertMessage
+import time
+from utils.handleMessage import sendMessage, sendCancel, convertMessage
 
 
 @strawberry.type
@@ -20,7 +21,8 @@ class Mutation:
               data={
                   "question": prompt,
                   "projectId": projectId
-              }
+              },
+              project=projectId
           )
       id = message.get("result", [{}])[0].get("_id", "unknown_id")
       
@@ -33,7 +35,10 @@ class Mutation:
               "prompt": prompt,
               "id": id,
               "projectId": projectId
-          }
+          },
+      project=projectId,
+      deadline=time.time() + worker.chat_timeout,
+      cancelToken=id
       )
       return ChatResponse(
         status="completed",
@@ -55,7 +60,8 @@ class Mutation:
           data={
               "question": response,
               "projectId": projectId
-          }
+          },
+          project=projectId
       )
       id = message.get("result", [{}])[0].get("_id", "unknown_id")
 
@@ -67,7 +73,10 @@ class Mutation:
           data={
               "response":response,
               "chat_id": id
-          }
+          },
+      project=projectId,
+      deadline=time.time() + worker.chat_timeout,
+      cancelToken=id
       )
       return ChatResponse(
         status="completed",
@@ -77,4 +86,11 @@ class Mutation:
           projectId=projectId
        )
 
-    )
\ No newline at end of file
+    )
+
+  @strawberry.field
+  def cancelChat(self,chatId:str,info: strawberry.Info)-> CancelResponse:
+      """Stop the pipeline of a chat, the workers stop between stages"""
+      worker = info.context.get('worker')
+      sendCancel(worker.conn, chatId)
+      return CancelResponse(status="cancelling", chat_id=chatId)
\ No newline at end of file
@@ -62,13 +62,15 @@ class Query:
       print(f"Cache destination: {cacheDest}, Cache data: {caceData}")
       result = worker.sendToOtherWorker(
           destination=cacheDest,
-          data=caceData
+          data=caceData,
+          project=projectId
       )
       if len(result["result"]) == 0:
           print(projectId)
           result = worker.sendToOtherWorker(
               destination=[f"DatabaseInteractionWorker/getPrompt/{projectId}"],
-              data={"key": projectId}
+              data={"key": projectId},
+              project=projectId
           )
           sendMessage(
               conn=worker.conn,
@@ -78,7 +80,8 @@ class Query:
               data={
                   "key":f"{projectId}",
                   "value":result['result'],
-              }
+              },
+              project=projectId
           )
       print(f"Result from worker: {result}")
       if result['result'] == 'null' or len(result['result']) == 0:
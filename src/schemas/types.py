@@ -37,6 +37,11 @@ class ChatResponse:
     status: str
     data: ChatResponseDataItem
 
+@strawberry.type
+class CancelResponse:
+    status: str
+    chat_id: str
+
 @strawberry.type
 class TopicQuestionType:
     optimal_prompt: str
@@ -2,16 +2,35 @@ import sys
 import os
 import time
 import threading
+import tempfile
+import itertools
+import queue
 import importlib
 import multiprocessing
 from datetime import datetime
-from multiprocessing.connection import Connection
+from multiprocessing.connection import Connection, Listener, wait
 import traceback
 from utils.log import log
 from utils.handleMessage import sendMessage,convertMessage
+from utils.codec import useCodec, encodeMessage, withKey
+from utils.sharedPayload import PayloadRegistry, useSharedMemory
+from utils.dispatcher import Dispatcher
+from utils.pendingStore import PendingStore
+from utils.wal import WriteAheadLog, newKey, useKeyJournal
+from utils.autoscaler import Autoscaler
+from utils.peers import usePeerRoutes, serveListener
+from utils.outbox import Outbox
+from utils.priority import PriorityQueue, useAging, normalizePriority
+from utils.quota import ProjectQuotas
+from utils.cancellation import cancel, stopReason
+from utils.startup import useStartMethod
+from utils.routeTable import parseDestination, useFusedWorkers, hostOf
+from utils.llmGateway import useLlmGateway, sharedLimits
+from utils.llmCache import useLlmCache
 import psutil
 
-from config.workerConfig import CacheWorkerConfig, CounterExampleCreatorWorkerConfig, DatabaseInteractionWorkerConfig, LogicalFallacyClassificationWorkerConfig, LogicalFallacyPromptWorkerConfig, LogicalFallacyResponseWorkerConfig,allConfigs, SMTConverterWorkerConfig, VectorWorkerConfig, PromptRecommendationWorkerConfig, RabbitMQWorkerConfig, RestApiWorkerConfig, CRAGWorkerConfig,GraphQLWorkerConfig
+from config.pipeline import FusedWorkers
+from config.workerConfig import CacheWorkerConfig, CounterExampleCreatorWorkerConfig, SupervisorConfig, DatabaseInteractionWorkerConfig, LogicalFallacyClassificationWorkerConfig, LogicalFallacyPromptWorkerConfig, LogicalFallacyResponseWorkerConfig,allConfigs, SMTConverterWorkerConfig, VectorWorkerConfig, PromptRecommendationWorkerConfig, RabbitMQWorkerConfig, RestApiWorkerConfig, CRAGWorkerConfig,GraphQLWorkerConfig
 
 #########
 # dont edit this class except worker conf
@@ -19,9 +38,56 @@ from config.workerConfig import CacheWorkerConfig, CounterExampleCreatorWorkerCo
 class Supervisor:
     _workers:dict={}
     workers_health:dict ={}
-    pending_messages:dict={}
+    queues:dict={}
     
     def __init__(self):
+        self.dispatcher = Dispatcher(SupervisorConfig.get("dispatch_policy"))
+        useCodec(SupervisorConfig.get("codec", "json"))
+        # per priority class, a flood of bulk work cannot push chats out
+        self.queue_limit = SupervisorConfig.get("queue_limit", 1000)
+        # members of a fused host are routed to the host's replicas
+        useFusedWorkers(FusedWorkers)
+        useAging(SupervisorConfig.get("priority_aging", {}))
+        self.payloads = PayloadRegistry(SupervisorConfig.get("shm_ttl", 600))
+        self.health_interval = SupervisorConfig.get("health_interval", 10)
+        self.heartbeat = SupervisorConfig.get("heartbeat", {})
+        # messageId -> times a worker hung on it
+        self._hangs: dict = {}
+        # worker type -> the queued message last found with no credit left
+        self._stalled: dict = {}
+        # worker types started here or registered by an agent, messages to anything else are dropped
+        self._worker_types: set = set(allConfigs) | set(FusedWorkers)
+        # requests running and tokens spent per project, checked when a request enters
+        self.quotas = ProjectQuotas(SupervisorConfig.get("quotas"))
+        self.pending = PendingStore(SupervisorConfig.get("pending_limit", 10000), SupervisorConfig.get("pending_ttl", 900), on_drop=self._on_pending_drop)
+        self.autoscaler = Autoscaler(SupervisorConfig.get("autoscale"))
+        # worker type -> methods its replicas take straight from other workers
+        self.peer_routes = SupervisorConfig.get("peer_routes", {})
+        self._peer_authkey = os.urandom(32)
+        # rate limiter state of each LLM deployment, shared by the workers
+        self._llm_limits = sharedLimits(SupervisorConfig.get("llm"))
+        self._peer_dir = tempfile.mkdtemp(prefix="sc-peers-") if self.peer_routes else None
+        self._peer_ids = itertools.count()
+        self.wal = None
+        wal_config = SupervisorConfig.get("wal", {})
+        if wal_config.get("enabled"):
+            self.wal = WriteAheadLog(
+                wal_config["dir"],
+                fsync_interval=wal_config.get("fsync_interval", 0.05),
+                fsync_batch=wal_config.get("fsync_batch", 64),
+                compact_bytes=wal_config.get("compact_bytes", 0),
+            )
+            # queued before the workers exist, they get it once ready
+            self._replay_wal()
+        # remote workers (src/agent.py) connect over TCP and are handed to the
+        # I/O thread through this queue, the pipe wakes it up
+        self._joining = queue.SimpleQueue()
+        self._wake_reader, self._wake_writer = multiprocessing.Pipe(duplex=False)
+        remote_config = SupervisorConfig.get("remote", {})
+        if remote_config.get("address") and not remote_config.get("authkey"):
+            log("SUPERVISOR_REMOTE_AUTHKEY is empty, not accepting remote workers", "error")
+        elif remote_config.get("address"):
+            self._start_remote_listener(remote_config["address"], remote_config["authkey"])
 
         ####
         # just edit this part to add your workers
@@ -47,9 +113,9 @@ class Supervisor:
         ####
         
 
-        # Start periodic health check thread
-        self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
-        self._health_thread.start()
+        # every pipe is read, and every message routed, on this one thread
+        self._io_thread = threading.Thread(target=self._io_loop, daemon=True)
+        self._io_thread.start()
         log("Supervisor initialized", "info")
 
     def create_worker(self, worker: str, count: int = 1, config: dict = None):
@@ -57,27 +123,72 @@ class Supervisor:
             log("Worker count must be greater than zero", "error")
             raise ValueError("Worker count must be greater than zero")
         config = config or {}
+        host = hostOf(worker)
+        if host != worker:
+            # a fused stage runs inside its host, started once for all its members
+            if any(info['name'] == host and not info['closed'] for info in self._workers.values()):
+                log(f"{worker} runs inside {host}", "info")
+                return
+            worker = host
+        if worker in FusedWorkers:
+            members = {member: allConfigs.get(member, {}) for member in FusedWorkers[worker]}
+            config = {
+                "host": worker, "members": members,
+                "concurrency": sum(int(c.get("concurrency", 1)) for c in members.values()),
+            }
+        self._worker_types.add(worker)
         # log(f"Creating {count} worker(s) of type {worker}", "info")
 
         for _ in range(count):
             parent_conn, child_conn = multiprocessing.Pipe()
+            worker_config = {**config, "peer_authkey": self._peer_authkey, "llm_limits": self._llm_limits}
+            if worker in self.peer_routes:
+                worker_config["peer_address"] = os.path.join(self._peer_dir, f"{worker}-{next(self._peer_ids)}.sock")
             
             p = multiprocessing.Process(
                 target=Supervisor._worker_runner,
-                args=(worker, child_conn, config),  
+                args=(worker, child_conn, worker_config),  
                 daemon=False
             )
             p.start()
-            self._workers[p.pid] = {"process": p, "conn": parent_conn, "name": worker}
-            self._start_listener(p.pid)
+            self._workers[p.pid] = {
+                "process": p, "conn": parent_conn, "outbox": Outbox(parent_conn, f"{worker} ({p.pid})"), "name": worker, "closed": False, "draining": False, "remote": False,
+                # set by every message of the worker, and its running tasks by each heartbeat
+                "last_seen": None, "tasks": [],
+                "peer_address": worker_config.get("peer_address"),
+            }
+            # nothing is sent before the worker advertises its capacity, otherwise
+            # a new replica would get the whole backlog in its pipe
+            self.dispatcher.set_capacity(p.pid, 0)
             
-        running = list([pid for pid, info in self._workers.items() if info['process'].is_alive() and info['name'] == worker])
+        running = list([pid for pid, info in self._workers.items() if self._is_alive(info) and info['name'] == worker])
         log(f"{worker} running on pid(s): {running}", "success")
         self.resend_pending_messages(worker)
+        self._drain(worker)
     @staticmethod
     def _worker_runner( worker_name: str, conn: Connection, config: dict):
         try:
-            module = importlib.import_module(f"workers.{worker_name}")
+            useCodec(SupervisorConfig.get("codec", "json"))
+            # a remote worker shares no memory with the supervisor
+            useSharedMemory(0 if config.get("remote") else SupervisorConfig.get("shm_threshold", 0))
+            wal_config = SupervisorConfig.get("wal", {})
+            useKeyJournal(wal_config.get("dir") if wal_config.get("enabled") else None)
+            # a remote worker has no limiter state of the supervisor, its limits hold for it alone
+            useLlmGateway(SupervisorConfig.get("llm"), config.get("llm_limits"))
+            useLlmCache(SupervisorConfig.get("llm_cache"))
+            # fused stages share one process, see config/pipeline.py
+            module_name = "FusedWorker" if config.get("members") else worker_name
+            module = importlib.import_module(f"workers.{module_name}")
+            worker_class = getattr(module, module_name, None)
+            if worker_class is not None:
+                # each worker runs in its own process, so the class attributes are ours
+                if config.get("concurrency"):
+                    worker_class.capacity = int(config["concurrency"])
+                worker_class.heartbeat_interval = SupervisorConfig.get("heartbeat", {}).get("interval", 5)
+                worker_class.peer_address = config.get("peer_address")
+                worker_class.peer_authkey = config.get("peer_authkey", b"")
+            # the routes themselves come from the supervisor once workers are ready
+            usePeerRoutes({}, config.get("peer_authkey", b""))
             module.main(conn, config)
         except ModuleNotFoundError as e:
             print(e)
@@ -88,134 +199,565 @@ class Supervisor:
         finally:
             conn.close()
 
-    def _start_listener(self, pid: int):
-        def listen():
-            conn = self._workers[pid]["conn"]
-            while True:
-                try:
-                    message = conn.recv()
-                    self.handle_worker_message(convertMessage(message), pid)
-                except EOFError as e:
-                    log(f"Worker {pid} connection closed: {e}", "error")
-                    log(f"Connection closed for worker {self._workers[pid]['name']} ({pid})", "warn")
-                    break
-                except Exception as e:
-                    log(f"Error listening to worker {pid}: {e}", "error")
-                    break
-        t = threading.Thread(target=listen, daemon=True)
-        t.start()
-
-    def _health_loop(self):
+    def _io_loop(self):
+        """
+        Wait on all worker pipes at once and route whatever is readable.
+        Health checks run here too, so the routing state is only ever
+        touched from this thread and needs no locking.
+        """
+        next_health = time.time() + self.health_interval
+        next_scale = time.time() + self.autoscaler.interval
         while True:
-            time.sleep(10)
-            self.check_worker_health()
+            conns = {info['conn']: pid for pid, info in self._workers.items() if not info['closed']}
+            conns[self._wake_reader] = None
+            wake = min(next_health, next_scale)
+            if self.wal is not None and self.wal.deadline() is not None:
+                wake = min(wake, self.wal.deadline())
+            try:
+                ready = wait(list(conns), timeout=max(0, wake - time.time()))
+            except OSError as e:
+                # a pipe closed under us, the health check below reaps its worker
+                log(f"Error waiting on worker pipes: {e}", "error")
+                ready = []
+            for conn in ready:
+                if conn is self._wake_reader:
+                    self._accept_remote()
+                else:
+                    self._read_worker(conns[conn], conn)
+            if self.wal is not None:
+                self.wal.tick()
+            if time.time() >= next_health:
+                self.check_worker_health()
+                next_health = time.time() + self.health_interval
+            if time.time() >= next_scale:
+                self.autoscale()
+                next_scale = time.time() + self.autoscaler.interval
+
+    def _read_worker(self, pid: int, conn: Connection):
+        try:
+            frame = conn.recv_bytes()
+        except (EOFError, OSError) as e:
+            info = self._workers.get(pid)
+            if info:
+                # stop watching it, the health check replaces the worker once its process is gone
+                info['closed'] = True
+                log(f"Connection closed for worker {info['name']} ({pid}): {e}", "warn")
+            return
+        self._workers[pid]['last_seen'] = time.time()
+        try:
+            self.handle_worker_message(convertMessage(frame), pid, frame)
+        except Exception as e:
+            traceback.print_exc()
+            log(f"Error handling message from worker {pid}: {e}", "error")
 
     def check_worker_health(self):
         now = time.time()
+        self.payloads.expire()
+        self.pending.expire()
         
         for pid,metadata in list(self._workers.items()):
+            if metadata['remote']:
+                # its agent restarts it, what it had in flight goes to the other replicas
+                if metadata['closed']:
+                    log(f"Remote worker {metadata['name']} ({pid}) disconnected", "warn")
+                    self._kill_worker(pid)
+                    self.resend_pending_messages(metadata['name'])
+                elif not metadata['draining']:
+                    self._check_hung(pid, metadata, now)
+                continue
             psutil_pid = psutil.pid_exists(pid)
             process_status = psutil.Process(pid).status() if psutil_pid else None
             if not psutil_pid or process_status == psutil.STATUS_ZOMBIE or process_status == psutil.STATUS_DEAD:
                 log(f"Worker {metadata['name']} ({pid}) is not alive, removing from tracking", "warn")
                 self._kill_worker(pid)
+                if metadata['draining']:
+                    # it was being retired anyway
+                    continue
                 self.create_worker(metadata['name'], count=1, config=allConfigs.get(metadata['name'], {}))
+            elif not metadata['draining']:
+                self._check_hung(pid, metadata, now)
+
+    def _check_hung(self, pid: int, metadata: dict, now: float):
+        """Recycle a worker that stopped sending heartbeats or has a task running for too long."""
+        if metadata['last_seen'] is None:
+            # still starting, it has not even sent ready
+            return
+        silent = now - metadata['last_seen']
+        timeouts = self.heartbeat.get("task_timeout", {})
+        timeout = timeouts.get(metadata['name'], timeouts.get("default", 300))
+        stuck = [t for t in metadata['tasks'] if t.get('elapsed', 0) + silent > timeout]
+        if silent > self.heartbeat.get("silent_after", 60):
+            reason = f"no heartbeat for {silent:.0f}s"
+        elif stuck:
+            reason = ", ".join(f"{t['method']} of {t['messageId']} running for {t['elapsed'] + silent:.0f}s" for t in stuck)
+        else:
+            return
+        log(f"Worker {metadata['name']} ({pid}) looks hung ({reason}), recycling it", "error")
+        metadata['draining'] = True
+        # a request that hangs every worker it is given is dropped after max_retries.
+        # A worker blocked before its first heartbeat reports no task, blame what it had in flight
+        suspects = [t['messageId'] for t in (stuck or metadata['tasks'])] or self.dispatcher.in_flight_ids(pid)
+        for msg_id in suspects:
+            self._hangs[msg_id] = self._hangs.get(msg_id, 0) + 1
+            if self._hangs[msg_id] > self.heartbeat.get("max_retries", 2):
+                log(f"Giving up on {msg_id}, it hung {metadata['name']} {self._hangs.pop(msg_id)} times", "error")
+                self._forget_keys(self.pending.discard(metadata['name'], msg_id))
+        self._kill_worker(pid)
+        if metadata['remote']:
+            # closing its connection makes the agent restart it
+            self.resend_pending_messages(metadata['name'])
+            return
+        # the replacement gets what the hung worker had in flight
+        self.create_worker(metadata['name'], count=1, config=allConfigs.get(metadata['name'], {}))
                 
         
-    def handle_worker_message(self, message: dict, pid: int):
+    def handle_worker_message(self, message: dict, pid: int, frame: bytes = None):
         dests = message.get('destination')
         status = message.get('status')
         msg_id = message.get('messageId')
+        if status == 'ready':
+            self._on_ready(pid, message.get('data', {}))
+            return
+        if status == 'release':
+            self.payloads.release(message.get('data', {}).get('segment'))
+            return
+        if status == 'heartbeat':
+            info = self._workers.get(pid)
+            if info:
+                info['tasks'] = message.get('data', {}).get('tasks', [])
+                info['llm_cache'] = message.get('data', {}).get('llm_cache', {})
+            return
+        if status == 'cancel':
+            self._cancel(message.get('data', {}).get('token'))
+            return
+        payload = message.get('payload')
+        if payload:
+            # the copies queued below take the references, see _enqueue
+            self.payloads.register(payload['name'], payload.get('size', 0))
+        # workers that advertised a capacity free a slot only with a credit,
+        # for the others any message carrying the id we sent means it is done
+        if status == 'credit' or not self.dispatcher.is_flow_controlled(pid):
+            self._on_credit(pid, msg_id, message.get('data', {}).get('key') if status == 'credit' else None)
+        if any(dest != 'supervisor' for dest in dests):
+            reason = stopReason(message)
+            if reason:
+                # sent by a handler that had not seen the cancel yet, or too late to matter
+                log(f"Dropping {msg_id} from {self._workers.get(pid, {}).get('name')}: {reason}", "warn")
+                self._release_payload(message)
+                return
+            rejection = self.quotas.admit(self._workers.get(pid, {}).get('name'), message)
+            if rejection:
+                self._reject(pid, message, rejection)
+                return
+        busy_pid = pid if status == 'failed' and message.get('reason') == 'SERVER_BUSY' else None
         for dest in dests:
           if dest != 'supervisor':
-              self._send_to_worker(dest, message)
+              self._send_to_worker(dest, message, exclude=busy_pid, frame=frame)
           continue  
-        if status == 'completed' and dest:
-            worker_name = dest.split('/')[0].split('.')[0]
-            self.remove_pending_message(worker_name, msg_id)
+        if payload:
+            # no destination queued it
+            self.payloads.drop(payload['name'])
         
 
-    def _send_to_worker(self, destination: str, message: dict):
-        worker_name = destination.split('/')[0].split('.')[0]
-        method= destination.split('/')[1] if '/' in destination else None
+    def _on_ready(self, pid: int, data: dict):
+        info = self._workers.get(pid)
+        if not info:
+            return
+        capacity = int(data.get('capacity', 1))
+        self.dispatcher.set_capacity(pid, capacity)
+        log(f"{info['name']} ({pid}) ready with capacity {capacity}", "success")
+        if info['peer_address']:
+            # its peer socket is listening now
+            self._broadcast_routes()
+        self._drain(info['name'])
+
+    def _broadcast_routes(self):
+        """Send every worker the peer endpoints of the live replicas, see utils/peers.py."""
+        if not self.peer_routes:
+            return
+        routes = {
+            worker: {
+                "methods": methods,
+                "endpoints": [
+                    info['peer_address'] for info in self._workers.values()
+                    if info['name'] == worker and info['peer_address'] and info['last_seen']
+                    and not info['closed'] and not info['draining']
+                ],
+            }
+            for worker, methods in self.peer_routes.items()
+        }
+        frame = encodeMessage({"messageId": "routes", "status": "routes", "reason": "", "destination": [], "data": routes})
+        for pid, info in self._workers.items():
+            # peer sockets are local, remote workers keep the supervisor path
+            if info['closed'] or info['remote']:
+                continue
+            try:
+                info['outbox'].send_bytes(frame)
+            except OSError as e:
+                log(f"Failed to send peer routes to {info['name']} ({pid}): {e}", "error")
+
+    def _on_credit(self, pid: int, msg_id: str, key: str = None):
+        info = self._workers.get(pid)
+        sent_at = self.dispatcher.release(pid, msg_id)
+        if not info:
+            return
+        if sent_at is not None:
+            self.autoscaler.observe_latency(info['name'], time.time() - sent_at)
+        # the worker is done with it, nothing to resend if it dies now. The
+        # delivery may no longer be in flight, e.g. credited after a resend,
+        # its pending, quota and WAL entries are done all the same
+        self._hangs.pop(msg_id, None)
+        key = self.pending.complete(info['name'], msg_id, key)
+        if key is not None:
+            self.quotas.close(msg_id)
+        self._forget_keys([key])
+        self._drain(info['name'])
+
+    def _reject(self, pid, message: dict, rejection: dict):
+        """Answer a request over its project's quota right away, to the replica waiting for it."""
+        info = self._workers.get(pid)
+        self._release_payload(message)
+        method = self.quotas.entry_workers.get(info['name']) if info else None
+        if not method or info['closed']:
+            return
+        reply = {
+            "messageId": message.get('messageId'),
+            "status": "failed",
+            "reason": "QUOTA_EXCEEDED",
+            "destination": [f"{info['name']}/{method}"],
+            "data": rejection,
+            "priority": message.get('priority'),
+        }
+        try:
+            info['outbox'].send_bytes(encodeMessage(reply))
+        except OSError as e:
+            log(f"Failed to send quota rejection to {info['name']} ({pid}): {e}", "error")
+
+    def _release_payload(self, message: dict):
+        payload = message.get('payload')
+        if payload:
+            # dropped before any copy was queued, none of the destinations will map it
+            self.payloads.drop(payload['name'])
+
+    def _cancel(self, token: str):
+        """Drop the queued messages of the request token and tell every worker to stop it."""
+        if not token:
+            return
+        cancel(token)
+        dropped = 0
+        for worker_name, queue in self.queues.items():
+            for _, message, _ in queue.remove(lambda item: item[1].get('cancelToken') == token):
+                self._abandon(worker_name, message, f"request {token} was cancelled")
+                dropped += 1
+        log(f"Cancelled request {token}, {dropped} queued message(s) dropped", "info")
+        frame = encodeMessage({"messageId": token, "status": "cancel", "reason": "", "destination": [], "data": {"token": token}})
+        for pid, info in self._workers.items():
+            if info['closed']:
+                continue
+            try:
+                info['outbox'].send_bytes(frame)
+            except OSError as e:
+                log(f"Failed to send cancel to {info['name']} ({pid}): {e}", "error")
+
+    def _abandon(self, worker_name: str, message: dict, reason: str):
+        """Forget a queued message that will never be delivered."""
+        msg_id = message.get('messageId')
+        log(f"Dropping queued {msg_id} for {worker_name}: {reason}", "warn")
+        key = self.pending.complete(worker_name, msg_id)
+        if key is not None:
+            self.quotas.close(msg_id)
+        self._forget_keys([key])
+        if message.get('payload'):
+            self.payloads.release(message['payload']['name'])
+
+    def _on_pending_drop(self, keys: list, message: dict):
+        self.quotas.close(message.get('messageId'), len(keys))
+        self._forget_keys(keys)
+
+    def _forget_keys(self, keys: list):
+        if self.wal is None:
+            return
+        for key in keys:
+            if key:
+                self.wal.done(key)
+
+    def _send_to_worker(self, destination: str, message: dict, exclude: int = None, frame: bytes = None):
+        worker_name = hostOf(parseDestination(destination)[0])
         msg_id = message.get('messageId')
         status = message.get('status')
         reason = message.get('reason')
+        if worker_name not in self._worker_types:
+            # e.g. a reply to "error", it would wait in a queue nobody drains and hold its project's quota
+            log(f"Dropping {msg_id} for {destination}: no worker type {worker_name}", "warn")
+            return
 
         # log(f"Routing message {msg_id} to {worker_name}", "info")
-        self.track_pending_message(worker_name, message)
-
-        # Find available worker
-        available = [w for w in self._workers.values() if w['name'] == worker_name]
-        if status == 'failed' and reason == 'SERVER_BUSY':
-            # filter out busy
-            log(f"Filtering out busy workers for {worker_name}", "error")
-            available = []
+        bounced = status == 'failed' and reason == 'SERVER_BUSY'
+        if bounced:
+            # only the replica that bounced the message is skipped
+            log(f"Worker {exclude} bounced {msg_id}, requeueing for {worker_name}", "warn")
+            self.autoscaler.observe_busy(worker_name)
+            message = {**message, 'status': 'completed', 'reason': ''}
+            frame = None
+            # it was pending already when first routed
+            keys = self.pending.discard(worker_name, msg_id)
+            self.quotas.close(msg_id, len(keys))
+            self._forget_keys(keys)
 
-        if not available:
-            log(f"No available worker for destination: {destination}", "warn")
-            # retry later - fix the lambda to capture pid properly
-            def retry_message():
-                self.handle_worker_message({**message, 'status':'completed'}, 0)
-            threading.Timer(5, retry_message).start()
+        # the idempotency key travels in front of the frame, resends and replays keep it
+        key = newKey()
+        frame = withKey(key, frame if frame is not None else encodeMessage(message))
+        if not self._enqueue(worker_name, destination, message, front=bounced, frame=frame):
             return
+        self.track_pending_message(worker_name, message, frame, key)
+        # a shared memory segment does not survive a restart, so those are not logged
+        if self.wal is not None and not message.get('payload'):
+            self.wal.route(key, worker_name, destination, frame)
+        self._drain(worker_name, exclude=exclude)
+
+    def _enqueue(self, worker_name: str, destination: str, message: dict, front: bool = False, frame: bytes = None) -> bool:
+        queue = self.queues.setdefault(worker_name, PriorityQueue())
+        priority = normalizePriority(message.get('priority'))
+        if queue.depth(priority) >= self.queue_limit:
+            log(f"Queue for {worker_name} is full ({queue.depth(priority)} {priority}), dropping message {message.get('messageId')}", "error")
+            return False
+        # the frame the message arrived in is forwarded as is, no re-encoding
+        if front:
+            queue.appendleft((destination, message, frame), priority, message.get('project'))
+        else:
+            queue.append((destination, message, frame), priority, message.get('project'))
+        if message.get('payload'):
+            # held by this copy until the worker it is delivered to releases it, or _abandon
+            self.payloads.acquire(message['payload']['name'])
+        return True
+
+    def _drain(self, worker_name: str, exclude: int = None):
+        """Send queued messages for worker_name, highest priority class first, while a live replica has credit left."""
+        queue = self.queues.get(worker_name)
+        while queue:
+            destination, message, frame = queue.peek()
+            reason = stopReason(message)
+            if reason:
+                queue.popleft(message.get('priority'))
+                self._abandon(worker_name, message, reason)
+                continue
+            candidates = [
+                pid for pid, w in self._workers.items()
+                if w['name'] == worker_name and pid != exclude and not w['closed'] and not w['draining']
+                and self._is_alive(w) and self.dispatcher.has_credit(pid)
+                # a shared memory segment cannot be mapped on another host
+                and not (w['remote'] and message.get('payload'))
+            ]
+            pid = self.dispatcher.select(worker_name, candidates, destination, message)
+            if pid is None:
+                # every credit drains again, a message waiting at the head
+                # counts as one busy event however many times it is retried
+                if self._stalled.get(worker_name) is not message:
+                    self._stalled[worker_name] = message
+                    self.autoscaler.observe_busy(worker_name)
+                    log(f"No credit left for {worker_name}, queue depth: {len(queue)}", "debug")
+                return
+            self._stalled.pop(worker_name, None)
+            queue.popleft(message.get('priority'))
+            self._deliver(pid, destination, message, frame)
 
-        target = available[0]
-        log(f"Sending message to worker: {worker_name}, PID: {target['process'].pid}, Method: {method}, Message ID: {msg_id}, Status: {status}, Reason: {reason}", "info")
+    def _deliver(self, pid: int, destination: str, message: dict, frame: bytes = None):
+        target = self._workers[pid]
+        method = parseDestination(destination)[1] or None
+        msg_id = message.get('messageId')
+        log(f"Sending message to worker: {target['name']}, PID: {pid}, Method: {method}, Message ID: {msg_id}, In flight: {self.dispatcher.in_flight(pid)}, Queued: {len(self.queues.get(target['name'], ()))}", "info")
         try:
             # log(f"Sending message to worker: {worker_name}, PID: {target['process'].pid}, Method: {method}, Message ID: {msg_id}, Status: {status}, Reason: {reason}, Size data: {len(message.get('data', {}))}", "info")
-            target['conn'].send(message)
+            target['outbox'].send_bytes(frame if frame is not None else encodeMessage(message))
+            self.dispatcher.acquire(pid, msg_id)
             # log(f"Sent message {msg_id} to {worker_name} with {method} PID: {target['process'].pid}", "success")
         except Exception as e:
             traceback.print_exc()
-            log(f"Failed to send message to worker {worker_name}: {e}", "error")
+            log(f"Failed to send message to worker {target['name']}: {e}", "error")
+
+    def autoscale(self):
+        """Add or retire one replica per managed worker type, then reap retired replicas that are done."""
+        for worker_name in self.autoscaler.managed():
+            live = [
+                pid for pid, w in self._workers.items()
+                if w['name'] == worker_name and not w['closed'] and not w['draining']
+            ]
+            in_flight = sum(self.dispatcher.in_flight(pid) for pid in live)
+            step = self.autoscaler.decide(worker_name, len(live), len(self.queues.get(worker_name, ())), in_flight)
+            if step > 0:
+                self.create_worker(worker_name, count=1, config=allConfigs.get(worker_name, {}))
+            elif step < 0 and any(not self._workers[pid]['remote'] for pid in live):
+                # the least busy local replica stops receiving work and goes once it has finished,
+                # remote ones belong to their agent
+                pid = min((pid for pid in live if not self._workers[pid]['remote']), key=self.dispatcher.in_flight)
+                self._workers[pid]['draining'] = True
+                self._broadcast_routes()
+        for pid, info in list(self._workers.items()):
+            if info['draining'] and self.dispatcher.in_flight(pid) == 0:
+                log(f"Retiring {info['name']} ({pid})", "info")
+                self._kill_worker(pid)
 
-    def track_pending_message(self, worker_name: str, message: dict):
-        self.pending_messages.setdefault(worker_name, []).append(message)
+    def queue_depths(self) -> dict:
+        return {name: len(queue) for name, queue in self.queues.items()}
+
+    def metrics(self) -> dict:
+        return {
+            "queues": self.queue_depths(),
+            "queue_classes": {name: queue.depths() for name, queue in self.queues.items()},
+            "in_flight": self.dispatcher.snapshot(),
+            "pending": self.pending.snapshot(),
+            "payloads": self.payloads.snapshot(),
+            "replicas": self.replica_counts(),
+            "autoscale": self.autoscaler.snapshot(),
+            "projects": self.quotas.snapshot(),
+            "llm_cache": self.llm_cache_stats(),
+        }
+
+    def llm_cache_stats(self) -> dict:
+        """Hits and misses of the LLM cache per chain, summed over the live workers."""
+        chains = {}
+        for info in self._workers.values():
+            if info['closed']:
+                continue
+            for chain, stats in info.get('llm_cache', {}).items():
+                total = chains.setdefault(chain, {"hits": 0, "redis_hits": 0, "misses": 0})
+                for field in total:
+                    total[field] += stats.get(field, 0)
+        for total in chains.values():
+            lookups = total["hits"] + total["redis_hits"] + total["misses"]
+            total["hit_rate"] = round((total["hits"] + total["redis_hits"]) / lookups, 3) if lookups else 0.0
+        return chains
+
+    def replica_counts(self) -> dict:
+        counts = {}
+        for info in self._workers.values():
+            if not info['closed'] and not info['draining']:
+                counts[info['name']] = counts.get(info['name'], 0) + 1
+        return counts
+
+    def track_pending_message(self, worker_name: str, message: dict, frame: bytes = None, key: str = None):
+        self.pending.track(worker_name, message, frame, key)
+        self.quotas.open(message)
 
     def remove_pending_message(self, worker_name: str, message_id: str):
-        if worker_name in self.pending_messages:
-            self.pending_messages[worker_name] = [m for m in self.pending_messages[worker_name] if m.get('messageId') != message_id]
+        if self.pending.complete(worker_name, message_id) is not None:
+            self.quotas.close(message_id)
 
     def resend_pending_messages(self, worker_name: str):
-        msgs = self.pending_messages.get(worker_name, [])
+        msgs = self.pending.messages(worker_name)
+        if not msgs:
+            return
+        queued = {m.get('messageId') for _, m, _ in self.queues.get(worker_name, ())}
+        # still being processed by a live replica, a new replica must not get it again
+        running = {
+            msg_id for pid, w in self._workers.items() if w['name'] == worker_name
+            for msg_id in self.dispatcher.in_flight_ids(pid)
+        }
+        msgs = [m for m in msgs if m[0].get('messageId') not in queued and m[0].get('messageId') not in running]
         if not msgs:
             return
         log(f"Resending {len(msgs)} pending messages to {worker_name}", "info")
-        connections = [w['conn'] for w in self._workers.values() if w['name'] == worker_name]
-        if not connections:
-            log(f"No connection available for {worker_name}", "warn")
+        for msg, frame, _ in msgs:
+            destination = next((d for d in msg.get('destination', []) if hostOf(parseDestination(d)[0]) == worker_name), worker_name)
+            self._enqueue(worker_name, destination, msg, frame=frame)
+        self._drain(worker_name)
+
+    def _replay_wal(self):
+        routes = self.wal.recover()
+        if not routes:
             return
-        for msg in msgs:
+        log(f"Replaying {len(routes)} unfinished message(s) from the write-ahead log", "warn")
+        for key, worker_name, destination, frame in routes:
+            message = convertMessage(frame)
+            if not message or not self._enqueue(worker_name, destination, message, frame=frame):
+                self.wal.done(key)
+                continue
+            self.track_pending_message(worker_name, message, frame, key)
+
+    def _start_remote_listener(self, address: str, authkey: bytes):
+        host, port = address.rsplit(':', 1)
+        # the authkey handshake is serveListener's, off the accepting thread
+        listener = Listener((host, int(port)))
+        log(f"Accepting remote workers on {address}", "info")
+        # registrations come from one thread per connection
+        wake = threading.Lock()
+
+        def register(conn):
             try:
-                connections[0].send(msg)
-                log(f"Resent message {msg.get('messageId')} to {worker_name}", "success")
+                # the first message of an agent's worker says who it is
+                if not conn.poll(10):
+                    raise TimeoutError("no register message")
+                message = convertMessage(conn.recv_bytes())
+                if message.get('status') != 'register':
+                    raise ValueError(f"expected register, got {message.get('status')}")
             except Exception as e:
-                log(f"Failed to resend: {e}", "error")
+                log(f"Refused a remote worker: {e}", "warn")
+                conn.close()
+                return
+            self._joining.put((conn, message.get('data', {})))
+            with wake:
+                self._wake_writer.send_bytes(b"")
+
+        serveListener(listener, authkey, register, "remote-workers")
+
+    def _accept_remote(self):
+        """Add the remote workers that registered since the last wake up, on the I/O thread."""
+        while self._wake_reader.poll():
+            self._wake_reader.recv_bytes()
+        while not self._joining.empty():
+            conn, data = self._joining.get()
+            worker = data.get('worker')
+            pid = f"{data.get('host')}:{data.get('pid')}"
+            self._workers[pid] = {
+                "process": None, "conn": conn, "outbox": Outbox(conn, f"{worker} ({pid})"), "name": worker, "closed": False, "draining": False, "remote": True,
+                "last_seen": None, "tasks": [], "peer_address": None,
+            }
+            self.dispatcher.set_capacity(pid, 0)
+            self._worker_types.add(worker)
+            log(f"Remote worker {worker} registered as {pid}", "success")
+            self.resend_pending_messages(worker)
 
-    def _kill_worker(self, pid: int):
+    def _is_alive(self, info: dict) -> bool:
+        if info['remote']:
+            return not info['closed']
+        return info['process'].is_alive()
+
+    def _kill_worker(self, pid):
         info = self._workers.pop(pid, None)
+        self.dispatcher.forget(pid)
+        if info and info['peer_address']:
+            self._broadcast_routes()
         if info:
+            info['outbox'].close()
+        if info and info['remote']:
+            try:
+                info['conn'].close()
+            except OSError as e:
+                log(f"Error disconnecting remote worker {pid}: {e}", "error")
+        elif info:
             try:
                 info['conn'].close()
                 info['process'].terminate()
             except Exception as e:
                 log(f"Error terminating worker {pid}: {e}", "error")
 
-    def is_worker_alive(self, pid: int) -> bool:
+    def is_worker_alive(self, pid) -> bool:
         info = self._workers.get(pid)
-        return info is not None and info['process'].is_alive()
+        return info is not None and self._is_alive(info)
 
 
 if __name__ == '__main__':
     
     
-    # Add this for Windows multiprocessing support
-    multiprocessing.set_start_method('spawn', force=True)
+    # spawn unless SUPERVISOR_START_METHOD asks for forkserver and the system has it
+    method = useStartMethod(SupervisorConfig.get("start_method", "spawn"), SupervisorConfig.get("preload"))
+    log(f"Starting workers with {method}", "info")
     
     supervisor = Supervisor()
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        log("Shutting down Supervisor", "info")
\ No newline at end of file
+        log("Shutting down Supervisor", "info")
+        if supervisor.wal is not None:
+            supervisor.wal.close()
\ No newline at end of file
@@ -0,0 +1,111 @@
+import time
+
+import psutil
+
+from .log import log
+
+#########
+# Replica count of each worker type between its configured min and max.
+# The supervisor feeds it what it sees (queue depth, busy events, time
+# from delivery to credit) and applies the steps it decides: one replica
+# more under pressure, one less after a quiet period, never above the
+# memory ceiling and never twice within a cooldown.
+#########
+
+class Autoscaler:
+
+    def __init__(self, config: dict = None):
+        config = config or {}
+        self.enabled = config.get("enabled", True)
+        self.interval = config.get("interval", 5)
+        self._cooldown_up = config.get("cooldown_up", 30)
+        self._cooldown_down = config.get("cooldown_down", 120)
+        # percent of system memory above which no replica is added
+        self._memory_ceiling = config.get("memory_ceiling", 85)
+        self._defaults = {
+            "min": 1,
+            "max": 1,
+            # queued messages per live replica before adding one
+            "queue_per_replica": 4,
+            # busy events (bounce or no credit left) per interval before adding one
+            "busy_per_interval": 3,
+            # seconds from delivery to credit, averaged, before adding one
+            "target_latency": 30,
+            # seconds without queued or in-flight work before removing one
+            "idle_after": 120,
+            **config.get("defaults", {}),
+        }
+        self._workers = {name: {**self._defaults, **limits} for name, limits in config.get("workers", {}).items()}
+        self._stats: dict = {}
+
+    def managed(self) -> list:
+        return list(self._workers) if self.enabled else []
+
+    def limits(self, worker_name: str) -> dict:
+        return self._workers.get(worker_name, {})
+
+    def _stat(self, worker_name: str) -> dict:
+        return self._stats.setdefault(worker_name, {
+            "busy": 0,
+            "latency": None,
+            "last_up": 0,
+            "last_down": 0,
+            "busy_since": time.time(),
+        })
+
+    def observe_busy(self, worker_name: str) -> None:
+        self._stat(worker_name)["busy"] += 1
+
+    def observe_latency(self, worker_name: str, seconds: float) -> None:
+        stat = self._stat(worker_name)
+        # exponential moving average, recent messages weigh more
+        stat["latency"] = seconds if stat["latency"] is None else 0.8 * stat["latency"] + 0.2 * seconds
+
+    def memory_available(self) -> bool:
+        return psutil.virtual_memory().percent < self._memory_ceiling
+
+    def decide(self, worker_name: str, replicas: int, queued: int, in_flight: int) -> int:
+        """+1 to add a replica of worker_name, -1 to retire one, 0 to leave it."""
+        limits = self._workers.get(worker_name)
+        if limits is None:
+            return 0
+        stat = self._stat(worker_name)
+        now = time.time()
+        busy, stat["busy"] = stat["busy"], 0
+        if queued or in_flight:
+            stat["busy_since"] = now
+
+        if replicas < limits["min"]:
+            return 1
+        if replicas > limits["max"]:
+            return -1
+
+        reason = None
+        if queued > limits["queue_per_replica"] * max(replicas, 1):
+            reason = f"{queued} queued"
+        elif busy >= limits["busy_per_interval"]:
+            reason = f"{busy} busy events"
+        elif queued and stat["latency"] is not None and stat["latency"] > limits["target_latency"]:
+            reason = f"{stat['latency']:.1f}s per message"
+        if reason:
+            if replicas >= limits["max"] or now - stat["last_up"] < self._cooldown_up:
+                return 0
+            if not self.memory_available():
+                log(f"Not scaling {worker_name} up ({reason}), memory above {self._memory_ceiling}%", "warn")
+                return 0
+            stat["last_up"] = now
+            log(f"Scaling {worker_name} up to {replicas + 1} replica(s): {reason}", "info")
+            return 1
+
+        idle = now - stat["busy_since"]
+        if replicas > limits["min"] and idle >= limits["idle_after"] and now - max(stat["last_up"], stat["last_down"]) >= self._cooldown_down:
+            stat["last_down"] = now
+            log(f"Scaling {worker_name} down to {replicas - 1} replica(s): idle for {idle:.0f}s", "info")
+            return -1
+        return 0
+
+    def snapshot(self) -> dict:
+        return {
+            name: {"latency": stat["latency"], "idle": time.time() - stat["busy_since"]}
+            for name, stat in self._stats.items()
+        }
@@ -0,0 +1,66 @@
+import contextvars
+import time
+from collections import OrderedDict
+
+#########
+# Deadlines and cooperative cancellation. Entry points give what they send
+# an absolute "deadline" (epoch seconds) and a "cancelToken" (the chat or
+# request id), and every message a handler sends inherits both, like the
+# priority class. A cancel for a token reaches every worker through the
+# supervisor. Queued messages of the token, or past their deadline, are
+# dropped before they run. Long handlers call checkCancelled() between
+# stages to stop one that already started.
+#########
+
+# tokens cancelled in the last hour, messages still on their way carry them
+_RETENTION = 3600
+_cancelled: OrderedDict = OrderedDict()
+_current = contextvars.ContextVar("request", default=(None, None))
+
+
+class Cancelled(Exception):
+    """Raised by checkCancelled() in a handler whose request was cancelled or is past its deadline."""
+
+
+def cancel(token: str) -> None:
+    if not token:
+        return
+    _cancelled[token] = time.time()
+    _cancelled.move_to_end(token)
+    deadline = time.time() - _RETENTION
+    while _cancelled and next(iter(_cancelled.values())) < deadline:
+        _cancelled.popitem(last=False)
+
+def isCancelled(token: str) -> bool:
+    return bool(token) and token in _cancelled
+
+def stopReason(message: dict):
+    """Why message should not run anymore, None if it should."""
+    if isCancelled(message.get("cancelToken")):
+        return f"request {message['cancelToken']} was cancelled"
+    deadline = message.get("deadline")
+    if deadline and time.time() > deadline:
+        return f"deadline passed {time.time() - deadline:.1f}s ago"
+    return None
+
+def currentDeadline():
+    return _current.get()[0]
+
+def currentCancelToken():
+    return _current.get()[1]
+
+def setCurrentRequest(deadline, token):
+    """Make deadline and token the ones inherited by what the running handler sends."""
+    return _current.set((deadline, token))
+
+def remainingTime():
+    """Seconds left before the deadline of the running handler, None without one."""
+    deadline = currentDeadline()
+    return None if deadline is None else max(0.0, deadline - time.time())
+
+def checkCancelled() -> None:
+    """Raise Cancelled when the request of the running handler was cancelled or ran out of time."""
+    deadline, token = _current.get()
+    reason = stopReason({"deadline": deadline, "cancelToken": token})
+    if reason:
+        raise Cancelled(reason)
@@ -0,0 +1,78 @@
+import json
+
+from .log import log
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ormsgpack
+except ImportError:
+    ormsgpack = None
+
+#########
+# Wire format of supervisor <-> worker messages: one tag byte naming the
+# codec followed by the encoded envelope, sent with send_bytes. The tag
+# lets a reader decode any frame whatever codec it uses itself.
+#########
+
+def _jsonDumps(message) -> bytes:
+    return json.dumps(message).encode("utf-8")
+
+def _jsonLoads(body):
+    return json.loads(bytes(body))
+
+def _orjsonDumps(message) -> bytes:
+    return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS)
+
+def _msgpackDumps(message) -> bytes:
+    return ormsgpack.packb(message, option=ormsgpack.OPT_NON_STR_KEYS)
+
+CODECS = {
+    "json": (b"J", _jsonDumps, _jsonLoads),
+    "orjson": (b"O", _orjsonDumps, orjson.loads if orjson else None),
+    "msgpack": (b"M", _msgpackDumps, ormsgpack.unpackb if ormsgpack else None),
+}
+_LOADERS = {tag: loads for tag, _, loads in CODECS.values()}
+
+# a delivery frame can be prefixed with the idempotency key of the delivery
+# (16 raw bytes), so the supervisor adds it without re-encoding the message
+KEY_TAG = b"K"
+KEY_SIZE = 16
+
+_codec = "json"
+
+def isAvailable(name: str) -> bool:
+    return name in CODECS and CODECS[name][2] is not None
+
+def useCodec(name: str) -> str:
+    """Select the codec used to encode outgoing messages in this process."""
+    global _codec
+    if not isAvailable(name):
+        log(f"IPC codec '{name}' is not available, using json", "warn")
+        name = "json"
+    _codec = name
+    return name
+
+def getCodec() -> str:
+    return _codec
+
+def encodeMessage(message: dict) -> bytes:
+    tag, dumps, _ = CODECS[_codec]
+    return tag + dumps(message)
+
+def withKey(key: str, frame: bytes) -> bytes:
+    return KEY_TAG + bytes.fromhex(key) + bytes(frame)
+
+def decodeMessage(frame: bytes) -> dict:
+    tag = bytes(frame[:1])
+    if tag == KEY_TAG:
+        message = decodeMessage(memoryview(frame)[1 + KEY_SIZE:])
+        message["idempotencyKey"] = bytes(frame[1:1 + KEY_SIZE]).hex()
+        return message
+    loads = _LOADERS.get(tag)
+    if loads is None:
+        raise ValueError(f"Unknown codec tag {tag!r}")
+    return loads(memoryview(frame)[1:])
@@ -0,0 +1,149 @@
+import hashlib
+import itertools
+import time
+from typing import Optional
+
+from .log import log
+from .routeTable import parseDestination
+
+
+def getRoutingKey(destination: str, message: dict) -> str:
+    """
+    Key used by the sticky policy. Prefer the id in the destination
+    (``Worker/method/<id>``), then the chat/project id in the payload,
+    then the messageId.
+    """
+    param = parseDestination(destination)[2]
+    if param:
+        return param
+    data = message.get("data")
+    if isinstance(data, dict):
+        for field in ("chat_id", "id", "project_id", "projectId"):
+            if data.get(field):
+                return str(data[field])
+    return str(message.get("messageId", ""))
+
+
+class DispatchPolicy:
+    """Choose one pid out of the live replicas of a worker."""
+    name: str = ""
+
+    def select(self, worker_name: str, candidates: list, destination: str, message: dict, dispatcher: "Dispatcher") -> Optional[int]:
+        raise NotImplementedError
+
+
+class RoundRobinPolicy(DispatchPolicy):
+    name = "round_robin"
+
+    def __init__(self):
+        self._counters: dict = {}
+
+    def select(self, worker_name, candidates, destination, message, dispatcher):
+        counter = self._counters.setdefault(worker_name, itertools.count())
+        # pids of local workers, "host:pid" of remote ones
+        ordered = sorted(candidates, key=str)
+        return ordered[next(counter) % len(ordered)]
+
+
+class LeastInFlightPolicy(DispatchPolicy):
+    name = "least_in_flight"
+
+    def __init__(self):
+        self._tiebreak = RoundRobinPolicy()
+
+    def select(self, worker_name, candidates, destination, message, dispatcher):
+        lowest = min(dispatcher.in_flight(pid) for pid in candidates)
+        idle = [pid for pid in candidates if dispatcher.in_flight(pid) == lowest]
+        return self._tiebreak.select(worker_name, idle, destination, message, dispatcher)
+
+
+class StickyPolicy(DispatchPolicy):
+    """
+    Rendezvous hashing on the routing key, so the same chat/project keeps
+    hitting the same replica and only the keys of a removed replica move.
+    """
+    name = "sticky"
+
+    def select(self, worker_name, candidates, destination, message, dispatcher):
+        key = getRoutingKey(destination, message)
+        return max(
+            candidates,
+            key=lambda pid: hashlib.md5(f"{key}:{pid}".encode()).digest()
+        )
+
+
+POLICIES = {
+    RoundRobinPolicy.name: RoundRobinPolicy,
+    LeastInFlightPolicy.name: LeastInFlightPolicy,
+    StickyPolicy.name: StickyPolicy,
+}
+
+
+class Dispatcher:
+    """
+    Tracks the messages in flight on every worker pid and picks the replica
+    a message is sent to, using the policy configured for the worker type.
+    """
+
+    def __init__(self, policies: dict = None):
+        policies = dict(policies or {})
+        default = policies.pop("default", LeastInFlightPolicy.name)
+        self._default = self._build(default)
+        self._policies = {worker: self._build(name) for worker, name in policies.items()}
+        self._in_flight: dict = {}
+        self._capacity: dict = {}
+
+    @staticmethod
+    def _build(name: str) -> DispatchPolicy:
+        if name not in POLICIES:
+            log(f"Unknown dispatch policy '{name}', using {LeastInFlightPolicy.name}", "warn")
+            name = LeastInFlightPolicy.name
+        return POLICIES[name]()
+
+    def policy_for(self, worker_name: str) -> DispatchPolicy:
+        return self._policies.get(worker_name, self._default)
+
+    def select(self, worker_name: str, candidates: list, destination: str, message: dict) -> Optional[int]:
+        if not candidates:
+            return None
+        return self.policy_for(worker_name).select(worker_name, candidates, destination, message, self)
+
+    def in_flight(self, pid) -> int:
+        return sum(len(sent) for sent in self._in_flight.get(pid, {}).values())
+
+    def set_capacity(self, pid, capacity: int):
+        self._capacity[pid] = max(0, int(capacity))
+
+    def is_flow_controlled(self, pid) -> bool:
+        # only workers that advertised a capacity hand out credits
+        return pid in self._capacity
+
+    def has_credit(self, pid) -> bool:
+        capacity = self._capacity.get(pid)
+        return capacity is None or self.in_flight(pid) < capacity
+
+    def acquire(self, pid, message_id: str):
+        # a messageId is kept across the hops of a pipeline, so the same id
+        # can be in flight on one pid more than once
+        self._in_flight.setdefault(pid, {}).setdefault(message_id, []).append(time.time())
+
+    def release(self, pid, message_id: str) -> Optional[float]:
+        """Free the oldest delivery of message_id on pid, returns when it was sent or None if it was not in flight."""
+        messages = self._in_flight.get(pid, {})
+        sent = messages.get(message_id)
+        if not sent:
+            return None
+        sent_at = sent.pop(0)
+        if not sent:
+            messages.pop(message_id, None)
+        return sent_at
+
+    def in_flight_ids(self, pid) -> list:
+        return list(self._in_flight.get(pid, {}))
+
+    def forget(self, pid):
+        self._in_flight.pop(pid, None)
+        self._capacity.pop(pid, None)
+
+    def snapshot(self) -> dict:
+        return {pid: self.in_flight(pid) for pid in self._in_flight}
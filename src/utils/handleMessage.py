@@ -1,33 +1,177 @@
-import multiprocessing
+import multiprocessing.connection
 from .log import log
+from .codec import encodeMessage, decodeMessage
+from .sharedPayload import shouldShare, writePayload, isSharingEnabled
+from .tweetBatch import isBatch, serializeBatch
+from .peers import hasPeerRoutes, peerEndpoint, sendToPeer
+from .priority import currentPriority
+from .quota import currentProject
+from .cancellation import currentDeadline, currentCancelToken
+from .routeTable import parseDestination
 from typing import Any, Literal
+import collections
+import contextlib
+import contextvars
 import json
+import threading
+
+# handlers run on several threads, a message must not interleave with another
+_sendLock = threading.Lock()
+# worker types running in this process (workers/FusedWorker.py) and the
+# callback putting a message in their inbox, see useLocalRoutes
+_localWorkers: frozenset = frozenset()
+_deliverLocal = None
+# set while a fused worker runs a chain of stages on this thread, see runningStages
+_stageQueue = contextvars.ContextVar("stageQueue", default=None)
+
+def useLocalRoutes(workers, deliver) -> None:
+    """Messages to the worker types in workers are handed to deliver(message) instead of the supervisor."""
+    global _localWorkers, _deliverLocal
+    _localWorkers = frozenset(workers)
+    _deliverLocal = deliver
+
+@contextlib.contextmanager
+def runningStages():
+    """
+    Messages to the local worker types sent inside the block are collected,
+    as they are, in the yielded deque for the caller to run next, instead of
+    being copied into the inbox.
+    """
+    pending = collections.deque()
+    token = _stageQueue.set(pending)
+    try:
+        yield pending
+    finally:
+        _stageQueue.reset(token)
+
 def sendMessage(
   conn:multiprocessing.connection.Connection,
   messageId:str,
-  status:Literal["completed", "failed", "healthy", "unhealthy"],
+  status:Literal["completed", "failed", "healthy", "unhealthy", "ready", "credit", "release", "heartbeat", "routes", "register", "cancel"],
   reason:str = "",
   destination:list[str] = ["supervisor"],
-  data:Any = []
+  data:Any = [],
+  priority:Literal["interactive", "default", "bulk"] = None,
+  project:str = None,
+  deadline:float = None,
+  cancelToken:str = None
   ):
     message = {
         "messageId": messageId,
         "status": status,
         "reason": reason,
         "destination": destination,
-        "data": data
+        "data": data,
+        # inherited from the message being handled, see utils/priority.py
+        "priority": priority or currentPriority()
     }
-    conn.send(json.dumps(message))
+    # the projectId the request belongs to, for fair queuing and quotas, see utils/quota.py
+    project = project or currentProject()
+    if project:
+        message["project"] = project
+    # absolute epoch seconds and id of the request, see utils/cancellation.py
+    deadline = deadline or currentDeadline()
+    cancelToken = cancelToken or currentCancelToken()
+    if deadline:
+        message["deadline"] = deadline
+    if cancelToken:
+        message["cancelToken"] = cancelToken
+    if isBatch(data) and not isSharingEnabled():
+        # a remote worker has no shared memory with the supervisor, the rows go inline
+        message["data"] = data = data.to_pylist()
+    elif isBatch(data):
+        # arrow batches always go through shared memory, the codecs cannot carry them
+        message["data"] = None
+        message["payload"] = writePayload(serializeBatch(data), format="arrow")
+    if message.get("payload") is None and _localWorkers and not _sendLocally(message):
+        return
+    frame = encodeMessage(message)
+    if message.get("payload") is None and hasPeerRoutes():
+        # before sharing a large payload, whose release goes through the
+        # supervisor: a peer takes frames of any size, and a method keeps the
+        # same channel whatever the size of its messages
+        frame = _sendToPeers(message, frame)
+        if frame is None:
+            return
+    if message.get("payload") is None and shouldShare(len(frame)):
+        # only the handle goes through the pipes, see utils/sharedPayload.py
+        message["data"] = None
+        message["payload"] = writePayload(encodeMessage(data))
+        frame = encodeMessage(message)
+    with _sendLock:
+        conn.send_bytes(frame)
+
+def _sendLocally(message: dict) -> list:
+    """Deliver the destinations running in this process, return the ones left to send."""
+    destination = message["destination"]
+    local = [dest for dest in destination if parseDestination(dest)[0] in _localWorkers]
+    if not local:
+        return destination
+    pending = _stageQueue.get()
+    for dest in local:
+        if pending is not None:
+            # run next on the same thread, nothing else holds the message
+            pending.append({**message, "destination": [dest]})
+        else:
+            # through the codec, the receiving stage gets its own copy of the data
+            _deliverLocal(decodeMessage(encodeMessage({**message, "destination": [dest]})))
+    message["destination"] = [dest for dest in destination if dest not in local]
+    return message["destination"]
+
+def _sendToPeers(message: dict, frame: bytes):
+    """Send the destinations that have a peer channel directly, return the frame left for the supervisor or None."""
+    destination = message["destination"]
+    remaining = []
+    for dest in destination:
+        address = peerEndpoint(dest)
+        if address is None:
+            remaining.append(dest)
+            continue
+        peer_frame = frame if len(destination) == 1 else encodeMessage({**message, "destination": [dest]})
+        if not sendToPeer(address, peer_frame):
+            remaining.append(dest)
+    if not remaining:
+        return None
+    if len(remaining) == len(destination):
+        return frame
+    message["destination"] = remaining
+    return encodeMessage(message)
+
+def recvMessage(conn:multiprocessing.connection.Connection)->dict:
+    """Block until the next message arrives on conn and decode it."""
+    return convertMessage(conn.recv_bytes())
+
+def sendReady(conn:multiprocessing.connection.Connection, capacity:int):
+    """Tell the supervisor how many messages this worker takes at once."""
+    sendMessage(conn=conn, messageId="ready", status="ready", data={"capacity": capacity})
+
+def sendHeartbeat(conn:multiprocessing.connection.Connection, tasks:list, llmCache:dict = None):
+    """Tell the supervisor this worker is alive and what it is running, [{messageId, method, elapsed}]."""
+    sendMessage(conn=conn, messageId="heartbeat", status="heartbeat", data={"tasks": tasks, "llm_cache": llmCache or {}})
+
+def sendCredit(conn:multiprocessing.connection.Connection, messageId:str, key:str=None):
+    """Hand one credit back to the supervisor once messageId is processed, key is the idempotency key of that delivery."""
+    sendMessage(conn=conn, messageId=messageId, status="credit", data={"credits": 1, "key": key})
+
+def sendCancel(conn:multiprocessing.connection.Connection, token:str):
+    """Cancel every message of the request token, queued or running, in every worker."""
+    sendMessage(conn=conn, messageId=token, status="cancel", data={"token": token})
+
+def sendRelease(conn:multiprocessing.connection.Connection, messageId:str, segment:str):
+    """Tell the supervisor this worker is done with the shared payload segment."""
+    sendMessage(conn=conn, messageId=messageId, status="release", data={"segment": segment})
     
 def convertMessage(message)->dict:
     try:
-        if isinstance(message, str):
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            return decodeMessage(message)
+        elif isinstance(message, str):
             return json.loads(message)
         elif isinstance(message, dict):
             return message
         else:
             log(f"Unsupported message type: {type(message)}", "error")
             return {}
-    except json.JSONDecodeError as e:
+    except ValueError as e:
         log(f"Failed to decode message: {e}", "error")
         return {}
\ No newline at end of file
@@ -0,0 +1,189 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from .log import log
+
+#########
+# Answers of deterministic LLM calls, looked up before the request leaves
+# the gateway (utils/llmGateway.py). The key is a sha256 of the deployment
+# and the request body (messages and every parameter), so a different
+# prompt, model or temperature is a different entry. Nothing is cached
+# unless the call runs under llmCache(chain) or through CachedChain: a chain
+# opts in because it knows its answers can be reused. Entries live in an
+# LRU of the process, then in the Redis of CacheWorker, shared by the
+# replicas and kept across restarts.
+#########
+
+_defaults = {
+    "enabled": True,
+    # entries of the in-process tier
+    "max_entries": 2048,
+    # seconds, for the chains not listed in "chains"
+    "ttl": 3600,
+    # chain -> seconds its answers are kept, 0 turns the chain's cache off
+    "chains": {},
+    # connection of the Redis tier, None for the in-process tier only
+    "redis": None,
+}
+_PREFIX = "CACHE_LLM_"
+# seconds without the Redis tier after it failed
+_REDIS_RETRY = 60
+
+_config: dict = dict(_defaults)
+_current = contextvars.ContextVar("llmCache", default=None)
+_entries: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+_redis = None
+_redisDownUntil = 0.0
+# chain -> {"hits", "redis_hits", "misses"} since the process started
+_stats: dict = {}
+
+def useLlmCache(config: dict) -> None:
+    global _config, _redis, _redisDownUntil
+    _config = {**_defaults, **(config or {})}
+    _redis, _redisDownUntil = None, 0.0
+    with _lock:
+        _entries.clear()
+
+@contextlib.contextmanager
+def llmCache(chain: str):
+    """LLM calls inside the block are answered from the cache, under the name and TTL of chain."""
+    ttl = _config["chains"].get(chain, _config["ttl"])
+    token = _current.set((chain, ttl) if _config["enabled"] and ttl else None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class CachedChain:
+    """A langchain runnable whose LLM calls go through llmCache(name), otherwise the runnable itself."""
+
+    def __init__(self, chain, name: str):
+        self._chain = chain
+        self._name = name
+
+    def invoke(self, *args, **kwargs):
+        with llmCache(self._name):
+            return self._chain.invoke(*args, **kwargs)
+
+    async def ainvoke(self, *args, **kwargs):
+        with llmCache(self._name):
+            return await self._chain.ainvoke(*args, **kwargs)
+
+    def batch(self, *args, **kwargs):
+        # langchain copies the context into its batch threads
+        with llmCache(self._name):
+            return self._chain.batch(*args, **kwargs)
+
+    async def abatch(self, *args, **kwargs):
+        with llmCache(self._name):
+            return await self._chain.abatch(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._chain, name)
+
+def cacheKey(deployment: str, body: bytes):
+    """Key of a request body to deployment, None when no chain opted in."""
+    if _current.get() is None or not body:
+        return None
+    try:
+        # the same request serialized with its keys in another order is the same entry
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        return None
+    return hashlib.sha256(deployment.encode() + b"\n" + body).hexdigest()
+
+def lookup(key: str):
+    """The cached response body of key, or None."""
+    chain, _ = _current.get()
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] > now:
+            _entries.move_to_end(key)
+    if entry is not None and entry[0] > now:
+        _count(chain, "hits")
+        return entry[1]
+    content, ttl = _redisGet(key)
+    if content is not None:
+        _remember(key, content, now + ttl)
+        _count(chain, "redis_hits")
+        return content
+    _count(chain, "misses")
+    return None
+
+def store(key: str, content: bytes) -> None:
+    _, ttl = _current.get()
+    _remember(key, content, time.time() + ttl)
+    client = _redisClient()
+    if client is None:
+        return
+    try:
+        client.set(_PREFIX + key, content, ex=int(ttl))
+    except Exception as e:
+        _redisFailed(e)
+
+def cacheStats() -> dict:
+    with _lock:
+        return {chain: dict(stats) for chain, stats in _stats.items()}
+
+def _count(chain: str, field: str) -> None:
+    with _lock:
+        stats = _stats.setdefault(chain, {"hits": 0, "redis_hits": 0, "misses": 0})
+        stats[field] += 1
+
+def _remember(key: str, content: bytes, expires: float) -> None:
+    with _lock:
+        _entries[key] = (expires, content)
+        _entries.move_to_end(key)
+        while len(_entries) > _config["max_entries"]:
+            _entries.popitem(last=False)
+
+def _redisGet(key: str) -> tuple:
+    client = _redisClient()
+    if client is None:
+        return None, 0
+    try:
+        pipeline = client.pipeline(transaction=False)
+        pipeline.get(_PREFIX + key)
+        pipeline.ttl(_PREFIX + key)
+        content, ttl = pipeline.execute()
+    except Exception as e:
+        _redisFailed(e)
+        return None, 0
+    return (content, ttl) if content is not None and ttl > 0 else (None, 0)
+
+def _redisClient():
+    global _redis
+    settings = _config.get("redis")
+    if not settings or time.time() < _redisDownUntil:
+        return None
+    if _redis is None:
+        url = settings.get("url", "localhost")
+        options = {
+            "username": settings.get("username") or None,
+            "password": settings.get("password") or None,
+            "socket_timeout": 0.5,
+            "socket_connect_timeout": 0.5,
+        }
+        try:
+            import redis
+            if "://" in url:
+                _redis = redis.Redis.from_url(url, **options)
+            else:
+                _redis = redis.Redis(host=url, port=settings.get("port", 6379), db=settings.get("db", 0), **options)
+        except Exception as e:
+            _redisFailed(e)
+    return _redis
+
+def _redisFailed(error: Exception) -> None:
+    global _redisDownUntil
+    # a cache miss costs an LLM call, not a failed request
+    log(f"LLM cache Redis tier unavailable for {_REDIS_RETRY}s: {error}", "warn")
+    _redisDownUntil = time.time() + _REDIS_RETRY
@@ -0,0 +1,256 @@
+import asyncio
+import itertools
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+
+import httpx
+
+from .log import log
+from .llmCache import cacheKey, lookup, store
+
+#########
+# Every LLM and embedding call of the workers goes through this module's
+# HTTP clients: one pool of kept-alive connections per process, and a
+# transport that holds each request to the requests and tokens per minute
+# of its Azure deployment. The limiter state is shared memory created by
+# the supervisor, so the limits hold across all the workers together, and
+# a 429 makes every worker back off, not only the one that got it.
+#
+#   openai client      azureClient(endpoint, api_key, api_version)
+#   langchain models   AzureChatOpenAI(**gatewayKwargs(), ...)
+#
+# Answers of chains that opted in to utils/llmCache.py come from the cache
+# before the limiter is even asked.
+#########
+
+_defaults = {
+    # per deployment, 0 for no limit
+    "rpm": 0,
+    "tpm": 0,
+    # seconds of the budget that may be spent at once
+    "burst": 5,
+    # tokens an answer is expected to use when the request sets no max_tokens
+    "completion_tokens": 500,
+    # 429 responses retried, Retry-After is honoured when Azure sends it
+    "max_retries": 5,
+    "backoff": 1.0,
+    "max_backoff": 30,
+    "max_connections": 20,
+    "max_keepalive": 10,
+    # seconds an idle connection stays open
+    "keepalive_expiry": 60,
+    "timeout": 120,
+}
+_config: dict = dict(_defaults)
+_deployments: dict = {}
+_shared: dict = {}
+_limiters: dict = {}
+_lock = threading.Lock()
+_http = None
+_asyncHttp = None
+_clients: dict = {}
+_DEPLOYMENT = re.compile(r"/deployments/([^/]+)/")
+
+def useLlmGateway(config: dict, shared: dict = None) -> None:
+    """config is SupervisorConfig["llm"], shared the limiter state the supervisor created with sharedLimits."""
+    global _config, _deployments, _shared
+    config = config or {}
+    _config = {**_defaults, **{key: value for key, value in config.items() if key != "deployments"}}
+    _deployments = dict(config.get("deployments", {}))
+    _shared = dict(shared or {})
+    _limiters.clear()
+
+def sharedLimits(config: dict) -> dict:
+    """{deployment: limiter state} of the configured deployments, handed to every worker process."""
+    return {deployment: multiprocessing.Array("d", 2) for deployment in (config or {}).get("deployments", {})}
+
+
+class RateLimiter:
+    """
+    Requests and tokens per minute of one deployment, as a generic cell rate
+    algorithm. A caller reserves the next free slot under the lock and waits
+    for it outside of it, so slots go out in the order callers arrive from
+    whichever process, and a slow caller holds nobody else up.
+    """
+
+    def __init__(self, rpm: int, tpm: int, burst: float, state=None):
+        self.rpm, self.tpm, self.burst = rpm, tpm, burst
+        # epoch seconds the next request and the next token are due
+        self._state = state if state is not None else multiprocessing.Array("d", 2)
+
+    def reserve(self, tokens: int) -> float:
+        """Seconds to wait before sending a request of tokens."""
+        now = time.time()
+        with self._state.get_lock():
+            wait = self._state[0] - now - self.burst
+            for index, limit, cost in ((0, self.rpm, 1), (1, self.tpm, tokens)):
+                if limit:
+                    slot = max(self._state[index], now)
+                    self._state[index] = slot + 60.0 * cost / limit
+                    wait = max(wait, slot - now - self.burst)
+        return max(wait, 0.0)
+
+    def settle(self, reserved: int, used: int) -> None:
+        """Give back, or take, the difference between the tokens reserved and those the response reports."""
+        if self.tpm and used != reserved:
+            with self._state.get_lock():
+                self._state[1] += 60.0 * (used - reserved) / self.tpm
+
+    def pause(self, seconds: float) -> None:
+        """Nobody sends to the deployment for seconds, it answered 429."""
+        with self._state.get_lock():
+            self._state[0] = max(self._state[0], time.time() + seconds + self.burst)
+
+def limiterFor(deployment: str) -> RateLimiter:
+    with _lock:
+        limiter = _limiters.get(deployment)
+        if limiter is None:
+            limits = {**_config, **_deployments.get(deployment, {})}
+            limiter = _limiters[deployment] = RateLimiter(limits["rpm"], limits["tpm"], limits["burst"], _shared.get(deployment))
+        return limiter
+
+def _admit(request: httpx.Request) -> tuple:
+    """(deployment, estimated tokens, streamed) of an outgoing request."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except Exception:
+        body = {}
+    match = _DEPLOYMENT.search(request.url.path)
+    deployment = match.group(1) if match else (body.get("model") if isinstance(body, dict) else None) or "default"
+    # about four characters per token, plus the answer of chat requests
+    tokens = len(request.content or b"") // 4
+    if not isinstance(body, dict):
+        return deployment, tokens, False
+    if "messages" in body:
+        tokens += int(body.get("max_tokens") or body.get("max_completion_tokens") or _config["completion_tokens"])
+    return deployment, tokens, bool(body.get("stream"))
+
+def _usedTokens(response: httpx.Response, reserved: int) -> int:
+    try:
+        return int(response.json()["usage"]["total_tokens"])
+    except Exception:
+        return reserved
+
+def _cachedResponse(content: bytes) -> httpx.Response:
+    return httpx.Response(200, headers={"content-type": "application/json"}, content=content)
+
+def _retryDelay(response: httpx.Response, attempt: int) -> float:
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(response.headers[header]) * scale
+        except (KeyError, ValueError):
+            continue
+    return min(_config["max_backoff"], _config["backoff"] * 2 ** attempt) * random.uniform(0.5, 1)
+
+
+class GatewayTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        deployment, tokens, stream = _admit(request)
+        key = None if stream else cacheKey(deployment, request.content)
+        cached = lookup(key) if key else None
+        if cached is not None:
+            return _cachedResponse(cached)
+        limiter = limiterFor(deployment)
+        for attempt in itertools.count():
+            wait = limiter.reserve(tokens)
+            if wait:
+                time.sleep(wait)
+            response = self._transport.handle_request(request)
+            if response.status_code != 429 or attempt >= _config["max_retries"]:
+                break
+            delay = _retryDelay(response, attempt)
+            response.close()
+            # a throttled request spent nothing
+            limiter.settle(tokens, 0)
+            limiter.pause(delay)
+            log(f"LLM deployment {deployment} throttled, retrying in {delay:.1f}s", "warn")
+        if response.status_code == 200 and not stream:
+            response.read()
+            limiter.settle(tokens, _usedTokens(response, tokens))
+            if key:
+                store(key, response.content)
+        return response
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncGatewayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        deployment, tokens, stream = _admit(request)
+        key = None if stream else cacheKey(deployment, request.content)
+        cached = lookup(key) if key else None
+        if cached is not None:
+            return _cachedResponse(cached)
+        limiter = limiterFor(deployment)
+        for attempt in itertools.count():
+            wait = limiter.reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            response = await self._transport.handle_async_request(request)
+            if response.status_code != 429 or attempt >= _config["max_retries"]:
+                break
+            delay = _retryDelay(response, attempt)
+            await response.aclose()
+            limiter.settle(tokens, 0)
+            limiter.pause(delay)
+            log(f"LLM deployment {deployment} throttled, retrying in {delay:.1f}s", "warn")
+        if response.status_code == 200 and not stream:
+            await response.aread()
+            limiter.settle(tokens, _usedTokens(response, tokens))
+            if key:
+                store(key, response.content)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_config["max_connections"],
+        max_keepalive_connections=_config["max_keepalive"],
+        keepalive_expiry=_config["keepalive_expiry"],
+    )
+
+def httpClient() -> httpx.Client:
+    """The pooled, rate limited client of this process, safe to share between threads."""
+    global _http
+    with _lock:
+        if _http is None:
+            _http = httpx.Client(transport=GatewayTransport(httpx.HTTPTransport(limits=_limits())), timeout=_config["timeout"])
+        return _http
+
+def asyncHttpClient() -> httpx.AsyncClient:
+    global _asyncHttp
+    with _lock:
+        if _asyncHttp is None:
+            _asyncHttp = httpx.AsyncClient(transport=AsyncGatewayTransport(httpx.AsyncHTTPTransport(limits=_limits())), timeout=_config["timeout"])
+        return _asyncHttp
+
+def gatewayKwargs() -> dict:
+    """Arguments routing a langchain_openai model or embeddings through the gateway."""
+    # retries are the gateway's, a retry of the SDK would skip the shared backoff
+    return {"http_client": httpClient(), "http_async_client": asyncHttpClient(), "max_retries": 0}
+
+def azureClient(azure_endpoint: str, api_key: str, api_version: str):
+    """openai.AzureOpenAI through the gateway, one per endpoint and key in the process."""
+    from openai import AzureOpenAI
+    key = (azure_endpoint, api_key, api_version)
+    with _lock:
+        client = _clients.get(key)
+    if client is None:
+        client = AzureOpenAI(azure_endpoint=azure_endpoint, api_key=api_key, api_version=api_version, http_client=httpClient(), max_retries=0)
+        with _lock:
+            client = _clients.setdefault(key, client)
+    return client
@@ -0,0 +1,38 @@
+import threading
+
+from .log import log
+
+#########
+# NLTK data ships with the image (NLTK_DATA, see the Dockerfile) instead of
+# being downloaded when a worker module is imported. The tokenizer is
+# imported on first use, and data missing from a local checkout is
+# downloaded once per process at that point.
+#########
+
+# package -> resource nltk.data.find looks for
+_RESOURCES = {
+    "punkt_tab": "tokenizers/punkt_tab",
+}
+_ready: set = set()
+_lock = threading.Lock()
+
+def ensureNltkData(*packages: str) -> None:
+    if _ready.issuperset(packages):
+        return
+    import nltk
+    with _lock:
+        for package in packages:
+            if package in _ready:
+                continue
+            try:
+                nltk.data.find(_RESOURCES.get(package, package))
+            except LookupError:
+                log(f"NLTK data {package} is not bundled, downloading it", "warn")
+                nltk.download(package, quiet=True)
+            _ready.add(package)
+
+def wordTokenize(text: str) -> list:
+    """nltk.word_tokenize, with its punkt_tab data made available first."""
+    ensureNltkData("punkt_tab")
+    from nltk.tokenize import word_tokenize
+    return word_tokenize(text)
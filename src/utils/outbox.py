@@ -0,0 +1,48 @@
+import queue
+import threading
+
+from .log import log
+
+#########
+# What the supervisor sends a worker goes through the worker's Outbox: the
+# I/O thread only queues the frame, and a thread per connection writes it.
+# A send_bytes on the I/O thread would wait as soon as a worker's pipe is
+# full, and that worker may itself be waiting to send a credit or a
+# heartbeat the I/O thread no longer reads, a deadlock. Frames to one
+# connection keep their order.
+#########
+
+class Outbox:
+    def __init__(self, conn, name: str):
+        self._conn = conn
+        self._name = name
+        self._frames = queue.SimpleQueue()
+        self.closed = False
+        threading.Thread(target=self._write, daemon=True, name=f"outbox-{name}").start()
+
+    def send_bytes(self, frame: bytes) -> None:
+        """Queue frame for the connection, never blocks."""
+        if self.closed:
+            raise OSError(f"outbox of {self._name} is closed")
+        self._frames.put(frame)
+
+    def pending(self) -> int:
+        return self._frames.qsize()
+
+    def close(self) -> None:
+        """Stop writing once the frames queued so far are written."""
+        self.closed = True
+        self._frames.put(None)
+
+    def _write(self) -> None:
+        while True:
+            frame = self._frames.get()
+            if frame is None:
+                return
+            try:
+                self._conn.send_bytes(frame)
+            except (OSError, ValueError) as e:
+                # the I/O thread sees the pipe closed and the health check replaces the worker
+                log(f"Failed to send to {self._name}: {e}", "error")
+                self.closed = True
+                return
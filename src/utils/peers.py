@@ -0,0 +1,118 @@
+import hashlib
+import os
+import socket
+import struct
+import threading
+from multiprocessing.connection import Client, answer_challenge, deliver_challenge
+
+from .log import log
+from .routeTable import parseDestination
+
+#########
+# Opt-in worker -> worker channels. The supervisor gives every worker type
+# listed in SupervisorConfig["peer_routes"] a Unix socket per replica and
+# broadcasts the table {worker: {"methods": [...], "endpoints": [...]}}
+# to every worker. sendMessage then writes messages for those methods
+# straight to a replica, and the supervisor hop is skipped. Anything else,
+# and anything that fails to go through a peer, still goes to the
+# supervisor. Peer messages are not flow controlled, logged or replayed.
+#########
+
+_routes: dict = {}
+_authkey: bytes = b""
+_clients: dict = {}
+_clientsLock = threading.Lock()
+
+def usePeerRoutes(routes: dict, authkey: bytes = None) -> None:
+    global _routes, _authkey
+    _routes = {worker: {"methods": set(r.get("methods", [])), "endpoints": list(r.get("endpoints", []))} for worker, r in routes.items()}
+    if authkey is not None:
+        _authkey = authkey
+    # replicas that went away
+    live = {address for r in _routes.values() for address in r["endpoints"]}
+    with _clientsLock:
+        for address in [a for a in _clients if a not in live]:
+            _close(address)
+
+def hasPeerRoutes() -> bool:
+    return bool(_routes)
+
+def peerEndpoint(destination: str):
+    """Socket of the replica that takes destination directly, None when it goes through the supervisor."""
+    worker, method, key = parseDestination(destination)
+    route = _routes.get(worker)
+    if not route or method not in route["methods"] or not route["endpoints"]:
+        return None
+    # rendezvous hashing on the id, the same chat keeps going to the same replica
+    return max(route["endpoints"], key=lambda address: hashlib.md5(f"{key}:{address}".encode()).digest())
+
+def sendToPeer(address: str, frame: bytes) -> bool:
+    """Send frame on the peer channel to address, False if the peer cannot be reached."""
+    with _clientsLock:
+        entry = _clients.get(address)
+        if entry is None:
+            try:
+                entry = _clients[address] = (Client(address, family="AF_UNIX", authkey=_authkey), threading.Lock())
+            except OSError as e:
+                log(f"Peer {address} unreachable: {e}", "warn")
+                return False
+    connection, lock = entry
+    try:
+        with lock:
+            connection.send_bytes(frame)
+        return True
+    except OSError as e:
+        log(f"Peer {address} closed: {e}", "warn")
+        with _clientsLock:
+            _close(address)
+        return False
+
+def _close(address: str) -> None:
+    entry = _clients.pop(address, None)
+    if entry is not None:
+        try:
+            entry[0].close()
+        except OSError:
+            pass
+
+def serveListener(listener, authkey: bytes, onConnection, name: str, timeout: float = 10) -> None:
+    """
+    Accept connections on listener, created without an authkey, and call
+    onConnection(conn) with each that passed the authkey handshake. The
+    handshake of a connection runs on a thread of its own and gives up
+    after timeout seconds, so a client that never answers holds up nobody.
+    """
+    def handshake(conn):
+        try:
+            _receiveTimeout(conn, timeout)
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+            _receiveTimeout(conn, 0)
+        except Exception as e:
+            log(f"{name} refused a connection: {e}", "warn")
+            conn.close()
+            return
+        onConnection(conn)
+
+    def accept():
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                # the listener was closed
+                return
+            threading.Thread(target=handshake, args=(conn,), daemon=True, name=f"{name}-handshake").start()
+
+    threading.Thread(target=accept, daemon=True, name=name).start()
+
+def _receiveTimeout(conn, seconds: float) -> None:
+    """Make a blocked receive on conn fail after seconds, 0 to block again."""
+    try:
+        sock = socket.socket(fileno=os.dup(conn.fileno()))
+    except OSError:
+        # not a socket, e.g. a Windows pipe, the handshake thread waits instead
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, struct.pack("ll", int(seconds), int(seconds % 1 * 1e6)))
+    finally:
+        sock.close()
@@ -0,0 +1,129 @@
+import time
+from collections import OrderedDict
+
+from .log import log
+from .codec import encodeMessage
+
+#########
+# Messages routed to a worker type and not finished yet, so they can be
+# resent when a replica of that type is recreated. Entries are keyed by
+# messageId per worker type and kept in arrival order; completion is a
+# dict pop instead of a rebuild of the whole list.
+#########
+
+class PendingStore:
+    """Bounded, age limited pending messages with byte accounting."""
+
+    def __init__(self, limit: int = 10000, ttl: float = 900, on_drop=None):
+        self._workers: dict = {}
+        # called with the idempotency keys and the message of entries evicted or expired
+        self._on_drop = on_drop
+        self._limit = limit
+        self._ttl = ttl
+        self._entries = 0
+        self._bytes = 0
+        self._evicted = 0
+        self._expired = 0
+
+    def track(self, worker_name: str, message: dict, frame: bytes = None, key: str = None) -> None:
+        msg_id = message.get('messageId')
+        entries = self._workers.setdefault(worker_name, OrderedDict())
+        entry = entries.get(msg_id)
+        if entry is not None:
+            # the same id can come back to a worker type on a later hop,
+            # it stays pending until every delivery is done
+            self._bytes -= entry["size"]
+            entry.update(self._entry(message, frame, entry["keys"] + [key]))
+            self._bytes += entry["size"]
+            entries.move_to_end(msg_id)
+            return
+        if self._limit and self._entries >= self._limit:
+            self._evict_oldest()
+        entry = self._entry(message, frame, [key])
+        entries[msg_id] = entry
+        self._entries += 1
+        self._bytes += entry["size"]
+
+    @staticmethod
+    def _entry(message: dict, frame: bytes, keys: list) -> dict:
+        if frame is None:
+            frame = encodeMessage(message)
+        return {"message": message, "frame": frame, "key": keys[-1], "keys": keys, "size": len(frame), "created": time.time()}
+
+    def complete(self, worker_name: str, message_id: str, key: str = None):
+        """
+        Mark the delivery of message_id with idempotency key done, the
+        oldest one without a key, and return its key, None if it was not pending.
+        """
+        entries = self._workers.get(worker_name)
+        entry = entries.get(message_id) if entries else None
+        if entry is None:
+            return None
+        if key is not None and key in entry["keys"]:
+            entry["keys"].remove(key)
+        else:
+            key = entry["keys"].pop(0)
+        if not entry["keys"]:
+            self._remove(entries, message_id)
+        else:
+            # a resend carries the key of a delivery still outstanding
+            entry["key"] = entry["keys"][-1]
+        return key
+
+    def discard(self, worker_name: str, message_id: str) -> list:
+        """Forget message_id whatever its deliveries, returns their keys."""
+        entries = self._workers.get(worker_name)
+        if entries and message_id in entries:
+            return self._remove(entries, message_id)["keys"]
+        return []
+
+    def _remove(self, entries: OrderedDict, message_id: str) -> dict:
+        entry = entries.pop(message_id)
+        self._entries -= 1
+        self._bytes -= entry["size"]
+        return entry
+
+    def _dropped(self, entry: dict) -> None:
+        if self._on_drop:
+            self._on_drop([key for key in entry["keys"] if key], entry["message"])
+
+    def _evict_oldest(self) -> None:
+        worker_name, entries = min(
+            ((name, entries) for name, entries in self._workers.items() if entries),
+            key=lambda item: next(iter(item[1].values()))["created"],
+        )
+        message_id = next(iter(entries))
+        log(f"Pending store full ({self._limit}), dropping {message_id} of {worker_name}", "warn")
+        self._dropped(self._remove(entries, message_id))
+        self._evicted += 1
+
+    def messages(self, worker_name: str) -> list:
+        """(message, frame, key) of the pending messages of worker_name, oldest first."""
+        return [(e["message"], e["frame"], e["key"]) for e in self._workers.get(worker_name, {}).values()]
+
+    def expire(self) -> None:
+        # messages whose worker never finished them (crash without respawn, lost credit)
+        deadline = time.time() - self._ttl
+        for worker_name, entries in self._workers.items():
+            stale = []
+            for message_id, entry in entries.items():
+                if entry["created"] >= deadline:
+                    break
+                stale.append(message_id)
+            for message_id in stale:
+                self._dropped(self._remove(entries, message_id))
+            if stale:
+                self._expired += len(stale)
+                log(f"Expired {len(stale)} pending message(s) of {worker_name}", "warn")
+
+    def __len__(self) -> int:
+        return self._entries
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": self._entries,
+            "bytes": self._bytes,
+            "evicted": self._evicted,
+            "expired": self._expired,
+            "workers": {name: len(entries) for name, entries in self._workers.items() if entries},
+        }
@@ -0,0 +1,107 @@
+import contextvars
+import time
+
+from .quota import FairQueue
+
+#########
+# Priority classes of the message envelope. Entry points set the class of
+# what they send (REST and GraphQL chats are interactive, RabbitMQ
+# ingestion is bulk), and every message a handler sends inherits the class
+# of the message it is handling, so a whole pipeline keeps its class.
+# Queues serve the highest class first. An item that waited longer than
+# the aging limit of its class goes first anyway, so bulk work still
+# progresses under a steady stream of chats.
+#########
+
+PRIORITIES = ["interactive", "default", "bulk"]
+DEFAULT_PRIORITY = "default"
+
+# seconds an item of the class may wait before it is served ahead of higher classes
+_aging = {"default": 10, "bulk": 30}
+_processPriority = DEFAULT_PRIORITY
+_current = contextvars.ContextVar("priority", default=None)
+
+def useAging(aging: dict) -> None:
+    global _aging
+    _aging = dict(aging)
+
+def useDefaultPriority(priority: str) -> None:
+    """Class of the messages this process sends outside of a handler (HTTP routes, queue consumers)."""
+    global _processPriority
+    _processPriority = normalizePriority(priority)
+
+def normalizePriority(priority) -> str:
+    return priority if priority in PRIORITIES else DEFAULT_PRIORITY
+
+def currentPriority() -> str:
+    return _current.get() or _processPriority
+
+def setCurrentPriority(priority):
+    """Make priority the class inherited by what the running handler sends."""
+    return _current.set(normalizePriority(priority) if priority else None)
+
+
+class PriorityQueue:
+    """Queue per priority class, served highest class first with aging, projects fairly within a class."""
+
+    def __init__(self):
+        self._queues = {priority: FairQueue() for priority in PRIORITIES}
+        # (queue, aged) of the item peek returned, popleft(priority) takes the same one
+        self._peeked = None
+
+    def append(self, item, priority: str = None, project=None) -> None:
+        self._queues[normalizePriority(priority)].append(item, project)
+
+    def appendleft(self, item, priority: str = None, project=None) -> None:
+        # a bounced item goes back to the head and ages with it
+        queue = self._queues[normalizePriority(priority)]
+        queue.appendleft(item, project, queue.head()[0] if queue else None)
+
+    def _next(self) -> tuple:
+        """(queue, aged) of the next item, aged when it is the oldest of its class, overdue."""
+        now = time.time()
+        for priority in PRIORITIES[1:]:
+            queue = self._queues[priority]
+            # the oldest item, not the head: fair queuing across projects can
+            # put a newer item of another project ahead of it
+            if queue and now - queue.oldest()[0] > _aging.get(priority, float("inf")):
+                return queue, True
+        for priority in PRIORITIES:
+            if self._queues[priority]:
+                return self._queues[priority], False
+        raise IndexError("pop from an empty PriorityQueue")
+
+    def peek(self):
+        queue, aged = self._peeked = self._next()
+        return (queue.oldest() if aged else queue.head())[1]
+
+    def popleft(self, priority: str = None):
+        """Remove the next item, or of the given class the one peek returned."""
+        if priority is None:
+            queue, aged = self._next()
+        else:
+            queue = self._queues[normalizePriority(priority)]
+            aged = self._peeked is not None and self._peeked[0] is queue and self._peeked[1]
+        self._peeked = None
+        return queue.popoldest() if aged else queue.popleft()
+
+    def remove(self, predicate) -> list:
+        """Take out the items predicate is true for, whatever their class, and return them."""
+        self._peeked = None
+        return [item for queue in self._queues.values() for item in queue.remove(predicate)]
+
+    def depth(self, priority: str) -> int:
+        return len(self._queues[normalizePriority(priority)])
+
+    def depths(self) -> dict:
+        return {priority: len(queue) for priority, queue in self._queues.items()}
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def __bool__(self) -> bool:
+        return any(self._queues.values())
+
+    def __iter__(self):
+        for priority in PRIORITIES:
+            yield from self._queues[priority]
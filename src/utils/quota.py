@@ -0,0 +1,220 @@
+import contextvars
+import heapq
+import itertools
+import time
+
+from .log import log
+
+#########
+# Per project fairness and quotas. Messages carry the "project" of the
+# request that started them, inherited like the priority class. Inside a
+# priority class the queues serve projects by weighted fair queuing, so a
+# project with a thousand queued messages delays another by one message,
+# not a thousand. The supervisor also caps, per project, the requests that
+# run at once and the tokens they may spend per minute. A request over its
+# quota is rejected with QUOTA_EXCEEDED as soon as it enters the system.
+#########
+
+_defaults = {
+    # share of the queues relative to other projects
+    "weight": 1,
+    # requests of the project running at once, 0 for no limit
+    "concurrency": 0,
+    # tokens the project may spend per minute, 0 for no limit
+    "tokens_per_minute": 0,
+    # tokens a request is expected to cost on top of its own text
+    "tokens_per_request": 2000,
+}
+_projects: dict = {}
+_current = contextvars.ContextVar("project", default=None)
+
+def useQuotas(config: dict) -> None:
+    global _defaults, _projects
+    _defaults = {**_defaults, **config.get("defaults", {})}
+    _projects = dict(config.get("projects", {}))
+
+def projectLimits(project) -> dict:
+    return {**_defaults, **_projects.get(project, {})}
+
+def currentProject():
+    return _current.get()
+
+def setCurrentProject(project):
+    """Make project the one inherited by what the running handler sends."""
+    return _current.set(project or None)
+
+def estimateTokens(message: dict, limits: dict) -> int:
+    # about four characters per token, the pipeline's own prompts are in tokens_per_request
+    payload = message.get("payload")
+    size = payload.get("size", 0) if payload else len(str(message.get("data", "")))
+    return limits["tokens_per_request"] + size // 4
+
+
+class QuotaExceeded(Exception):
+    """Raised by the entry workers when the supervisor rejected a request of a project over its quota."""
+
+    def __init__(self, rejection: dict):
+        self.rejection = rejection or {}
+        super().__init__(self.rejection.get("error", "QUOTA_EXCEEDED"))
+
+
+class FairQueue:
+    """FIFO per project, served by weighted fair queuing on virtual finish times."""
+
+    def __init__(self):
+        self._heap: list = []
+        self._finish: dict = {}
+        self._virtual = 0.0
+        self._seq = itertools.count()
+
+    def append(self, item, project=None, enqueued: float = None) -> None:
+        start = max(self._virtual, self._finish.get(project, 0.0))
+        finish = self._finish[project] = start + 1.0 / max(projectLimits(project)["weight"], 0.001)
+        heapq.heappush(self._heap, (finish, next(self._seq), enqueued or time.time(), item))
+
+    def appendleft(self, item, project=None, enqueued: float = None) -> None:
+        # ahead of everything queued, a bounced message keeps its turn
+        finish = self._heap[0][0] if self._heap else self._virtual
+        heapq.heappush(self._heap, (finish, -next(self._seq), enqueued or time.time(), item))
+
+    def head(self) -> tuple:
+        """(enqueued, item) of the next item."""
+        _, _, enqueued, item = self._heap[0]
+        return enqueued, item
+
+    def oldest(self) -> tuple:
+        """(enqueued, item) of the item waiting the longest, whatever its turn."""
+        _, _, enqueued, item = min(self._heap, key=lambda entry: entry[2])
+        return enqueued, item
+
+    def popleft(self):
+        finish, _, _, item = heapq.heappop(self._heap)
+        self._virtual = finish
+        self._idle()
+        return item
+
+    def popoldest(self):
+        """Remove the item oldest() returned, out of its turn."""
+        entry = min(self._heap, key=lambda entry: entry[2])
+        self._heap.remove(entry)
+        heapq.heapify(self._heap)
+        self._idle()
+        return entry[3]
+
+    def _idle(self) -> None:
+        if not self._heap:
+            # idle, nobody has a backlog to be compared with
+            self._finish.clear()
+            self._virtual = 0.0
+
+    def remove(self, predicate) -> list:
+        """Take out the items predicate is true for and return them."""
+        removed = [entry[3] for entry in self._heap if predicate(entry[3])]
+        if removed:
+            self._heap = [entry for entry in self._heap if not predicate(entry[3])]
+            heapq.heapify(self._heap)
+        return removed
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __iter__(self):
+        for _, _, _, item in sorted(self._heap):
+            yield item
+
+
+class ProjectQuotas:
+    """Admission of new requests per project at the supervisor."""
+
+    def __init__(self, config: dict = None):
+        config = config or {}
+        useQuotas(config)
+        self.enabled = config.get("enabled", True)
+        # worker type -> method the rejection is sent to. Only messages from
+        # these start requests, anything else continues one and is never rejected
+        self.entry_workers = config.get("entry_workers", {})
+        # cancelToken (messageId without one) -> [project, messageIds of the request routed and not finished]
+        self._requests: dict = {}
+        # messageId -> [request, deliveries routed and not finished]
+        self._messages: dict = {}
+        self._stats: dict = {}
+
+    def _stat(self, project) -> dict:
+        return self._stats.setdefault(project, {
+            "running": 0,
+            "tokens": float(projectLimits(project)["tokens_per_minute"]),
+            "refilled": time.time(),
+            "rejected": 0,
+        })
+
+    def admit(self, origin: str, message: dict):
+        """None when message may enter, else the rejection {error, projectId, retryAfter}."""
+        project = message.get("project")
+        msg_id = message.get("messageId")
+        if not self.enabled or not project or origin not in self.entry_workers or self._request(message) in self._requests:
+            return None
+        limits = projectLimits(project)
+        stat = self._stat(project)
+        now = time.time()
+        rate = limits["tokens_per_minute"] / 60
+        if rate:
+            stat["tokens"] = min(limits["tokens_per_minute"], stat["tokens"] + (now - stat["refilled"]) * rate)
+        stat["refilled"] = now
+
+        error, retry_after = None, 0
+        if limits["concurrency"] and stat["running"] >= limits["concurrency"]:
+            error, retry_after = f"{stat['running']} requests running, the limit is {limits['concurrency']}", 1
+        elif rate:
+            cost = estimateTokens(message, limits)
+            if stat["tokens"] < cost:
+                error, retry_after = f"token budget of {limits['tokens_per_minute']} per minute spent", (cost - stat["tokens"]) / rate
+            else:
+                stat["tokens"] -= cost
+        if error is None:
+            return None
+        stat["rejected"] += 1
+        log(f"Rejecting {msg_id} of project {project} from {origin}: {error}", "warn")
+        return {"error": f"QUOTA_EXCEEDED: {error}", "projectId": project, "retryAfter": round(retry_after, 1)}
+
+    @staticmethod
+    def _request(message: dict):
+        # the messages a handler sends carry the cancelToken of the request, whatever their id
+        return message.get("cancelToken") or message.get("messageId")
+
+    def open(self, message: dict) -> None:
+        """One more delivery of a message of the request is routed."""
+        project = message.get("project")
+        if not self.enabled or not project:
+            return
+        msg_id = message.get("messageId")
+        entry = self._messages.get(msg_id)
+        if entry is None:
+            request_id = self._request(message)
+            request = self._requests.get(request_id)
+            if request is None:
+                request = self._requests[request_id] = [project, 0]
+                self._stat(project)["running"] += 1
+            request[1] += 1
+            entry = self._messages[msg_id] = [request_id, 0]
+        entry[1] += 1
+
+    def close(self, msg_id: str, count: int = 1) -> None:
+        """count deliveries of msg_id are done, its request is once none of its messages is left."""
+        entry = self._messages.get(msg_id)
+        if entry is None:
+            return
+        entry[1] -= count
+        if entry[1] > 0:
+            return
+        del self._messages[msg_id]
+        request = self._requests[entry[0]]
+        request[1] -= 1
+        if request[1] <= 0:
+            del self._requests[entry[0]]
+            self._stat(request[0])["running"] -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            project: {"running": stat["running"], "tokens": round(stat["tokens"]), "rejected": stat["rejected"]}
+            for project, stat in self._stats.items()
+        }
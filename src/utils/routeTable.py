@@ -0,0 +1,55 @@
+import functools
+import inspect
+
+#########
+# Destinations ("Worker/method/param") are parsed once and cached, and the
+# stages of config/pipeline.py are compiled into handler references when a
+# worker starts, instead of a split('/') and a getattr per message.
+#########
+
+# worker type -> worker type of the process it runs in, for fused stages
+_hosts: dict = {}
+
+@functools.lru_cache(maxsize=4096)
+def parseDestination(destination: str) -> tuple:
+    """(worker, method, param) of a destination, method and param empty when absent."""
+    parts = destination.split('/')
+    return (
+        parts[0].split('.')[0],
+        parts[1] if len(parts) > 1 else "",
+        parts[2] if len(parts) > 2 else "",
+    )
+
+def stage(name: str, param: str = "") -> str:
+    """Destination of the stage declared as name in config/pipeline.py."""
+    from config.pipeline import Stages
+    return f"{Stages[name]}/{param}"
+
+def useFusedWorkers(fused: dict) -> None:
+    """fused is {host: [worker types]}, the listed types run inside the host's process."""
+    global _hosts
+    _hosts = {member: host for host, members in fused.items() for member in members}
+
+def hostOf(worker_name: str) -> str:
+    return _hosts.get(worker_name, worker_name)
+
+def compileRoutes(instance, worker_name: str = None) -> dict:
+    """
+    {method: (instance, handler, is_coroutine)} of the public methods of
+    instance, the stage handlers of config/pipeline.py checked to exist.
+    """
+    from config.pipeline import Stages
+    from .log import log
+    worker_name = worker_name or type(instance).__name__
+    routes = {}
+    for name in dir(type(instance)):
+        # looked up on the class, properties are not evaluated
+        if name.startswith('_') or not callable(inspect.getattr_static(type(instance), name, None)):
+            continue
+        handler = getattr(instance, name)
+        routes[name] = (instance, handler, inspect.iscoroutinefunction(handler))
+    for stage_name, destination in Stages.items():
+        worker, method, _ = parseDestination(destination)
+        if worker == worker_name and method not in routes:
+            log(f"Stage {stage_name} routes to {destination}, {worker_name} has no method {method}", "error")
+    return routes
@@ -0,0 +1,133 @@
+import gc
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from .log import log
+
+#########
+# Payloads larger than the threshold are written once to a shared memory
+# segment by the sender; only a handle {"name", "size"} travels through the
+# supervisor. Every delivery maps the segment, then sends a "release"
+# once its handler is done and the supervisor unlinks the segment after
+# the last release.
+#########
+
+_threshold = 1024 * 1024
+
+def useSharedMemory(threshold: int) -> None:
+    """Payloads bigger than threshold bytes go through shared memory, 0 disables it."""
+    global _threshold
+    _threshold = int(threshold)
+
+def isSharingEnabled() -> bool:
+    return _threshold > 0
+
+def shouldShare(size: int) -> bool:
+    return _threshold > 0 and size > _threshold
+
+def _untrack(segment: SharedMemory) -> None:
+    # the resource tracker of this process would unlink the segment when the
+    # process exits, the supervisor owns it instead
+    try:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+
+def writePayload(body, format: str = None) -> dict:
+    """Copy body (any bytes-like object) into a new segment and return its handle."""
+    segment = SharedMemory(create=True, size=len(body))
+    try:
+        segment.buf[:len(body)] = memoryview(body).cast("B")
+    except Exception:
+        segment.close()
+        segment.unlink()
+        raise
+    _untrack(segment)
+    segment.close()
+    handle = {"name": segment.name, "size": len(body)}
+    if format:
+        handle["format"] = format
+    return handle
+
+def openPayload(handle: dict) -> tuple:
+    """
+    Map the segment of handle. Returns (segment, view) where view is a
+    memoryview over the payload; close the segment once done with it.
+    """
+    segment = SharedMemory(name=handle["name"])
+    _untrack(segment)
+    return segment, segment.buf[:handle["size"]]
+
+def closePayload(segment: SharedMemory, view: memoryview = None) -> None:
+    for attempt in range(2):
+        try:
+            if view is not None:
+                view.release()
+            segment.close()
+            return
+        except BufferError:
+            # objects read from the buffer can sit in a reference cycle
+            gc.collect()
+    # something still holds a view on the buffer, it goes with the process
+    log(f"Shared payload {segment.name} still in use, leaving it mapped", "warn")
+
+def unlinkPayload(name: str) -> None:
+    try:
+        segment = SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+
+class PayloadRegistry:
+    """
+    Supervisor side bookkeeping: how many copies of the message still hold
+    each segment. Every copy queued for a worker, first routed or resent,
+    takes a reference and the worker it is delivered to gives it back with
+    its release, whether it ran the message, skipped or dropped it.
+    """
+
+    def __init__(self, ttl: float = 600):
+        self._segments: dict = {}
+        self._ttl = ttl
+
+    def register(self, name: str, size: int = 0) -> None:
+        # a segment seen again, e.g. a resent message, keeps its references
+        self._segments.setdefault(name, {"refs": 0, "size": size, "created": time.time()})
+
+    def acquire(self, name: str) -> None:
+        entry = self._segments.get(name)
+        if entry is not None:
+            entry["refs"] += 1
+
+    def release(self, name: str) -> None:
+        entry = self._segments.get(name)
+        if entry is None:
+            return
+        entry["refs"] -= 1
+        if entry["refs"] <= 0:
+            self._segments.pop(name, None)
+            unlinkPayload(name)
+
+    def drop(self, name: str) -> None:
+        """Unlink the segment if no queued or delivered copy holds it."""
+        entry = self._segments.get(name)
+        if entry is not None and entry["refs"] <= 0:
+            self._segments.pop(name, None)
+            unlinkPayload(name)
+
+    def expire(self) -> None:
+        # destinations that died before releasing would leak the segment
+        deadline = time.time() - self._ttl
+        for name in [n for n, e in self._segments.items() if e["created"] < deadline]:
+            log(f"Shared payload {name} was never released by every destination, unlinking it", "warn")
+            self._segments.pop(name, None)
+            unlinkPayload(name)
+
+    def snapshot(self) -> dict:
+        return {
+            "segments": len(self._segments),
+            "bytes": sum(e["size"] for e in self._segments.values()),
+        }
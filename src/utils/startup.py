@@ -0,0 +1,24 @@
+import multiprocessing
+
+from .log import log
+
+#########
+# How worker processes are started. "spawn" starts every worker from an
+# empty interpreter, which imports langchain, pandas, openai... again each
+# time. "forkserver" imports the preload list once in a server process and
+# forks the workers from it: a worker or a restart only imports what is
+# specific to it, and the preloaded modules stay shared copy-on-write
+# between the workers instead of being duplicated in each of them.
+#########
+
+def useStartMethod(method: str = "forkserver", preload: list = None) -> str:
+    """Set the start method of worker processes, returns the one in use."""
+    if method not in multiprocessing.get_all_start_methods():
+        # forkserver needs a Unix system
+        log(f"Start method {method} is not available here, using spawn", "warn")
+        method = "spawn"
+    multiprocessing.set_start_method(method, force=True)
+    if method == "forkserver" and preload:
+        # a module missing from this install is skipped by the server
+        multiprocessing.set_forkserver_preload(list(preload))
+    return method
@@ -10,6 +10,7 @@ class GraphState(TypedDict):
         generation: LLM generation
         web_search: whether to add search
         documents: list of documents
+        chat_id: chat the run belongs to, used to address progress updates
     """
 
     question: str
@@ -23,4 +24,5 @@ class GraphState(TypedDict):
     previous_opinion: str
     round_count: int
     question: str
-    final_decision: Optional[str]
\ No newline at end of file
+    final_decision: Optional[str]
+    chat_id: str
\ No newline at end of file
@@ -0,0 +1,50 @@
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+#########
+# Tweets travel between workers as one Arrow record batch instead of a list
+# of dicts: DatabaseInteractionWorker builds it straight from the cursor,
+# sendMessage ships it through shared memory and the consumers read it
+# from the mapped buffer without copying.
+#########
+
+TWEET_COLUMNS = ["full_text", "tweet_url", "projectId"]
+TWEET_PROJECTION = {column: 1 for column in TWEET_COLUMNS}
+
+def isAvailable() -> bool:
+    return pa is not None
+
+def isBatch(data) -> bool:
+    return pa is not None and isinstance(data, (pa.RecordBatch, pa.Table))
+
+def toTweetBatch(documents):
+    """Build a record batch of TWEET_COLUMNS from an iterable of tweet documents, in one pass."""
+    columns = {column: [] for column in TWEET_COLUMNS}
+    for doc in documents:
+        for column, values in columns.items():
+            value = doc.get(column)
+            values.append(None if value is None else str(value))
+    return pa.RecordBatch.from_pydict(
+        columns, schema=pa.schema([(column, pa.string()) for column in TWEET_COLUMNS])
+    )
+
+def serializeBatch(batch):
+    """Arrow IPC stream of batch, as a pyarrow Buffer."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write(batch)
+    return sink.getvalue()
+
+def readBatch(buffer):
+    """Open a serialized batch over buffer (bytes or memoryview) without copying it."""
+    return pa.ipc.open_stream(pa.py_buffer(buffer)).read_all()
+
+def tweetColumn(tweets, column: str) -> list:
+    """Values of one column, for a batch or the older list of dicts."""
+    if isBatch(tweets):
+        if column not in tweets.schema.names:
+            return [""] * tweets.num_rows
+        return [value or "" for value in tweets.column(column).to_pylist()]
+    return [doc.get(column, "") or "" for doc in tweets if isinstance(doc, dict)]
@@ -0,0 +1,239 @@
+import base64
+import glob
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from .log import log
+
+#########
+# Durability of routed messages across supervisor restarts.
+#
+# The supervisor appends a "route" record for every message it queues for
+# a worker and a "done" record once that worker sends its credit. Writes
+# are buffered and fsynced in batches from the I/O loop. On startup the
+# records without "done" are queued again.
+#
+# Every delivery carries an idempotency key, fixed when the message is
+# first queued and kept by resends and replays (see codec.withKey). Workers remember the keys they finished and
+# skip a message they already ran. Workers with expensive stages also
+# append the keys to a journal on disk, so after a crash the supervisor
+# drops the replays those workers had already finished.
+#########
+
+def newKey() -> str:
+    return uuid.uuid4().hex
+
+
+class WriteAheadLog:
+    """Append-only log of the messages routed to workers and not finished yet."""
+
+    def __init__(self, directory: str, fsync_interval: float = 0.05, fsync_batch: int = 64, compact_bytes: int = 64 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, "supervisor.wal")
+        self._fsync_interval = fsync_interval
+        self._fsync_batch = fsync_batch
+        self._compact_bytes = compact_bytes
+        self._buffer: list = []
+        self._buffered_at = None
+        # key -> route record line, what a compaction keeps
+        self._live: OrderedDict = OrderedDict()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def route(self, key: str, worker_name: str, destination: str, frame: bytes) -> None:
+        line = json.dumps({
+            "op": "route",
+            "key": key,
+            "worker": worker_name,
+            "destination": destination,
+            "frame": base64.b64encode(frame).decode("ascii"),
+        })
+        self._live[key] = line
+        self._append(line)
+
+    def done(self, key: str) -> None:
+        if self._live.pop(key, None) is None:
+            return
+        self._append(json.dumps({"op": "done", "key": key}))
+
+    def _append(self, line: str) -> None:
+        self._buffer.append(line)
+        if self._buffered_at is None:
+            self._buffered_at = time.time()
+        if len(self._buffer) >= self._fsync_batch:
+            self.flush()
+
+    def deadline(self):
+        """Time by which the buffered records must be flushed, None when there are none."""
+        if self._buffered_at is None:
+            return None
+        return self._buffered_at + self._fsync_interval
+
+    def tick(self) -> None:
+        deadline = self.deadline()
+        if deadline is not None and time.time() >= deadline:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        self._file.write("\n".join(self._buffer) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer.clear()
+        self._buffered_at = None
+        if self._compact_bytes and self._file.tell() > self._compact_bytes:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the log with only the routes still outstanding."""
+        self.flush()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as out:
+            for line in self._live.values():
+                out.write(line + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+        self._file.close()
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        trimKeyJournals(self.directory, set(self._live))
+
+    def recover(self) -> list:
+        """
+        Read back the routes that never got their "done", oldest first, as
+        (key, worker_name, destination, frame). Routes a worker journaled as
+        finished are dropped, then the log and the journals are compacted.
+        """
+        outstanding: OrderedDict = OrderedDict()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a record torn by the crash can only be the last one
+                    log(f"Skipping unreadable WAL record at line {number}", "warn")
+                    continue
+                if record.get("op") == "route":
+                    outstanding[record["key"]] = line.rstrip("\n")
+                else:
+                    outstanding.pop(record.get("key"), None)
+        finished = readKeyJournals(self.directory)
+        routes = []
+        for key, line in outstanding.items():
+            if key in finished:
+                continue
+            record = json.loads(line)
+            self._live[key] = line
+            routes.append((key, record["worker"], record["destination"], base64.b64decode(record["frame"])))
+        self.compact()
+        return routes
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+#########
+# worker side
+#########
+
+_journal_dir = None
+
+def useKeyJournal(directory: str) -> None:
+    """Directory of the finished key journals of this process, None disables them."""
+    global _journal_dir
+    _journal_dir = directory or None
+
+def readKeyJournals(directory: str) -> set:
+    keys = set()
+    # rotated journals are still read, a crash can come before they are trimmed
+    for path in glob.glob(os.path.join(directory, "*.keys")) + glob.glob(os.path.join(directory, "*.rotated")):
+        with open(path, "r", encoding="utf-8") as f:
+            keys.update(line.strip() for line in f if line.strip())
+    return keys
+
+_TRIMMED = "trimmed.keys"
+
+def trimKeyJournals(directory: str, keep: set) -> None:
+    """
+    Rotate the worker journals away from their path, then write the keys
+    still in keep to one trimmed journal and remove the rotated files.
+    Workers notice the rotation on their next key and reopen the path,
+    see FinishedKeys.add, nothing is rewritten under an open handle.
+    """
+    trimmed = os.path.join(directory, _TRIMMED)
+    for path in glob.glob(os.path.join(directory, "*.keys")):
+        if path == trimmed:
+            continue
+        try:
+            os.replace(path, f"{path}.{time.time_ns()}.rotated")
+        except OSError as e:
+            # Windows refuses to rename a file a worker has open, it is trimmed once that worker is gone
+            log(f"Could not rotate key journal {path}: {e}", "debug")
+    rotated = glob.glob(os.path.join(directory, "*.rotated"))
+    keys = set()
+    for path in rotated + [trimmed]:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                keys.update(line.strip() for line in f if line.strip() in keep)
+    tmp = trimmed + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as out:
+        out.write("".join(key + "\n" for key in keys))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, trimmed)
+    for path in rotated:
+        os.remove(path)
+
+
+class FinishedKeys:
+    """
+    Idempotency keys a worker already ran, the last `limit` in memory.
+    With a journal name the keys are also appended, fsynced, to
+    <journal dir>/<name>.keys before the worker sends its credit.
+    """
+
+    def __init__(self, journal: str = None, limit: int = 4096):
+        self._keys: OrderedDict = OrderedDict()
+        self._limit = limit
+        self._file = None
+        self._path = None
+        if journal and _journal_dir:
+            os.makedirs(_journal_dir, exist_ok=True)
+            self._path = os.path.join(_journal_dir, f"{journal}.keys")
+            self._file = open(self._path, "a", encoding="utf-8")
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def add(self, key: str) -> None:
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        if len(self._keys) > self._limit:
+            self._keys.popitem(last=False)
+        if self._file is not None:
+            self._write(key)
+            if not self._current():
+                # the supervisor rotated the journal, maybe after reading it,
+                # the key goes to the new file too
+                self._file.close()
+                self._file = open(self._path, "a", encoding="utf-8")
+                self._write(key)
+
+    def _write(self, key: str) -> None:
+        self._file.write(key + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _current(self) -> bool:
+        try:
+            return os.stat(self._path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
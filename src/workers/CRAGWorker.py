@@ -27,16 +27,21 @@ from langchain_mongodb import MongoDBAtlasVectorSearch
 from pymongo import MongoClient
 import os
 from uuid import uuid4
-from nltk.tokenize import word_tokenize
 import traceback
 from multiprocessing.connection import Connection
 import threading
 import time
+import hashlib
 from  utils.log import log 
 from utils.handleMessage import sendMessage, convertMessage
+from utils.routeTable import stage
+from utils.llmGateway import gatewayKwargs
+from utils.llmCache import CachedChain
+from utils.cancellation import checkCancelled
+from utils.nltkData import wordTokenize
 
 from .Worker import Worker
-from prompt.RetrievalEvaluator import grade_prompt, GradeDocuments
+from prompt.RetrievalEvaluator import grade_prompt, GradeDocuments, batch_grade_prompt, GradeDocumentsBatch, number_documents
 from prompt.LeaderPrompt import leader_prompt
 from prompt.SkepticPrompt import skeptic_prompt
 from prompt.TrustPrompt import trust_prompt
@@ -44,8 +49,10 @@ from prompt.KeywordExtractor import re_write_prompt
 from prompt.PromptExtract import prompt_extrac
 from prompt.GenerateAnswer import prompt
 from utils.state import GraphState
-import nltk
-nltk.download('punkt_tab')
+
+
+# final_classification of the retrieval grader, by its lowercase
+GRADES = {"benar": "Benar", "salah": "Salah", "ambigu": "Ambigu"}
 
 
 class CRAGWorker(Worker):
@@ -55,8 +62,16 @@ class CRAGWorker(Worker):
     route_base = "/"
     conn:Connection
     requests: dict = {}
-    isBusy: bool = False
+    durable_keys: bool = True
+    handler_args: dict = {"id": "id", "data": "data", "mId": "messageId"}
     process_name: str = "Reduce information hallucinations by applying CRAG."
+    # retrieval_grader calls in flight at once for one chat
+    grading_concurrency: int = 5
+    # "concurrent" grades each document in its own request, "batched" several
+    # documents per request, up to grading_batch_size and grading_batch_tokens
+    grading_mode: str = "concurrent"
+    grading_batch_size: int = 10
+    grading_batch_tokens: int = 6000
     def __init__(self):
         # we'll assign these in run()
         self._port: int = None
@@ -78,16 +93,22 @@ class CRAGWorker(Worker):
             self.collection_name = config.get("collection_name", "vectorstores")
             
             self.connection_string = config.get("connection_string", "mongodb://localhost:27017/") 
+            self.grading_concurrency = config.get("grading_concurrency", self.grading_concurrency)
+            self.grading_mode = config.get("grading_mode", self.grading_mode)
+            self.grading_batch_size = config.get("grading_batch_size", self.grading_batch_size)
+            self.grading_batch_tokens = config.get("grading_batch_tokens", self.grading_batch_tokens)
             os.environ["AZURE_OPENAI_API_KEY"] = config['azure_openai_api_key']
             os.environ["TAVILY_API_KEY"] = config['tavily_api_key']
 
             self.llm = AzureChatOpenAI(
+                **gatewayKwargs(),
                 azure_endpoint= config['azure_openai_endpoint'],
                 azure_deployment=config['azure_openai_deployment_name'],
                 openai_api_version=config['azure_openai_api_version'],
                 temperature=0,
             )
             self.embeddings = AzureOpenAIEmbeddings(
+                **gatewayKwargs(),
                 azure_endpoint= config['azure_openai_endpoint'],
                 azure_deployment=config['azure_openai_deployment_name_embedding'],
                 openai_api_version= config['azure_openai_embedding_api_version'],
@@ -96,11 +117,17 @@ class CRAGWorker(Worker):
             
             self.web_search_tool = TavilySearchResults(max_results=5)
             self.rag_chain = prompt | self.llm | StrOutputParser()
-            self.keyword_extractor = re_write_prompt | self.llm | StrOutputParser()
+            # temperature 0 and asked again for the same question / document pairs, see utils/llmCache.py
+            self.keyword_extractor = CachedChain(re_write_prompt | self.llm | StrOutputParser(), "keyword_extractor")
             self.leader_chain = leader_prompt | self.llm | StrOutputParser()
             self.extract_chain = prompt_extrac | self.llm | StrOutputParser()
             self.structured_llm_grader = self.llm.with_structured_output(GradeDocuments)
-            self.retrieval_grader = grade_prompt | self.structured_llm_grader
+            self.retrieval_grader = CachedChain(grade_prompt | self.structured_llm_grader, "retrieval_grader")
+            self.batch_grader = CachedChain(batch_grade_prompt | self.llm.with_structured_output(GradeDocumentsBatch), "retrieval_grader")
+            # strips of knowledge_refinement, the tiktoken encoding is loaded once
+            self.text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+                chunk_size=256, chunk_overlap=0
+            )
             self.skeptic_chain = skeptic_prompt | self.llm | StrOutputParser()
             self.trust_chain = trust_prompt | self.llm | StrOutputParser()
             base_dir = os.path.dirname(os.path.abspath(__file__))  # path ke file ini
@@ -182,46 +209,6 @@ class CRAGWorker(Worker):
             print(e)
             log(f"Failed to connect to CRAGWorker: {e}", "error")
 
-    async def listen_task(self):
-        print("CRAGWorker is listening for messages...")
-        while True:
-            try:
-            # Change poll(1) to poll(0.1) to reduce blocking time
-                if CRAGWorker.conn.poll(1):  # Shorter timeout
-                    message = self.conn.recv()
-                    log(f"CRAGWorker received messageId :{message['messageId']}", "info")
-                    log(f"CRAGWorker Status busy: {CRAGWorker.isBusy}", "debug")
-                    if(CRAGWorker.isBusy):
-                        log("CRAGWorker is busy, ignoring message.",'error')
-                        self.sendToOtherWorker(
-                            messageId=message.get("messageId"),
-                            destination=message.get("destination", []),
-                            data=message.get("data", {}),
-                            status="failed",
-                            reason="SERVER_BUSY"
-                        )
-                        break
-                    CRAGWorker.isBusy =True
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "CRAGWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(id = param,mId = message.get("messageId"), data = message.get("data", {}))
-                
-                # ADD THIS LINE: Allow other async tasks to run
-                await asyncio.sleep(0.01)
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
-
     def sendToOtherWorker(self, messageId,destination, data: dict = None) -> None:
       sendMessage(
           conn=CRAGWorker.conn,
@@ -257,14 +244,14 @@ class CRAGWorker(Worker):
         return text
 
     def tokenizingText(self, text): 
-        text = word_tokenize(text)
+        text = wordTokenize(text)
         return text 
     
     def normalize_text(self, text, slang_dict):
         # Tokenize the text
         # print(text)
         # print(slang_dict)
-        tokens = word_tokenize(text)
+        tokens = wordTokenize(text)
         
         # Normalize each token using the slang dictionary
         normalized_tokens = [slang_dict.get(token, token) for token in tokens]
@@ -330,7 +317,7 @@ class CRAGWorker(Worker):
       page_content = [doc.page_content for doc in documents]
       result_retrieve = {"documents": page_content, "number_of_documents": len(page_content)}
       self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Retrieval",
@@ -365,11 +352,8 @@ class CRAGWorker(Worker):
         # print("===DOCUMENTS TO BE GRADED===")
         # print(documents)
         result_grade = []
-        for d in documents:
-            score = self.retrieval_grader.invoke(
-                {"question": question, "document": d.page_content}
-            )
-            grade = score.final_classification
+        grades = self._grade(question, [d.page_content for d in documents])
+        for d, grade in zip(documents, grades):
             if grade == "Benar":
                 # print("---GRADE: DOCUMENT BENAR---")
                 # print(d.page_content)
@@ -396,7 +380,7 @@ class CRAGWorker(Worker):
         # print(web_search)
         # print(grade)
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Retrieval Evaluation",
@@ -407,6 +391,61 @@ class CRAGWorker(Worker):
         )
         return {"documents": filtered_docs, "question": question, "web_search": web_search,"grade": grade_list}
 
+    def _grade(self, question, texts):
+        """final_classification of each text for question, in the order of texts, as Benar, Salah or Ambigu."""
+        if not texts:
+            return []
+        if self.grading_mode == "batched":
+            grades = self._grade_batched(question, texts)
+        else:
+            grades = self._grade_each(question, texts)
+        # whichever path graded it, " benar" is Benar. Anything else stays as
+        # the model wrote it and is taken as Ambigu by the callers
+        return [GRADES.get(grade.strip().lower(), grade.strip()) for grade in grades]
+
+    def _grade_each(self, question, texts):
+        """A request per text, grading_concurrency of them at once."""
+        scores = self.retrieval_grader.batch(
+            [{"question": question, "document": text} for text in texts],
+            config={"max_concurrency": self.grading_concurrency},
+        )
+        return [score.final_classification for score in scores]
+
+    def _grading_batches(self, texts):
+        """Indices of texts, split into requests of at most grading_batch_size texts and grading_batch_tokens tokens."""
+        batches, tokens = [[]], 0
+        for i, text in enumerate(texts):
+            # about four characters per token like the gateway's estimate, plus the number of the document
+            cost = len(text) // 4 + 8
+            if batches[-1] and (len(batches[-1]) >= self.grading_batch_size or tokens + cost > self.grading_batch_tokens):
+                batches.append([])
+                tokens = 0
+            batches[-1].append(i)
+            tokens += cost
+        return batches
+
+    def _grade_batched(self, question, texts):
+        """Several texts per request. Texts a request failed or left without a grade are graded one by one."""
+        batches = self._grading_batches(texts)
+        results = self.batch_grader.batch(
+            [{"question": question, "documents": number_documents([texts[i] for i in batch])} for batch in batches],
+            config={"max_concurrency": self.grading_concurrency},
+            return_exceptions=True,
+        )
+        grades = [None] * len(texts)
+        for batch, result in zip(batches, results):
+            if result is None or isinstance(result, Exception):
+                log(f"Batched grading of {len(batch)} documents failed, grading them one by one: {result}", "warn")
+                continue
+            for grade in result.classifications:
+                if 1 <= grade.index <= len(batch):
+                    grades[batch[grade.index - 1]] = grade.final_classification
+        missing = [i for i, grade in enumerate(grades) if grade is None]
+        if missing:
+            for i, grade in zip(missing, self._grade_each(question, [texts[i] for i in missing])):
+                grades[i] = grade
+        return grades
+
     def transform_query(self, state):
         """
         Transform the query to produce a better question.
@@ -430,7 +469,7 @@ class CRAGWorker(Worker):
         # print(question)
 
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Keyword Extraction",
@@ -483,7 +522,7 @@ class CRAGWorker(Worker):
         # print(question)
         # print(key_word)
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Knowledge Searching",
@@ -508,26 +547,27 @@ class CRAGWorker(Worker):
         key_word = state["key_word"]
 
 
+        started = time.perf_counter()
         # decompose
-        
+        # Split dokumen menjadi potongan-potongan kecil 
+        strips = self.text_splitter.split_documents(documents)
         decomposed_docs = []
-        for d in documents:
-            # Split dokumen menjadi potongan-potongan kecil 
-            text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-                chunk_size=256, chunk_overlap=0
-            )
-            doc_splits = text_splitter.split_documents([d])
-            decomposed_docs.extend(doc_splits)
+        seen = set()
+        for d in strips:
+            # near-identical web results share strips, each is graded and recomposed once
+            digest = hashlib.sha256(d.page_content.encode()).digest()
+            if digest not in seen:
+                seen.add(digest)
+                decomposed_docs.append(d)
         # print("===DECOMPOSED DOCUMENTS===")
         # print(decomposed_docs)
         # filter
         filtered_docs = []
         result_kl = []
-        for d in decomposed_docs:
-            score = self.retrieval_grader.invoke(
-                {"question": question, "document": d.page_content}
-            )
-            grade = score.final_classification
+        grading_started = time.perf_counter()
+        grades = self._grade(question, [d.page_content for d in decomposed_docs])
+        grading = time.perf_counter() - grading_started
+        for d, grade in zip(decomposed_docs, grades):
             if grade == "Benar":
                 # print("---GRADE: DOCUMENT BENAR---")
                 # print(d.page_content)
@@ -554,8 +594,18 @@ class CRAGWorker(Worker):
         # print(documents)
         # print(question)
         # print(key_word)
+        total = time.perf_counter() - started
+        # seconds, grading is spent concurrently so per_strip is its share of each strip
+        timing = {
+            "total": round(total, 3),
+            "grading": round(grading, 3),
+            "per_strip": round(grading / len(decomposed_docs), 3) if decomposed_docs else 0,
+            "strips": len(decomposed_docs),
+            "duplicates": len(strips) - len(decomposed_docs),
+        }
+        log(f"Knowledge refinement of {timing['strips']} strips ({timing['duplicates']} duplicates) took {total:.2f}s, {timing['per_strip']:.3f}s per strip", "info")
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Knowledge Refinement",
@@ -563,7 +613,8 @@ class CRAGWorker(Worker):
                 "output": {
                     "Decompose": [doc.page_content for doc in decomposed_docs],
                     "Filter": result_kl,
-                    "Recompose": [doc.page_content for doc in filtered_docs]
+                    "Recompose": [doc.page_content for doc in filtered_docs],
+                    "Timing": timing,
                 }
             },
             messageId=(str(uuid4()))
@@ -606,7 +657,7 @@ class CRAGWorker(Worker):
         # print(generation)
 
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Generation",
@@ -656,7 +707,7 @@ class CRAGWorker(Worker):
         text = self.extract_chain.invoke(prompt_vars)
         # print(text)
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Claim Detection",
@@ -679,7 +730,7 @@ class CRAGWorker(Worker):
         serialized_evidence = [{"content": doc.page_content, "source": doc.metadata['source']} for doc in evidence]
 
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Evidence Retrieval",
@@ -707,7 +758,7 @@ class CRAGWorker(Worker):
         text = self.skeptic_chain.invoke(prompt_vars)
         # print(text)
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Skeptic Evaluation",
@@ -741,7 +792,7 @@ class CRAGWorker(Worker):
         
         text = self.trust_chain.invoke(prompt_vars)
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Trust Evaluation",
@@ -789,7 +840,7 @@ class CRAGWorker(Worker):
         text = self.leader_chain.invoke(prompt_vars)
         # print(text)
         self.sendToOtherWorker(
-            destination=[f"DatabaseInteractionWorker/updateProgress/{self.id}"],
+            destination=[f"DatabaseInteractionWorker/updateProgress/{state['chat_id']}"],
             data={
                 "process_name": self.process_name,
                 "sub_process_name": "Leader Evaluation",
@@ -950,7 +1001,6 @@ class CRAGWorker(Worker):
         Replace this with your actual worker methods.
         """
         # print(data['prompt'])
-        self.id = id
         self.sendToOtherWorker(
             destination=[f"DatabaseInteractionWorker/createNewProgress/{id}"],
             data={
@@ -963,10 +1013,12 @@ class CRAGWorker(Worker):
         # return 
 
         # Run
-        inputs = {"question": data['prompt']}
+        inputs = {"question": data['prompt'], "chat_id": id}
         for output in self.app.stream(inputs):
             for key, value in output.items():
                 pass
+            # between two nodes, a cancelled or timed out chat stops calling the LLM
+            checkCancelled()
         final_response = value["generation"]
        
 
@@ -981,7 +1033,7 @@ class CRAGWorker(Worker):
         )
         
         self.sendToOtherWorker(
-            destination=[f"LogicalFallacyResponseWorker/removeLFResponse/"],
+            destination=[stage("remove_lf_response")],
             data={
                 "chat_id":id,
                 "response": final_response,
@@ -992,17 +1044,18 @@ class CRAGWorker(Worker):
         input_evaluasi = {
             "claim": value["generation"],
             "evidence": value["documents"],
-            "question": value["question"]
+            "question": value["question"],
+            "chat_id": id,
         }
 
         for output in self.app_evaluasi.stream(input_evaluasi):
             for key, value in output.items():
                 pass
+            checkCancelled()
                 # Node
         if value['claim']:
 
             log(f"CRAGWorker eval completed successfully. chat_id: {id}", "success")
-            CRAGWorker.isBusy = False
 
 def main(conn: Connection, config: dict):
     worker = CRAGWorker()
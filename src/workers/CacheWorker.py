@@ -18,7 +18,7 @@ class CacheWorker(Worker):
     #################
     # dont edit this part
     ################
-    isBusy: bool = False
+    handler_args: dict = {"id": "id", "data": "data"}
     redisInstance: redis.Redis
     prefixKey: str = "CACHE_CHATBOT_"
     conn: Connection
@@ -60,87 +60,6 @@ class CacheWorker(Worker):
         # Start the async tasks
         asyncio.run(self.listen_task())
 
-    async def listen_task(self):
-        print("CacheWorker is listening for messages...")
-        while True:
-            try:
-                # Change poll(1) to poll(0.1) to reduce blocking time
-                if CacheWorker.conn.poll(0.1):  # Shorter timeout
-                    message = self.conn.recv()
-                    if self.isBusy:
-                        print("CacheWorker is busy, ignoring message.")
-                        self.sendToOtherWorker(
-                            messageId=message.get("messageId"),
-                            destination=message.get("destination", []),
-                            data=message.get("data", {}),
-                            status="failed",
-                            reason="SERVER_BUSY"
-                        )
-                        continue
-                    
-                    self.isBusy = True
-                    
-                    try:
-                        dest = [
-                            d
-                            for d in message["destination"]
-                            if d.split("/", 1)[0] == "CacheWorker"
-                        ]
-                        
-                        if not dest:
-                            log("No valid destination found for CacheWorker", 'warning')
-                            continue
-                            
-                        destSplited = dest[0].split('/')
-                        if len(destSplited) < 2:
-                            log("Invalid destination format", 'error')
-                            continue
-                            
-                        method = destSplited[1]
-                        param = destSplited[2] if len(destSplited) > 2 else None
-                        
-                        instance_method = getattr(self, method, None)
-                        if not instance_method:
-                            log(f"Method {method} not found", 'error')
-                            continue
-                            
-                        # Call the method with appropriate parameters
-                        if param:
-                            result = instance_method(id=param, data=message.get("data", {}))
-                        else:
-                            result = instance_method(data=message.get("data", {}))
-                            
-                        sendMessage(
-                            conn=self.conn, 
-                            status="completed",
-                            destination=result["destination"],
-                            messageId=message["messageId"],
-                            data=result.get('data', []),
-                        )
-                        
-                    except Exception as e:
-                        log(f"Error processing message: {e}", 'error')
-                        traceback.print_exc()
-                        sendMessage(
-                            conn=self.conn, 
-                            status="failed",
-                            destination=message.get("destination", []),
-                            messageId=message.get("messageId"),
-                            data={"error": str(e)},
-                        )
-                    finally:
-                        self.isBusy = False
-          
-            except EOFError:
-                log("Connection closed by supervisor", 'error')
-                break
-            except Exception as e:
-                traceback.print_exc()
-                print(e)
-                log(f"Message loop error: {e}", 'error')
-                break
-            await asyncio.sleep(0.1)  # Sleep to prevent busy-waiting
-
     def sendToOtherWorker(self, messageId: str, destination: list, data: dict, status: str, reason: str = ""):
         """Helper method to send messages to other workers"""
         try:
@@ -154,6 +73,13 @@ class CacheWorker(Worker):
         except Exception as e:
             log(f"Error sending message to other worker: {e}", 'error')
 
+    def _failure_reply(self, message: dict, error: Exception) -> dict:
+        # a handler that raised is answered as failed, to where the message was
+        # going. That is back here, so a failed reply failing again is only logged
+        if message.get("status") == "failed":
+            return None
+        return {"destination": message.get("destination", []), "data": {"error": str(error)}}
+
     #########################################
     # Cache Methods
     #########################################
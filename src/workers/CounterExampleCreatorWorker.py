@@ -7,7 +7,8 @@ import time
 from utils.loadPromptTemplate import load_prompt_template
 from  utils.log import log 
 from utils.handleMessage import sendMessage, convertMessage
-from openai import AzureOpenAI
+from utils.routeTable import stage
+from utils.llmGateway import azureClient
 import json
 from .Worker import Worker
 from prompt.counterexample_interpretation import prompt_interpretation_template
@@ -19,6 +20,7 @@ class CounterExampleCreatorWorker(Worker):
     route_base = "/"
     conn:Connection
     requests: dict = {}
+    durable_keys: bool = True
     def __init__(self):
         # we'll assign these in run()
         self._port: int = None
@@ -32,7 +34,7 @@ class CounterExampleCreatorWorker(Worker):
         #### add your worker initialization code here
         
         
-        self.client = AzureOpenAI(
+        self.client = azureClient(
             api_key= config["azure_openai_api_key"],
             api_version= config["azure_openai_api_version"],
             azure_endpoint= config["azure_openai_endpoint"]
@@ -46,29 +48,6 @@ class CounterExampleCreatorWorker(Worker):
         # start background threads *before* blocking server
 
         asyncio.run(self.listen_task())
-    async def listen_task(self):
-        while True:
-            try:
-                if CounterExampleCreatorWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    message = self.conn.recv()
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "CounterExampleCreatorWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(message)
-                    await asyncio.sleep(0.1)  # Add a small delay to prevent busy-waiting
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
-
     def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
       sendMessage(
           conn=CounterExampleCreatorWorker.conn,
@@ -187,7 +166,7 @@ class CounterExampleCreatorWorker(Worker):
                         )
                 self.sendToOtherWorker(
                         messageId=message.get("messageId"),
-                        destination=["LogicalFallacyClassificationWorker/prepare_classification/"],
+                        destination=[stage("classification")],
                         data=message['data']
                         )
 
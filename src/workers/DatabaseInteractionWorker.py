@@ -9,6 +9,7 @@ import traceback
 import asyncio
 from utils.log import log
 from utils.handleMessage import sendMessage
+from utils.tweetBatch import isAvailable as isArrowAvailable, isBatch, toTweetBatch, TWEET_PROJECTION
 import time
 
 
@@ -20,7 +21,9 @@ class DatabaseInteractionWorker(Worker):
   # dont edit this part
   ################
   _instanceId: str    
-  _isBusy: bool = False
+  handler_args: dict = {"id": "id", "data": "data"}
+  # progress of one chat is read-modify-write, keep its updates in order
+  ordered: bool = True
   _client: MongoClient 
   _db_name: str 
   conn: Connection
@@ -57,53 +60,10 @@ class DatabaseInteractionWorker(Worker):
                 # Start the async tasks
     asyncio.run(run_background_tasks())
 
-  
-  async def listen_task(self):
-      print("DatabaseInteractionWorker is listening for messages...")
-      while True:
-        try:
-        # Change poll(1) to poll(0.1) to reduce blocking time
-          if DatabaseInteractionWorker.conn.poll(0.1):  # Shorter timeout
-            message = self.conn.recv()
-            if(self._isBusy):
-                print("DatabaseInteractionWorker is busy, ignoring message.")
-                self.sendToOtherWorker(
-                    messageId=message.get("messageId"),
-                    destination=message.get("destination", []),
-                    data=message.get("data", {}),
-                    status="failed",
-                    reason="SERVER_BUSY"
-                )
-                continue
-            self._isBusy =True
-            dest = [
-                d
-                for d in message["destination"]
-                if d.split("/", 1)[0] == "DatabaseInteractionWorker"
-            ]
-            destSplited = dest[0].split('/')
-            method = destSplited[1]
-            param= destSplited[2]
-            instance_method = getattr(self,method)
-            result = instance_method(id = param, data = message.get("data", {}))
-            sendMessage(
-                conn=self.conn, 
-                status="completed",
-                destination=result["destination"],
-                messageId=message["messageId"],
-                data=convertObjectIdToStr(result.get('data', [])),
-            )
-            self._isBusy = False
-      
-        except EOFError:
-            log("Connection closed by supervisor",'error')
-            break
-        except Exception as e:
-            traceback.print_exc()
-            print(e)
-            log(f"Message loop error: {e}",'error')
-            break
-        await asyncio.sleep(0.1)  # Sleep to prevent busy-waiting
+  def _encode_reply(self, data):
+    if isBatch(data):
+      return data
+    return convertObjectIdToStr(data)
   
   #########################################
   # Methods for Database Interaction
@@ -118,11 +78,13 @@ class DatabaseInteractionWorker(Worker):
       try:
         project_id = id
         print(f"Fetching tweets for project_id: {project_id}")
-        cursor = self._dbTweets['documents'].find({
-          "projectId": project_id,
-        })
-        self._isBusy = False
-        return {"data": list(cursor), "destination": [
+        if isArrowAvailable():
+          # only the columns the consumers read, as one arrow batch
+          cursor = self._dbTweets['documents'].find({"projectId": project_id}, TWEET_PROJECTION)
+          tweets = toTweetBatch(cursor)
+        else:
+          tweets = list(self._dbTweets['documents'].find({"projectId": project_id}))
+        return {"data": tweets, "destination": [
           f"VectorWorker/createVector/{id}",
           f"PromptRecommendationWorker/onTweetComing/{id}"
           ]}
@@ -131,13 +93,9 @@ class DatabaseInteractionWorker(Worker):
         log(f"Error in getTweets: {e}", "error")
   
   def getData(self,id):
-    if not self._isBusy:
-      self._isBusy =True
-      collection= self._db['mycollection']
-      data = list(collection.find({"project_id":id}))
-      
-      self._isBusy= False
-      return {"data":data,"destination":["GraphQLWorker/onProcessed"]}
+    collection= self._db['mycollection']
+    data = list(collection.find({"project_id":id}))
+    return {"data":data,"destination":["GraphQLWorker/onProcessed"]}
   def createNewHistory(self,id,data):
     created = self._db['history'].insert_one({
       "process": [],
@@ -0,0 +1,117 @@
+import asyncio
+import functools
+import importlib
+import traceback
+from multiprocessing.connection import Connection
+
+from utils.log import log
+from utils.handleMessage import sendMessage, useLocalRoutes, runningStages
+from utils.routeTable import compileRoutes, parseDestination
+from utils.cancellation import Cancelled, checkCancelled
+from .Worker import Worker
+
+#########
+# Several worker types in one process (config/pipeline.py FusedWorkers).
+# Each member is set up by its own run(), then the host listens for all of
+# them: the supervisor routes the members' destinations to the host, and
+# what a member sends to another member is run right after it on the same
+# thread, without the supervisor hop or a copy of the data. A chat going
+# through the logical fallacy loop (FOL -> SMT -> counterexample ->
+# classification -> modification, up to eval_iteration times) is one
+# handler call here, a state machine stepping from stage to stage.
+#########
+
+class FusedWorker(Worker):
+    def __init__(self, host: str):
+        self._host = host
+        self._members: dict = {}
+        # {worker type: {method: (instance, handler, is_coroutine)}} of the members, unwrapped
+        self._stages: dict = {}
+        self._loop = None
+
+    def run(self, conn: Connection, config: dict):
+        FusedWorker.conn = conn
+        for member_name, member_config in config["members"].items():
+            module = importlib.import_module(f"workers.{member_name}")
+            member = getattr(module, member_name)()
+            # the member only initializes, its messages are read by the host
+            member.listen_task = self._member_ready
+            member.run(conn, member_config)
+            self._members[member_name] = member
+        # one journal for the host, kept if any member's stages are too expensive to run twice
+        self.durable_keys = any(member.durable_keys for member in self._members.values())
+        useLocalRoutes(self._members, self._deliver_local)
+        log(f"{self._host} running {', '.join(self._members)}", "info")
+        asyncio.run(self.listen_task())
+
+    async def _member_ready(self) -> None:
+        return None
+
+    async def listen_task(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        await super().listen_task()
+
+    def _name(self) -> str:
+        return self._host
+
+    def _compile_routes(self) -> dict:
+        self._stages = {name: compileRoutes(member, name) for name, member in self._members.items()}
+        return {
+            name: {
+                # coroutine handlers are left to the event loop, their sends go through the inbox
+                method: (instance, handler if is_coroutine else functools.partial(self._run_stages, handler), is_coroutine)
+                for method, (instance, handler, is_coroutine) in stages.items()
+            }
+            for name, stages in self._stages.items()
+        }
+
+    def _run_stages(self, handler, **kwargs):
+        """Run handler, then every stage it hands work to in this process, until the chain leaves it."""
+        with runningStages() as pending:
+            result = handler(**kwargs)
+            while pending:
+                # the same checks the message would have met in the inbox
+                checkCancelled()
+                self._run_stage(pending.popleft())
+        return result
+
+    def _run_stage(self, message: dict) -> None:
+        # collected messages have the one local destination
+        worker, method, param = parseDestination(message["destination"][0])
+        entry = self._stages.get(worker, {}).get(method)
+        if entry is None:
+            log(f"{self._name()} has no method {method} of {worker}", 'error')
+            return
+        instance, handler, is_coroutine = entry
+        if is_coroutine:
+            self._deliver_local(message)
+            return
+        try:
+            result = handler(**instance._handler_kwargs(param, message))
+            if isinstance(result, dict) and "destination" in result:
+                sendMessage(
+                    conn=self.conn,
+                    status="completed",
+                    destination=result["destination"],
+                    messageId=message.get("messageId"),
+                    data=instance._encode_reply(result.get("data", [])),
+                )
+        except Cancelled:
+            raise
+        except Exception as e:
+            # one stage failing ends its branch, as it would in its own process
+            traceback.print_exc()
+            log(f"{self._name()} failed to process {method}: {e}", 'error')
+
+    def _deliver_local(self, message: dict) -> None:
+        # called from the handler threads. Like a peer message it owes the supervisor no credit
+        self._loop.call_soon_threadsafe(self._enqueue_local, message)
+
+    def _enqueue_local(self, message: dict) -> None:
+        self._inbox.append((message, True), message.get("priority"), message.get("project"))
+        self._inbox_ready.set()
+
+
+def main(conn: Connection, config: dict):
+    worker = FusedWorker(config["host"])
+    worker.run(conn, config)
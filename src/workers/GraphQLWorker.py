@@ -6,12 +6,15 @@ import asyncio
 import time
 import json
 import utils.log as log
-from utils.handleMessage import sendMessage, convertMessage
+from utils.handleMessage import sendMessage, sendCancel, convertMessage
+from utils.priority import useDefaultPriority
+from utils.quota import QuotaExceeded
 from strawberry.flask.views import GraphQLView
 from schemas.schema import schema
 import strawberry
 from schemas.queries import Query
 from schemas.mutations import Mutation
+from .Worker import Worker
 
 
 # Simple GraphQL-like implementation without external dependencies
@@ -33,8 +36,12 @@ class CustomGraphQLView(GraphQLView):
         cls.worker = worker
         # Create and return the Flask view function
         return super().as_view(name, **kwargs)
-class GraphQLWorker:
+class GraphQLWorker(Worker):
     requests: dict = {}
+    handler_args: dict = {"msg": "message"}
+    # seconds a resolver waits for a worker's answer, and a chat pipeline may run
+    request_timeout: float = 10
+    chat_timeout: float = 900
     def __init__(self):
         self.app = Flask(__name__)
         self.schema = strawberry.federation.Schema(
@@ -80,6 +87,9 @@ class GraphQLWorker:
             response_data = {"data": result.data}
             if result.errors:
                 response_data["errors"] = [{"message": str(error)} for error in result.errors]
+                if any(isinstance(error.original_error, QuotaExceeded) for error in result.errors):
+                    # the project is over its quota, tell the client to back off
+                    return jsonify(response_data), 429
                 
             return jsonify(response_data), 200
             
@@ -93,6 +103,8 @@ class GraphQLWorker:
         # assign here
         GraphQLWorker.conn = conn
         self._port = port
+        # someone is waiting on every request, served ahead of bulk ingestion
+        useDefaultPriority("interactive")
         def run_listen_task():
             asyncio.run(self.listen_task())
         threading.Thread(target=run_listen_task, daemon=True).start()
@@ -100,22 +112,6 @@ class GraphQLWorker:
         # Start Flask server
         self.app.run(debug=True, port=self._port, use_reloader=False, host="0.0.0.0")
     
-    async def listen_task(self):
-        while True:
-            try:
-                if GraphQLWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    print("[GRAPHQLWORKER]Listening for messages...")
-                    
-                    raw = GraphQLWorker.conn.recv()
-                    msg = convertMessage(raw)
-                    self.onProcessed(raw)
-                    await asyncio.sleep(0.1)  # Yield control to the event loop
-            except EOFError:
-                break
-            except Exception as e:
-                log.log(f"Listener error: {e}", 'error')
-                break
-    
     def onProcessed(self, msg: dict):
         """
         Called when a worker response comes in.
@@ -128,9 +124,10 @@ class GraphQLWorker:
         if not entry:
             return
         entry["response"] = msg.get("data")
+        entry["rejected"] = msg.get("status") == "failed" and msg.get("reason") == "QUOTA_EXCEEDED"
         entry["event"].set()
     
-    def sendToOtherWorker(self, destination: list, data: dict):
+    def sendToOtherWorker(self, destination: list, data: dict, project: str = None):
         """Send synchronous message to other worker and wait for response"""
         task_id = str(uuid.uuid4())
         evt = threading.Event()
@@ -146,26 +143,35 @@ class GraphQLWorker:
             messageId=task_id,
             status="processing",
             destination=destination,
-            data=data
+            data=data,
+            project=project,
+            deadline=time.time() + self.request_timeout,
+            cancelToken=task_id
         )
         
-        if not evt.wait(timeout=10):
-            # timeout
+        if not evt.wait(timeout=self.request_timeout):
+            # nobody reads the answer anymore, the workers can stop working on it
+            GraphQLWorker.requests.pop(task_id, None)
+            sendCancel(GraphQLWorker.conn, task_id)
             return {
                 "taskId": task_id,
                 "status": "timeout",
                 "result": None
             }
         
+        entry = GraphQLWorker.requests.pop(task_id)
+        if entry.get("rejected"):
+            # surfaces as a GraphQL error, see utils/quota.py
+            raise QuotaExceeded(entry["response"])
         # success
-        result = GraphQLWorker.requests.pop(task_id)["response"]
+        result = entry["response"]
         return {
             "taskId": task_id,
             "status": "completed",
             "result": result
         }
     
-    def send_message_async(self, destination: list, data: dict):
+    def send_message_async(self, destination: list, data: dict, project: str = None):
         """Send asynchronous message to other worker (fire and forget)"""
         task_id = str(uuid.uuid4())
         
@@ -174,9 +180,12 @@ class GraphQLWorker:
             messageId=task_id,
             status="processing",
             destination=destination,
-            data=data
+            data=data,
+            project=project
         )
 
 def main(conn: Connection, config: dict):
     worker = GraphQLWorker()
+    GraphQLWorker.request_timeout = config.get("request_timeout", GraphQLWorker.request_timeout)
+    GraphQLWorker.chat_timeout = config.get("chat_timeout", GraphQLWorker.chat_timeout)
     worker.run(conn, config.get("port", 8000))
\ No newline at end of file
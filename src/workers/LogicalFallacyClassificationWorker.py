@@ -7,7 +7,8 @@ import uuid
 import time
 from  utils.log import log 
 from utils.handleMessage import sendMessage, convertMessage
-from openai import AzureOpenAI
+from utils.routeTable import stage
+from utils.llmGateway import azureClient
 from prompt.logical_fallacy_classification import prompt_klasifikasi_template
 
 import pandas as pd
@@ -21,6 +22,7 @@ class LogicalFallacyClassificationWorker(Worker):
     route_base = "/"
     conn:Connection
     requests: dict = {}
+    durable_keys: bool = True
     def __init__(self):
         # we'll assign these in run()
         self._port: int = None
@@ -32,7 +34,7 @@ class LogicalFallacyClassificationWorker(Worker):
         LogicalFallacyClassificationWorker.conn = conn
 
         #### add your worker initialization code here
-        self.client = AzureOpenAI(
+        self.client = azureClient(
             api_key= config["azure_openai_api_key"],
             api_version= config["azure_openai_api_version"],
             azure_endpoint= config["azure_openai_endpoint"]
@@ -49,29 +51,6 @@ class LogicalFallacyClassificationWorker(Worker):
 
         asyncio.run(self.listen_task())
 
-    async def listen_task(self):
-        while True:
-            try:
-                if LogicalFallacyClassificationWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    message = self.conn.recv()
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "LogicalFallacyClassificationWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(message)
-                    await asyncio.sleep(0.1)  # Add a small delay to prevent busy-waiting
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
-
     def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
       sendMessage(
           conn=LogicalFallacyClassificationWorker.conn,
@@ -130,7 +109,7 @@ class LogicalFallacyClassificationWorker(Worker):
         message['data']['messages'] = messages
         self.sendToOtherWorker(
             messageId=message.get("messageId"),
-            destination=["LogicalFallacyPromptWorker/logical_fallacy_prompt_modification/" if message['data']['type'] == 'prompt' else "LogicalFallacyResponseWorker/logical_fallacy_response_modification/"], 
+            destination=[stage("prompt_modification" if message['data']['type'] == 'prompt' else "response_modification")], 
             data=message['data']
             )
 
@@ -11,11 +11,14 @@ import time
 import pandas as pd
 from  utils.log import log 
 from utils.handleMessage import sendMessage, convertMessage
+from utils.routeTable import stage
+from utils.llmGateway import azureClient
+from utils.llmCache import llmCache
+from utils.cancellation import Cancelled, checkCancelled
 from prompt.prompt_fol_extraction import prompt_fol_template
 from prompt.semantic_intent import prompt_intent_template
 from prompt.thematic_progression import prompt_progression_template
 from prompt.prompt_modification import prompt_modification_template
-from openai import AzureOpenAI
 from .Worker import Worker
 from prompt.semantic_intent_relation import prompt_intent_relationship_template
 
@@ -27,6 +30,7 @@ class LogicalFallacyPromptWorker(Worker):
     conn:Connection
     process_name: str = "Handling Logical Fallacy on User Prompt"
     requests: dict = {}
+    durable_keys: bool = True
     def __init__(self):
         # we'll assign these in run()
         self._port: int = None
@@ -38,7 +42,7 @@ class LogicalFallacyPromptWorker(Worker):
         LogicalFallacyPromptWorker.conn = conn
 
         #### add your worker initialization code here
-        self.client = AzureOpenAI(
+        self.client = azureClient(
             api_key= config["azure_openai_api_key"],
             api_version= config["azure_openai_api_version"],
             azure_endpoint= config["azure_openai_endpoint"]
@@ -54,30 +58,6 @@ class LogicalFallacyPromptWorker(Worker):
 
         asyncio.run(self.listen_task())
 
-    async def listen_task(self):
-        while True:
-            try:
-                if LogicalFallacyPromptWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    message = self.conn.recv()
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "LogicalFallacyPromptWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(message)
-                    await asyncio.sleep(0.1)  # Allow other tasks to run
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              traceback.print_exc()
-              log(f"Listener error: {e}",'error' )
-              break
-
     def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
       sendMessage(
           conn=LogicalFallacyPromptWorker.conn,
@@ -163,13 +143,15 @@ class LogicalFallacyPromptWorker(Worker):
         prompt_intent = prompt_intent_template.format(
             kalimat=prompt_user
         )
-        response = self.client.chat.completions.create(
-            model= self.model_name,
-            messages=[{
-                "role": "user",
-                "content": prompt_intent
-            }]
-        )
+        # the same prompt_user comes back every eval iteration
+        with llmCache("intent"):
+            response = self.client.chat.completions.create(
+                model= self.model_name,
+                messages=[{
+                    "role": "user",
+                    "content": prompt_intent
+                }]
+            )
 
         # Ambil hasil teks dari response
         semantic_intent = response.choices[0].message.content.strip()
@@ -180,13 +162,14 @@ class LogicalFallacyPromptWorker(Worker):
             kalimat=prompt_user
         )
         print("prompt user progression",prompt_progression)
-        response = self.client.chat.completions.create(
-            model= self.model_name,
-            messages=[{
-                "role": "user",
-                "content": prompt_progression
-            }]
-        )
+        with llmCache("thematic_progression"):
+            response = self.client.chat.completions.create(
+                model= self.model_name,
+                messages=[{
+                    "role": "user",
+                    "content": prompt_progression
+                }]
+            )
 
         # Ambil hasil teks dari response
         prompt_progression = response.choices[0].message.content.strip()
@@ -269,6 +252,8 @@ class LogicalFallacyPromptWorker(Worker):
                                     fallacy_type=fallacy_type)
                 return
             
+            # every eval iteration is several LLM calls, none of them for a cancelled chat
+            checkCancelled()
             intent = self.intent(prompt_user)
             if message['data']['is_eval'] == False:
                 print("prompt user di Anlysis Semantic Intent",prompt_user)
@@ -283,6 +268,7 @@ class LogicalFallacyPromptWorker(Worker):
                     messageId=(str(uuid.uuid4()))
                 )
             print(prompt_user)
+            checkCancelled()
             thematic_progression = self.thematic_progression(prompt_user)
             print(thematic_progression)
             if message['data']['is_eval'] == False:
@@ -346,6 +332,7 @@ class LogicalFallacyPromptWorker(Worker):
                 )
             
             
+            checkCancelled()
             modified_intent = self.intent(final_prompt_parsed)
             # print(modified_intent)
             intent_relation = self.intent_relationship(prompt_user = prompt_user if prompt_user is not None else prompt_user,
@@ -377,6 +364,8 @@ class LogicalFallacyPromptWorker(Worker):
                                               modified_intent=modified_intent,
                                               fallacy_type=fallacy_type)
         
+        except Cancelled:
+            raise
         except Exception as e:
             traceback.print_exc()
             print(e)
@@ -445,7 +434,7 @@ class LogicalFallacyPromptWorker(Worker):
         )        
         self.sendToOtherWorker(
             messageId= message['messageId'],
-            destination=[f"CRAGWorker/generateAnswer/{chat_id}"],
+            destination=[stage("generate_answer", chat_id)],
             data={
                 "projectId": "1",
                 "prompt": text
@@ -502,7 +491,7 @@ class LogicalFallacyPromptWorker(Worker):
         # print("kesimpulan", kesimpulan)
         self.sendToOtherWorker(
           messageId=message.get("messageId"),
-          destination=["SMTConverterWorker/fol_to_smtlib/"],
+          destination=[stage("fol_to_smt")],
           data={
               "fol":fol,
               "premis":premis,
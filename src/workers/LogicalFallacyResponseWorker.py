@@ -6,10 +6,11 @@ import uuid
 import time
 import re
 
-from openai import AzureOpenAI
 from utils.loadPromptTemplate import fix_json_if_incomplete, load_prompt_template, remove_json_text
 from  utils.log import log 
 from utils.handleMessage import sendMessage, convertMessage
+from utils.routeTable import stage
+from utils.llmGateway import azureClient
 # from utils.get_counter_example import get_counter_example
 import json
 from flask import Flask, request, jsonify
@@ -22,6 +23,7 @@ class LogicalFallacyResponseWorker(Worker):
     route_base = "/"
     conn:Connection
     requests: dict = {}
+    durable_keys: bool = True
     process_name ="Handling Logical Fallacy on Response Chatbot"
     def __init__(self):
         # we'll assign these in run()
@@ -38,7 +40,7 @@ class LogicalFallacyResponseWorker(Worker):
             
             
             print(config)
-            self.client = AzureOpenAI(
+            self.client = azureClient(
                 azure_endpoint = config['azure_openai_endpoint'],
                 api_key=config['azure_openai_api_key'],  
                 api_version=config['azure_openai_api_version']
@@ -52,29 +54,6 @@ class LogicalFallacyResponseWorker(Worker):
             log(f"Error in LogicalFallacyResponseWorker run method: {e}", 'error')
             traceback.print_exc()
 
-    async def listen_task(self):
-        while True:
-            try:
-                if LogicalFallacyResponseWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    message = self.conn.recv()
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "LogicalFallacyResponseWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(message)
-                    await asyncio.sleep(0.01)  # Allow other async tasks to run
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
-
     def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
       sendMessage(
           conn=LogicalFallacyResponseWorker.conn,
@@ -445,7 +424,7 @@ class LogicalFallacyResponseWorker(Worker):
                 log(f"LogicalFallacyResponseWorker processing completed successfully with No FOL. chat_id: {id}", "success")
                 return 
             self.sendToOtherWorker(
-                destination=["SMTConverterWorker/smt_file_converter_from_response/"],
+                destination=[stage("response_to_smt")],
                 messageId=message.get("messageId"),
                 data={
                     "fol":fol_transformation['fol'],
@@ -585,7 +564,7 @@ class LogicalFallacyResponseWorker(Worker):
             log(f"LogicalFallacyResponseWorker processing completed successfully with No FOL. chat_id: {id}", "success")
             return 
         self.sendToOtherWorker(
-            destination=["SMTConverterWorker/smt_file_converter_from_response/"],
+            destination=[stage("response_to_smt")],
             messageId=message.get("messageId"),
             data={
                 "fol":fol_transformation['fol'],
@@ -11,6 +11,9 @@ import traceback
 import pandas as pd
 from  utils.log import log 
 from utils.handleMessage import sendMessage, convertMessage
+from utils.tweetBatch import isBatch
+from utils.llmGateway import gatewayKwargs
+from utils.llmCache import CachedChain
 from langchain.prompts import PromptTemplate
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
@@ -26,11 +29,16 @@ class PromptRecommendationWorker(Worker):
     route_base = "/"
     conn:Connection
     requests: dict = {}
+    durable_keys: bool = True
+    handler_args: dict = {"id": "id", "data": "data", "message": "message"}
     def __init__(self):
         # we'll assign these in run()
         self._port: int = None
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
         self.requests: dict = {}
+        # messageId -> keyword/topics of a generatePrompt waiting for its tweets,
+        # getTweets answers with the messageId it was asked with
+        self.pendingProjects: dict = {}
         
     def run(self, conn: Connection, config:dict):
         # assign here
@@ -40,6 +48,7 @@ class PromptRecommendationWorker(Worker):
         
         # AZURE_OPENAI_MODEL_CHAT
         self.llm = AzureOpenAI(
+            **gatewayKwargs(),
             azure_endpoint=config['azure_openai_endpoint'],
             deployment_name=config['azure_openai_model'], 
             temperature=0,
@@ -47,6 +56,7 @@ class PromptRecommendationWorker(Worker):
             openai_api_version=config['azure_openai_api_version']
             )
         self.llmChat = AzureChatOpenAI(
+            **gatewayKwargs(),
             azure_endpoint=config['azure_openai_chat_endpoint'],
             deployment_name=config['azure_openai_model_chat'],
             openai_api_version=config['azure_openai_chat_api_version'],
@@ -67,29 +77,6 @@ class PromptRecommendationWorker(Worker):
         # start background threads *before* blocking server
         print("PromptRecommendationWorker started successfully.")
         asyncio.run(self.listen_task())
-    async def listen_task(self):
-        while True:
-            try:
-                if PromptRecommendationWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    message = self.conn.recv()
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "PromptRecommendationWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(id=param,data = message['data'],message=message)
-                    await asyncio.sleep(0.1)  # Sleep to prevent busy waiting
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
-
     def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
       sendMessage(
           conn=PromptRecommendationWorker.conn,
@@ -117,12 +104,13 @@ class PromptRecommendationWorker(Worker):
        
         prompt_template = PromptTemplate.from_template(self.format_context_prompt)
 
-        chain = prompt_template | self.llm | StrOutputParser() 
+        chain = CachedChain(prompt_template | self.llm | StrOutputParser(), "format_context")
         formatted_context = chain.invoke({"input": context})
         return formatted_context
     
     def preprocess_documents(self,tweets):
-        documents = pd.DataFrame(tweets)
+        # arrow batch from getTweets, or the older list of tweet dicts
+        documents = tweets.to_pandas() if isBatch(tweets) else pd.DataFrame(tweets)
         documents = documents[['full_text', 'tweet_url']]
         documents = documents.drop_duplicates(subset=['full_text'])
         documents['full_text'] = documents['full_text'].apply(self.normalize_text)
@@ -158,7 +146,7 @@ class PromptRecommendationWorker(Worker):
             ("human", self.get_category_prompt)
         ])
         
-        runnable = template | self.llm | StrOutputParser()
+        runnable = CachedChain(template | self.llm | StrOutputParser(), "prompt_category")
         
         category = runnable.invoke({
             "list_topics": context
@@ -203,6 +191,8 @@ class PromptRecommendationWorker(Worker):
         start_date = data['start_date']
         end_date = data['end_date']
         
+        # stored before asking for the tweets, the reply can come back on another thread
+        self.pendingProjects[m_id] = {"keyword": keyword, "topics": topics}
         self.sendToOtherWorker(
           messageId=m_id,
           destination=[f"DatabaseInteractionWorker/getTweets/{project_id}"],
@@ -212,18 +202,19 @@ class PromptRecommendationWorker(Worker):
                 "end_date": end_date
           }
           )
-        self.topics = topics
-        self.keyword = keyword
-        self.project_id = project_id
-
 
 
     def onTweetComing(self,id,message,data):
         try:
             print(f"[*] Received tweets for id: {id}")
+            pending = self.pendingProjects.pop(message['messageId'], None)
+            if pending is None:
+                log(f"No generatePrompt waiting for tweets of project {id} ({message['messageId']})", "warn")
+                return
+            keyword, topics = pending["keyword"], pending["topics"]
             
-            preprocessed_data = self.run_preprocessing(self.keyword,self.topics,tweets=data)
-            print(f"[*] Preprocessed data for keyword: {self.keyword} and topics: {self.topics}")
+            preprocessed_data = self.run_preprocessing(keyword,topics,tweets=data)
+            print(f"[*] Preprocessed data for keyword: {keyword} and topics: {topics}")
             category = self.get_category(preprocessed_data)
             print(f"[*] Category determined: {category}")
             prompts = self.get_optimal_prompt(category=category,context=preprocessed_data)
@@ -28,6 +28,7 @@ class RabbitMQWorker(Worker):
     produceQueue:str
     produceChannel:pika.adapters.blocking_connection.BlockingChannel
     produceCompensationQueue:str
+    handler_args: dict = {"queue_name": "id", "data": "data"}
     def __init__(self):
         # we'll assign these in run()
         self._port: int = None
@@ -74,29 +75,6 @@ class RabbitMQWorker(Worker):
           log(f"Failed to connect to RabbitMQ: {e}", "error")
           return
 
-    async def listen_task(self):
-        while True:
-            try:
-                if RabbitMQWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    message = self.conn.recv()
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "RabbitMQWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(param,message['data'])
-                    await asyncio.sleep(0.1)  # Yield control to the event loop
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
-
     def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
       sendMessage(
           conn=RabbitMQWorker.conn,
@@ -104,7 +82,9 @@ class RabbitMQWorker(Worker):
           messageId=messageId,
           status="completed",
           reason="Message sent to other worker successfully.",
-          data=data or {}
+          data=data or {},
+          # ingestion, chats are served first
+          priority="bulk"
       )
     ##########################################
     # add your worker methods here
@@ -7,8 +7,11 @@ import threading
 import uuid
 import asyncio
 import time
+import math
 from utils.log import log 
-from utils.handleMessage import sendMessage, convertMessage
+from utils.handleMessage import sendMessage, sendCancel, convertMessage
+from utils.routeTable import stage
+from utils.priority import useDefaultPriority
 from .Worker import Worker
 from flask_cors import CORS
 from urllib.parse import urlparse
@@ -24,6 +27,10 @@ class RestApiWorker(FlaskView, Worker):
     route_base = "/"
     conn:Connection
     requests: dict = {}
+    handler_args: dict = {"msg": "message"}
+    # seconds a route waits for a worker's answer, and a chat pipeline may run
+    request_timeout: float = 30
+    chat_timeout: float = 900
     def __init__(self):
         # we'll assign these in run()
         self._port: int = None
@@ -34,6 +41,8 @@ class RestApiWorker(FlaskView, Worker):
         # assign here
         RestApiWorker.conn = conn
         self._port = port
+        # someone is waiting on every request, served ahead of bulk ingestion
+        useDefaultPriority("interactive")
         def run_listen_task():
             asyncio.run(self.listen_task())
         threading.Thread(target=run_listen_task, daemon=True).start()
@@ -46,58 +55,21 @@ class RestApiWorker(FlaskView, Worker):
 
 
             
-    async def listen_task(self):
-        print("CRAGWorker is listening for messages...")
-        while True:
-            try:
-            # Change poll(1) to poll(0.1) to reduce blocking time
-                if RestApiWorker.conn.poll(1):  # Shorter timeout
-                    message = self.conn.recv()
-                    print('recived message')
-                    # if(self.isBusy):
-                    #     print("CRAGWorker is busy, ignoring message.")
-                    #     self.sendToOtherWorker(
-                    #         messageId=message.get("messageId")    ,
-                    #         destination=message.get("destination", []),
-                    #         data=message.get("data", {}),
-                    #         status="failed",
-                    #         reason="SERVER_BUSY"
-                    #     )
-                    #     continue
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "RestApiWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(message)
-                
-                # ADD THIS LINE: Allow other async tasks to run
-                await asyncio.sleep(0.01)
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
-
-    
-
     def onProcessed(self, msg):
         """
         Called when a worker response comes in.
         msg must contain 'messageId' and 'data'.
         """
         task_id = msg.get("messageId")
-        entry = RestApiWorker.requests[task_id]
+        entry = RestApiWorker.requests.get(task_id)
         if not entry:
+            if msg.get("reason") == "QUOTA_EXCEEDED":
+                log(f"Follow-up {task_id} rejected: {msg.get('data', {}).get('error')}", "warn")
             return
         entry["response"] = msg.get("data")
+        entry["rejected"] = msg.get("status") == "failed" and msg.get("reason") == "QUOTA_EXCEEDED"
         entry["event"].set()
-    def sendToOtherWorker(self, destination: str, data):
+    def sendToOtherWorker(self, destination: str, data, project: str = None):
       task_id = str(uuid.uuid4())
       evt = threading.Event()
       
@@ -112,24 +84,44 @@ class RestApiWorker(FlaskView, Worker):
           messageId=task_id,
           status="processing",
           destination=destination,
-          data=data
+          data=data,
+          project=project,
+          deadline=time.time() + self.request_timeout,
+          cancelToken=task_id
       )
-      if not evt.wait(timeout=30000):
-          # timeout
+      if not evt.wait(timeout=self.request_timeout):
+          # nobody reads the answer anymore, the workers can stop working on it
+          RestApiWorker.requests.pop(task_id, None)
+          sendCancel(RestApiWorker.conn, task_id)
           return {
               "taskId": task_id,
               "status": "timeout",
               "result": None
           }
       
+      entry = RestApiWorker.requests.pop(task_id)
+      if entry.get("rejected"):
+          return {
+              "taskId": task_id,
+              "status": "rejected",
+              "result": entry["response"]
+          }
       # success
-      result = RestApiWorker.requests.pop(task_id)["response"]
       return {
           "taskId": task_id,
           "status": "completed",
-          "result": result
+          "result": entry["response"]
       }
 
+    def _quotaExceeded(self, result: dict):
+      """429 response for a request the supervisor rejected, None otherwise."""
+      if result.get("status") != "rejected":
+          return None
+      rejection = result.get("result") or {}
+      response = jsonify({"error": rejection.get("error", "QUOTA_EXCEEDED"), "projectId": rejection.get("projectId")})
+      response.headers["Retry-After"] = str(max(1, math.ceil(rejection.get("retryAfter", 1))))
+      return response, 429
+
     ##########################################
     # FLASK ROUTES FUNCTIONS
     ##########################################
@@ -139,14 +131,22 @@ class RestApiWorker(FlaskView, Worker):
         
         result = self.sendToOtherWorker(
             destination=[f"CacheWorker/getByKey/{projectId}"],
-            data={"project_id": "{projectId}",}
+            data={"project_id": "{projectId}",},
+            project=projectId
         )
         print(result)
+        rejected = self._quotaExceeded(result)
+        if rejected:
+            return rejected
         if len(result["result"]) == 0:
             result = self.sendToOtherWorker(
                 destination=[f"DatabaseInteractionWorker/getPrompt/{projectId}"],
-                data={"key": projectId}
+                data={"key": projectId},
+                project=projectId
             )
+            rejected = self._quotaExceeded(result)
+            if rejected:
+                return rejected
             sendMessage(
                 conn=RestApiWorker.conn,
                 messageId=str(uuid.uuid4()),
@@ -155,7 +155,8 @@ class RestApiWorker(FlaskView, Worker):
                 data={
                     "key":f"{projectId}",
                     "value":result['result'],
-                }
+                },
+                project=projectId
             )
         return jsonify(result), 200
       
@@ -179,6 +180,15 @@ class RestApiWorker(FlaskView, Worker):
       else:
           return jsonify({"error": "Unknown error"}), 500
       
+    @route('/chat/<id>/cancel', methods=['POST'])
+    def cancelChat(self, id):
+      # the workers stop between stages, what they already wrote stays
+      sendCancel(RestApiWorker.conn, id)
+      return jsonify({
+          "status": "cancelling",
+          "data": {"chat_id": id}
+      }), 202
+
     @route('/', methods=['GET'])
     def getData(self):
     #   projectId = request.args.get('projectId')
@@ -200,19 +210,26 @@ class RestApiWorker(FlaskView, Worker):
             data={
                 "question": prompt,
                 "projectId": projectId
-            }
+            },
+            project=projectId
         )
+      rejected = self._quotaExceeded(message)
+      if rejected:
+          return rejected
       id = message.get("result", [{}])[0].get("_id", "unknown_id")
       print(f"Chat CRAG ID: {id}")
       sendMessage(
         conn=RestApiWorker.conn,
         messageId=id,
         status="complated",
-        destination=[f"CRAGWorker/generateAnswer/{id}"],
+        destination=[stage("generate_answer", id)],
         data={
                 "prompt": prompt,
                 "projectId": projectId
-            }
+            },
+        project=projectId,
+        deadline=time.time() + self.chat_timeout,
+        cancelToken=id
       )
       
       if message["status"] == "timeout":
@@ -243,20 +260,27 @@ class RestApiWorker(FlaskView, Worker):
                 data={
                     "question": prompt,
                     "projectId": projectId
-                }
+                },
+                project=projectId
             )
+        rejected = self._quotaExceeded(message)
+        if rejected:
+            return rejected
         id = message.get("result", [{}])[0].get("_id", "unknown_id")
         
         sendMessage(
         conn=RestApiWorker.conn,
         messageId=id,
         status="complated",
-        destination=[f"LogicalFallacyPromptWorker/removeLFPrompt/"],
+        destination=[stage("remove_lf_prompt")],
         data={
                 "prompt": prompt,
                 "id": id,
                 "projectId": projectId
-            }
+            },
+        project=projectId,
+        deadline=time.time() + self.chat_timeout,
+        cancelToken=id
         )
         return jsonify({
             "status":"success create new chat history, the progress updated every complated sub_step processed ",
@@ -281,19 +305,26 @@ class RestApiWorker(FlaskView, Worker):
             data={
                 "question": respons,
                 "projectId": projectId
-            }
+            },
+            project=projectId
         )
+        rejected = self._quotaExceeded(message)
+        if rejected:
+            return rejected
         id = message.get("result", [{}])[0].get("_id", "unknown_id")
 
         sendMessage(
         conn=RestApiWorker.conn,
         messageId=id,
         status="complated",
-            destination=["LogicalFallacyResponseWorker/removeLFResponse/"],
+            destination=[stage("remove_lf_response")],
             data={
                 "response":respons,
                 "chat_id": id
-            }
+            },
+            project=projectId,
+            deadline=time.time() + self.chat_timeout,
+            cancelToken=id
         )
         return jsonify({
             "status":"success create new chat history, the progress updated every complated sub_step processed ",
@@ -307,4 +338,6 @@ class RestApiWorker(FlaskView, Worker):
 def main(conn: Connection, config: dict):
     
     worker = RestApiWorker()
+    RestApiWorker.request_timeout = config.get("request_timeout", RestApiWorker.request_timeout)
+    RestApiWorker.chat_timeout = config.get("chat_timeout", RestApiWorker.chat_timeout)
     worker.run(conn, config.get("port", 5000))
@@ -14,7 +14,8 @@ import time
 from cvc5.utils.cvc import CVCGenerator
 from  utils.log import log 
 from utils.handleMessage import sendMessage, convertMessage
-from openai import AzureOpenAI
+from utils.routeTable import stage
+from utils.llmGateway import azureClient
 import json
 
 from .Worker import Worker
@@ -26,19 +27,26 @@ class SMTConverterWorker(Worker):
     route_base = "/"
     conn:Connection
     requests: dict = {}
+    durable_keys: bool = True
     def __init__(self):
         # we'll assign these in run()
         self._port: int = None
 
         self.requests: dict = {}
         
-    def run(self, conn: Connection, port: int):
+    def run(self, conn: Connection, config: dict):
         # assign here
         SMTConverterWorker.conn = conn
 
         #### add your worker initialization code here
         
         self.os_type = platform.system()
+        self.client = azureClient(
+            azure_endpoint=config["azure_openai_endpoint"],
+            api_key=config["azure_openai_api_key"],
+            api_version=config["azure_openai_api_version"]
+        )
+        self.model_name = config["azure_openai_deployment_name"]
         
         
         # log(f"SMTConverterWorker initialized on {self.os_type}", "info")
@@ -47,29 +55,6 @@ class SMTConverterWorker(Worker):
         # start background threads *before* blocking server
 
         asyncio.run(self.listen_task())
-    async def listen_task(self):
-        while True:
-            try:
-                if SMTConverterWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    message = self.conn.recv()
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "SMTConverterWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(message)
-                    await asyncio.sleep(0.1)  # Allow other tasks to run
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
-
     def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
       sendMessage(
           conn=SMTConverterWorker.conn,
@@ -308,14 +293,8 @@ class SMTConverterWorker(Worker):
                 }}
                 """
 
-                client = AzureOpenAI(
-                    azure_endpoint = "https://crag-skripsi.openai.azure.com/", 
-                    api_key="2MQNDFv4maWOJtsHOTV4J1grfhWkmfgIzwwX20OTX3aLs5eml1VTJQQJ99BEACYeBjFXJ3w3AAABACOGf0dD",  
-                    api_version="2025-01-01-preview"
-                    )
-
-                response = client.chat.completions.create(
-                    model="gpt-4.1", # model = "deployment_name".
+                response = self.client.chat.completions.create(
+                    model=self.model_name, # model = "deployment_name".
                     messages=[
                         {"role": "user", "content": prompt}
                     ]
@@ -347,7 +326,7 @@ class SMTConverterWorker(Worker):
                 message['data']['check_sat'] = "unknown"
                 self.sendToOtherWorker(
                     messageId=message.get("messageId"),
-                    destination=["CounterExampleCreatorWorker/counterexample_interpretation/"],
+                    destination=[stage("counterexample")],
                     data=message["data"])            
             # return f"Terjadi kesalahan: {e}"
 
@@ -424,7 +403,7 @@ class SMTConverterWorker(Worker):
             message['data']['check_sat'] = check_sat or "unknown"
             self.sendToOtherWorker(
                 messageId=message.get("messageId"),
-                destination=["CounterExampleCreatorWorker/counterexample_interpretation/"],
+                destination=[stage("counterexample")],
                 data=message["data"])
         except Exception as e:
             traceback.print_exc()
@@ -452,7 +431,7 @@ class SMTConverterWorker(Worker):
 
             self.sendToOtherWorker(
                 messageId=message.get("messageId"),
-                destination=["CounterExampleCreatorWorker/counterexample_interpretation/"],
+                destination=[stage("counterexample")],
                 data=message["data"])
             
 
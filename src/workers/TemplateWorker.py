@@ -1,4 +1,5 @@
 from multiprocessing.connection import Connection
+import asyncio
 import threading
 import uuid
 import time
@@ -33,7 +34,7 @@ class TemplateWorker(Worker):
         
         #### until this part
         # start background threads *before* blocking server
-        threading.Thread(target=self.listen_task, daemon=True).start()
+        threading.Thread(target=lambda: asyncio.run(self.listen_task()), daemon=True).start()
         threading.Thread(target=self.health_check, daemon=True).start()
 
         # asyncio.run(self.listen_task())
@@ -49,28 +50,6 @@ class TemplateWorker(Worker):
                 status="healthy"
             )
             time.sleep(10)
-    def listen_task(self):
-        while True:
-            try:
-                if TemplateWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    message = self.conn.recv()
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "TemplateWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(message)
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
-
     def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
       sendMessage(
           conn=TemplateWorker.conn,
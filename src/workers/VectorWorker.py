@@ -6,11 +6,11 @@ import uuid
 import time
 from  utils.log import log 
 from utils.handleMessage import sendMessage, convertMessage
+from utils.tweetBatch import tweetColumn
 from langchain.schema import Document
 
 import re
 import string
-from nltk.tokenize import word_tokenize
 from langchain_openai import AzureOpenAIEmbeddings
 import pandas as pd
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -19,9 +19,8 @@ from uuid import uuid4
 from pymongo import MongoClient
 
 import traceback
-import nltk
-# check if nltk data is downloaded, if not download it
-nltk.download('punkt_tab')
+from utils.nltkData import wordTokenize
+from utils.llmGateway import gatewayKwargs
 
 from .Worker import Worker
 
@@ -32,11 +31,13 @@ class VectorWorker(Worker):
     route_base = "/"
     conn:Connection
     requests: dict = {}
+    handler_args: dict = {"id": "id", "data": "data", "message": "message"}
     def __init__(self):
         # we'll assign these in run()
         self._port: int = None
 
         self.requests: dict = {}
+        self._slang_dict = None
         
     def run(self, conn: Connection, config: dict):
         # assign here
@@ -46,6 +47,7 @@ class VectorWorker(Worker):
         
         # print(config)
         self.embeddings = AzureOpenAIEmbeddings(
+            **gatewayKwargs(),
             azure_endpoint=config['azure_openai_endpoint'],
             azure_deployment=config['azure_openai_deployment_name_embedding'],
             openai_api_version=config['azure_openai_api_version'],
@@ -68,28 +70,6 @@ class VectorWorker(Worker):
         # threading.Thread(target=self.listen_task, daemon=True).start()
 
         asyncio.run(self.listen_task())
-    async def listen_task(self):
-        while True:
-            try:
-                if VectorWorker.conn.poll(1):  # Check for messages with 1 second timeout
-                    message = self.conn.recv()
-                    dest = [
-                        d
-                        for d in message["destination"]
-                        if d.split("/", 1)[0] == "VectorWorker"
-                    ]
-                    destSplited = dest[0].split('/')
-                    method = destSplited[1]
-                    param= destSplited[2]
-                    instance_method = getattr(self,method)
-                    instance_method(data=message['data'],id=param, message=message)
-                    await asyncio.sleep(0.1)  # Add a small sleep to prevent busy waiting
-            except EOFError:
-                break
-            except Exception as e:
-              print(e)
-              log(f"Listener error: {e}",'error' )
-              break
     def sendToOtherWorker(self, destination, messageId: str, data: dict = None) -> None:
       sendMessage(
           conn=VectorWorker.conn,
@@ -124,11 +104,11 @@ class VectorWorker(Worker):
         text = text.strip(' ') # remove characters space from both left and right text
         return text
     def tokenizingText(self,text): 
-        text = word_tokenize(text)
+        text = wordTokenize(text)
         return text
     def normalize_text(self,text, slang_dict):
         # Tokenize the text
-        tokens = word_tokenize(text)
+        tokens = wordTokenize(text)
         
         # Normalize each token using the slang dictionary
         normalized_tokens = [slang_dict.get(token, token) for token in tokens]
@@ -159,72 +139,38 @@ class VectorWorker(Worker):
           }
           )
         log("Test method called", "info")
-    def createVector(self,data,id,message):
-        try:
-            # print(message)
-            projectId = id
-            documents = data # {}
-            print("Creating vector for project:", projectId, "with size:", len(documents))
-            documents = [
-                {
-                    "full_text": doc.get("full_text", ""),
-                    "tweet_url": doc.get("tweet_url", "")
-                } for doc in documents if isinstance(doc, dict)
-            ]
-            
-            print("Number of documents to process:", len(documents))
-            # df['casefolded_text'] = df['full_text'].apply(casefoldingText)
-            
-            documents = [
-                {
-                    "full_text": self.casefoldingText(doc.get("full_text", "")),
-                    "tweet_url": doc.get("tweet_url", "")
-                } for doc in documents
-            ]
-            print("Casefolding completed. Number of documents:", len(documents))
-            # df['cleaned_text'] = df['casefolded_text'].apply(cleaningText)
-            documents = [
-                {
-                    "full_text": self.cleaningText(doc.get("full_text", "")),
-                    "tweet_url": doc.get("tweet_url", "")
-                } for doc in documents
-            ]
-            print("Cleaning completed. Number of documents:", len(documents))
+    def loadSlangDict(self):
+        if self._slang_dict is None:
             base_dir = os.path.dirname(os.path.abspath(__file__))  # path ke file ini
             path_slang = os.path.join(base_dir, "../../kamus/slang.xlsx")
             if not os.path.exists(path_slang):
                 print("slang not found, using default path")
             print("Loading slang dictionary from:", path_slang)
             df_slang = pd.read_excel(path_slang)
-            print("Slang dictionary loaded with", len(df_slang), "entries.")
-            slang_dict = dict(zip(df_slang['slang'], df_slang['formal']))
-            print("Slang dictionary created with", len(slang_dict), "entries.")
-            
-            # Apply normalization (this should happen before tokenization)
-            documents = [
-                {
-                    "full_text": self.normalize_text(doc.get("full_text", ""), slang_dict),
-                    "tweet_url": doc.get("tweet_url", "")
-                } for doc in documents
-            ]
-            print("Normalization completed. Number of documents:", len(documents))
-            
-            # Apply final casefolding
-            documents = [
-                {
-                    "full_text": self.casefoldingText(doc.get("full_text", "")),
-                    "tweet_url": doc.get("tweet_url", "")
-                } for doc in documents
-            ]
-            print("Final casefolding completed. Number of documents:", len(documents))
-            # Create documents for vector store (keep as strings, don't tokenize yet)
+            self._slang_dict = dict(zip(df_slang['slang'], df_slang['formal']))
+            print("Slang dictionary created with", len(self._slang_dict), "entries.")
+        return self._slang_dict
+    def createVector(self,data,id,message):
+        try:
+            # print(message)
+            projectId = id
+            # data is an arrow batch from getTweets, or the older list of tweet dicts
+            texts = tweetColumn(data, "full_text")
+            urls = tweetColumn(data, "tweet_url")
+            print("Creating vector for project:", projectId, "with size:", len(texts))
+            slang_dict = self.loadSlangDict()
+
+            # casefold, clean, normalise and casefold again in a single pass,
+            # straight into the documents for the vector store
             docs_list = [
                 Document(
-                    page_content=doc.get("full_text", ""),
+                    page_content=self.casefoldingText(
+                        self.normalize_text(self.cleaningText(self.casefoldingText(text)), slang_dict)
+                    ),
                     metadata={
-                        "source": doc.get("tweet_url", ""),
+                        "source": url,
                     }
-                ) for doc in documents if isinstance(doc, dict)
+                ) for text, url in zip(texts, urls)
             ]
             print("Documents created for vector store. Number of documents:", len(docs_list))
             
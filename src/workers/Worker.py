@@ -1,20 +1,339 @@
 from abc import ABC, abstractmethod
 import asyncio
+import contextlib
+import contextvars
+import functools
+import itertools
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection, Listener
+
+from utils.log import log
+from utils.handleMessage import sendMessage, recvMessage, sendReady, sendCredit, sendRelease, sendHeartbeat
+from utils.codec import decodeMessage
+from utils.sharedPayload import openPayload, closePayload
+from utils.tweetBatch import readBatch
+from utils.dispatcher import getRoutingKey
+from utils.wal import FinishedKeys
+from utils.peers import usePeerRoutes, serveListener
+from utils.priority import PriorityQueue, setCurrentPriority
+from utils.quota import setCurrentProject
+from utils.cancellation import Cancelled, cancel, stopReason, setCurrentRequest
+from utils.routeTable import parseDestination, compileRoutes
+from utils.llmCache import cacheStats
 
 class Worker(ABC):
+    conn: Connection
+    # how many messages the worker processes at once, advertised to the
+    # supervisor. Set per worker with "concurrency" in config/workerConfig.py
+    capacity: int = 1
+    # run messages with the same routing key (chat/project id) one at a time,
+    # in the order they arrived
+    ordered: bool = False
+    # handler argument -> where its value comes from. "id" is the parameter
+    # of the destination (Worker/method/<id>), "message" the whole message,
+    # anything else a field of the message ("data", "messageId", ...)
+    handler_args: dict = {"message": "message"}
+    # journal the idempotency keys of finished messages on disk, for workers
+    # whose handlers are too expensive to run again after a crash (LLM calls)
+    durable_keys: bool = False
+    # seconds between two heartbeats, set from SupervisorConfig["heartbeat"]
+    heartbeat_interval: float = 5
+    # Unix socket other workers send to directly, for the methods listed in
+    # SupervisorConfig["peer_routes"]. Set by the supervisor, None when unused
+    peer_address: str = None
+    peer_authkey: bytes = b""
+
     @abstractmethod
-    async def run(self) -> None:
+    def run(self) -> None:
         """
         Perform the worker’s main task.
         Should be overridden by subclasses.
         """
         raise NotImplementedError
 
-    @abstractmethod
     async def listen_task(self) -> None:
         """
         Listen for incoming tasks asynchronously.
-        Should be overridden by subclasses.
+        The pipe is registered with the event loop, so a message is picked
+        up as soon as it arrives instead of on the next poll. Up to capacity
+        messages are processed at once: coroutine handlers as tasks, the
+        others on a thread pool.
         """
-        raise NotImplementedError
+        loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.capacity, thread_name_prefix=self._name())
+        self._slots = asyncio.Semaphore(self.capacity)
+        self._key_locks: dict = {}
+        self._tasks: set = set()
+        self._finished = FinishedKeys(self._name() if self.durable_keys else None)
+        self._running: set = set()
+        self._current: dict = {}
+        self._task_ids = itertools.count()
+        # handler references resolved once, not a getattr per message
+        self._routes = self._compile_routes()
+        # received messages wait here for a slot, highest priority class first
+        self._inbox = PriorityQueue()
+        self._inbox_ready = asyncio.Event()
+        scheduler = asyncio.create_task(self._schedule())
+        listener = self._listen_peers(loop) if self.peer_address else None
+        sendReady(self.conn, self.capacity)
+        # sent from the event loop: a handler blocking the loop stops the
+        # heartbeats, one blocking a pool thread shows in their elapsed times
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            await self._read(self.conn)
+        except (EOFError, OSError):
+            log(f"{self._name()} connection closed by supervisor", 'error')
+        finally:
+            heartbeat.cancel()
+            scheduler.cancel()
+            if listener is not None:
+                listener.close()
+            self._executor.shutdown(wait=False)
+
+    async def _read(self, conn: Connection, peer: bool = False) -> None:
+        """Process every message arriving on conn, the supervisor pipe or a peer channel."""
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd = conn.fileno()
+        try:
+            loop.add_reader(fd, readable.set)
+        except (NotImplementedError, ValueError, OSError):
+            # the Proactor loop of Windows has no add_reader, nor its pipes a
+            # selectable fd: a thread of the loop waits on the pipe instead
+            fd = None
+        try:
+            while True:
+                if fd is None:
+                    # a bounded wait, the thread is not left behind when the task ends
+                    while not await loop.run_in_executor(None, conn.poll, 1.0):
+                        pass
+                else:
+                    await readable.wait()
+                    readable.clear()
+                while conn.poll():
+                    message = recvMessage(conn)
+                    if not peer and message.get("status") == "routes":
+                        usePeerRoutes(message.get("data", {}))
+                        continue
+                    if not peer and message.get("status") == "cancel":
+                        # running handlers see it at their next checkCancelled()
+                        cancel(message.get("data", {}).get("token"))
+                        continue
+                    self._inbox.append((message, peer), message.get("priority"), message.get("project"))
+                    self._inbox_ready.set()
+        finally:
+            if fd is not None:
+                loop.remove_reader(fd)
+
+    async def _schedule(self) -> None:
+        """Start the next message of the inbox whenever a slot is free."""
+        while True:
+            await self._slots.acquire()
+            while not self._inbox:
+                self._inbox_ready.clear()
+                await self._inbox_ready.wait()
+            message, peer = self._inbox.popleft()
+            task = asyncio.create_task(self._process(message, peer))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _listen_peers(self, loop) -> Listener:
+        if os.path.exists(self.peer_address):
+            # left over by a replica that crashed
+            os.unlink(self.peer_address)
+        # the authkey handshake is serveListener's, off the accepting thread
+        listener = Listener(self.peer_address, family="AF_UNIX")
+        serveListener(
+            listener, self.peer_authkey,
+            lambda conn: loop.call_soon_threadsafe(self._add_peer, conn),
+            f"{self._name()}-peers",
+        )
+        return listener
+
+    def _add_peer(self, conn: Connection) -> None:
+        async def session():
+            try:
+                await self._read(conn, peer=True)
+            except (EOFError, OSError):
+                pass
+            finally:
+                conn.close()
+
+        task = asyncio.create_task(session())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.time()
+            tasks = [
+                {"messageId": messageId, "method": method, "elapsed": round(now - started, 1)}
+                for messageId, method, started in self._current.values()
+            ]
+            try:
+                sendHeartbeat(self.conn, tasks, cacheStats())
+            except (EOFError, OSError):
+                return
+
+    async def _process(self, message: dict, peer: bool = False) -> None:
+        messageId = message.get("messageId")
+        key = message.get("idempotencyKey")
+        if key and (key in self._finished or key in self._running):
+            # a resend or a replay of something this worker already ran
+            log(f"{self._name()} skipping {messageId}, already processed", 'warn')
+            if not peer:
+                sendCredit(self.conn, messageId, key)
+            if message.get("payload"):
+                sendRelease(self.conn, messageId, message["payload"]["name"])
+            self._slots.release()
+            return
+        reason = stopReason(message)
+        if reason:
+            # waited in the inbox while its request was cancelled or ran out of time
+            log(f"{self._name()} dropping {messageId}: {reason}", 'warn')
+            if not peer:
+                sendCredit(self.conn, messageId, key)
+            if message.get("payload"):
+                sendRelease(self.conn, messageId, message["payload"]["name"])
+            self._slots.release()
+            return
+        handle = message.get("payload")
+        segment = view = None
+        if key:
+            self._running.add(key)
+        try:
+            if handle:
+                try:
+                    segment, view = openPayload(handle)
+                    # arrow batches are read in place, the segment stays mapped until the handler is done
+                    data = readBatch(view) if handle.get("format") == "arrow" else decodeMessage(view)
+                    message = {**message, "data": data}
+                    data = None
+                except Exception as e:
+                    log(f"{self._name()} could not read shared payload {handle['name']} of {messageId}: {e}", 'error')
+                    if not peer:
+                        sendCredit(self.conn, messageId, key)
+                    return
+            if self.ordered:
+                async with self._in_order(message):
+                    await self._dispatch(message, peer)
+            else:
+                await self._dispatch(message, peer)
+        finally:
+            # drop the last reference to data read from the segment before unmapping it
+            message = None
+            self._running.discard(key)
+            if segment is not None:
+                closePayload(segment, view)
+            if handle:
+                sendRelease(self.conn, messageId, handle["name"])
+            self._slots.release()
+
+    @contextlib.asynccontextmanager
+    async def _in_order(self, message: dict):
+        # asyncio.Lock wakes its waiters first in, first out
+        route = next((d for d in message.get("destination", []) if parseDestination(d)[0] in self._routes), "")
+        key = getRoutingKey(route, message)
+        entry = self._key_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._key_locks.pop(key, None)
+
+    def _name(self) -> str:
+        return type(self).__name__
+
+    def _compile_routes(self) -> dict:
+        """{worker type: {method: (instance, handler, is_coroutine)}} of what this process serves."""
+        return {self._name(): compileRoutes(self)}
+
+    def _route(self, message: dict):
+        """Return (method, param, handler entry) of the first destination addressed to this worker."""
+        for destination in message.get("destination", []):
+            worker, method, param = parseDestination(destination)
+            routes = self._routes.get(worker)
+            if routes is not None and method:
+                return method, param, routes.get(method)
+        return None
+
+    def _handler_kwargs(self, param: str, message: dict) -> dict:
+        values = {"data": {}, **message, "id": param, "message": message}
+        return {arg: values.get(source) for arg, source in self.handler_args.items()}
+
+    def _encode_reply(self, data):
+        return data
+
+    def _failure_reply(self, message: dict, error: Exception):
+        """{"destination", "data"} sent with status "failed" when a handler raises, None sends nothing."""
+        return None
 
+    async def _dispatch(self, message: dict, peer: bool = False) -> None:
+        route = self._route(message)
+        if route is None:
+            log(f"{self._name()} received a message not addressed to it: {message.get('messageId')}", 'warn')
+            if not peer:
+                sendCredit(self.conn, message.get("messageId"), message.get("idempotencyKey"))
+            return
+        method, param, entry = route
+        task_id = next(self._task_ids)
+        # what the handler sends keeps the priority class and project of this message
+        setCurrentPriority(message.get("priority"))
+        setCurrentProject(message.get("project"))
+        setCurrentRequest(message.get("deadline"), message.get("cancelToken"))
+        instance = self
+        try:
+            if entry is None:
+                log(f"{self._name()} has no method {method}", 'error')
+                return
+            instance, instance_method, is_coroutine = entry
+            kwargs = instance._handler_kwargs(param, message)
+            self._current[task_id] = (message.get("messageId"), method, time.time())
+            if is_coroutine:
+                result = await instance_method(**kwargs)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, contextvars.copy_context().run, functools.partial(instance_method, **kwargs)
+                )
+            # handlers returning {"destination", "data"} get it sent as the reply
+            if isinstance(result, dict) and "destination" in result:
+                sendMessage(
+                    conn=self.conn,
+                    status="completed",
+                    destination=result["destination"],
+                    messageId=message.get("messageId"),
+                    data=instance._encode_reply(result.get("data", [])),
+                )
+        except Cancelled as e:
+            log(f"{self._name()} stopped {method} of {message.get('messageId')}: {e}", 'warn')
+        except Exception as e:
+            traceback.print_exc()
+            log(f"{self._name()} failed to process {method}: {e}", 'error')
+            reply = instance._failure_reply(message, e)
+            if reply is not None:
+                try:
+                    sendMessage(
+                        conn=self.conn,
+                        status="failed",
+                        destination=reply["destination"],
+                        messageId=message.get("messageId"),
+                        data=reply.get("data", []),
+                    )
+                except (EOFError, OSError) as e:
+                    log(f"{self._name()} could not send the failure of {method}: {e}", 'error')
+        finally:
+            self._current.pop(task_id, None)
+            # recorded before the credit, which is what lets the supervisor forget the message
+            if message.get("idempotencyKey"):
+                self._finished.add(message["idempotencyKey"])
+            # peer messages never went through the supervisor's flow control
+            if not peer:
+                sendCredit(self.conn, message.get("messageId"), message.get("idempotencyKey"))